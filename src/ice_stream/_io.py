@@ -0,0 +1,21 @@
+"""Small file helpers shared by the modules writing local state and reports."""
+
+from __future__ import annotations
+
+import os
+
+
+def atomic_write(path: str, text: str) -> None:
+    """
+    Replace the file at *path* with *text*, creating its folder if needed.
+
+    The text goes to a temporary file first, which is synced and renamed over
+    *path*, so readers see either the old or the new content, never a torn file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
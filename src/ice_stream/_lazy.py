@@ -0,0 +1,47 @@
+"""Deferred imports for heavy dependencies.
+
+Importing xarray, pandas, zarr, icechunk or the clads backup stack costs
+hundreds of milliseconds, which adds up for cron driven runs on low-power
+field computers. Modules bind these dependencies with :func:`lazy_import`, and
+the import happens on first attribute access instead of at module load.
+"""
+
+from __future__ import annotations
+
+import importlib
+import sys
+import types
+from typing import Any
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy importing the real module on first attribute access."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __dir__(self) -> list[str]:
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Return *name* if it is already imported, otherwise a :class:`LazyModule`."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,277 @@
+"""Machine readable results of the upload benchmarks, compared against a baseline.
+
+:class:`BenchmarkRun` measures one run of an upload strategy: its wall time,
+the raw throughput, commits per second, the bytes and requests sent (counted by
+a :class:`~ice_stream.transfer.TransferStats`), the peak resident memory of the
+process and the size of the repository afterwards.
+
+:class:`BenchmarkResults` collects the runs of a session in one JSON file::
+
+    {"meta": {"python": "3.11.7", ...},
+     "results": {"incremental": {"wall_seconds": 12.3, "mb_per_s": 4.5, ...}}}
+
+:func:`compare` flags the metrics that got worse than in a baseline file by
+more than a relative threshold. ``ice-stream-bench-compare`` does the same from
+the command line and exits with status 1 on a regression::
+
+    ice-stream-bench-compare artifacts/benchmark_results.json baseline.json --threshold 0.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from typing import Any, Callable
+
+from loguru import logger
+
+from . import __version__
+from ._io import atomic_write
+from .transfer import TransferStats
+
+try:  # peak memory fallback, not available on every platform
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
+
+# metric -> whether higher is better
+METRICS: dict[str, bool] = {
+    "wall_seconds": False,
+    "mb_per_s": True,
+    "commits_per_s": True,
+    "bytes_sent": False,
+    "requests": False,
+    "peak_rss_bytes": False,
+    "store_bytes": False,
+}
+
+
+def _current_rss() -> int | None:
+    """Resident memory of this process in bytes, where ``/proc`` tells it."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _max_rss() -> int:
+    """Peak resident memory of the process lifetime in bytes."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class BenchmarkRun:
+    """
+    Measures one run of an upload strategy, as a context manager.
+
+    Parameters
+    ----------
+    name : str
+        Name of the run in the results, e.g. ``"incremental"``.
+    raw_bytes : int, optional
+        Uncompressed bytes uploaded by the run, for the throughput.
+    stats : TransferStats, optional
+        Counts the requests of the run, pass it to the upload helpers.
+    sample_interval : float, optional
+        Seconds between samples of the resident memory.
+    clock : callable, optional
+        Clock in seconds, by default :func:`time.perf_counter`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        raw_bytes: int = 0,
+        stats: TransferStats | None = None,
+        sample_interval: float = 0.05,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.name = name
+        self.raw_bytes = raw_bytes
+        self.stats = stats or TransferStats()
+        self.sample_interval = sample_interval
+        self.clock = clock
+        self.commits = 0
+        self.wall_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self._start = 0.0
+        self._done = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        while True:
+            rss = _current_rss()
+            if rss is not None:
+                self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+            if self._done.wait(self.sample_interval):
+                return
+
+    def __enter__(self) -> BenchmarkRun:
+        self._done.clear()
+        self.peak_rss_bytes = 0
+        if _current_rss() is not None:
+            self._sampler = threading.Thread(target=self._sample, name="bench-rss", daemon=True)
+            self._sampler.start()
+        self._start = self.clock()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.wall_seconds = self.clock() - self._start
+        self._done.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        else:
+            # without /proc, the peak of the process lifetime is the best bound
+            self.peak_rss_bytes = _max_rss()
+
+    def commit(self, session: Any, message: str, **kwargs: Any) -> Any:
+        """Commit the icechunk *session*, counting the commit."""
+        snapshot = session.commit(message, **kwargs)
+        self.commits += 1
+        return snapshot
+
+    def result(self, store_bytes: int | None = None, **extra: Any) -> dict[str, Any]:
+        """
+        The metrics of the run as a JSON-able record. *store_bytes* is the size of
+        the repository afterwards, *extra* is recorded as is.
+        """
+        seconds = max(self.wall_seconds, 1e-9)
+        result: dict[str, Any] = {
+            "wall_seconds": self.wall_seconds,
+            "mb_per_s": self.raw_bytes / 1024 / 1024 / seconds,
+            "commits_per_s": self.commits / seconds,
+            "commits": self.commits,
+            "raw_bytes": self.raw_bytes,
+            "bytes_sent": self.stats.bytes("PUT"),
+            "requests": self.stats.requests(),
+            "requests_by_operation": {op: counts["requests"] for op, counts in self.stats.totals().items()},
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+        if store_bytes is not None:
+            result["store_bytes"] = store_bytes
+        result.update(extra)
+        return result
+
+
+def load_results(path: str) -> dict[str, Any]:
+    """The ``{"meta", "results"}`` document of a results file."""
+    with open(path, encoding="utf-8") as file:
+        document = json.load(file)
+    if not isinstance(document, dict) or not isinstance(document.get("results"), dict):
+        raise ValueError(f"{path} is not a benchmark results file")
+    return document
+
+
+class BenchmarkResults:
+    """
+    The results of the benchmark runs of a session, kept in a JSON file.
+
+    The file is rewritten atomically after every run, so an interrupted session
+    keeps the runs it finished. Runs already in the file are kept unless they
+    are run again.
+
+    Parameters
+    ----------
+    path : str
+        The results file.
+    meta : dict, optional
+        Recorded with the results, e.g. the size of the benchmark dataset.
+    """
+
+    def __init__(self, path: str, meta: dict[str, Any] | None = None) -> None:
+        self.path = str(path)
+        self.results: dict[str, dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            self.results = load_results(self.path)["results"]
+        self.meta = {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "ice_stream": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **(meta or {}),
+        }
+
+    def record(self, name: str, result: dict[str, Any]) -> None:
+        self.results[name] = result
+        self.save()
+
+    def save(self) -> None:
+        document = {"meta": self.meta, "results": self.results}
+        atomic_write(self.path, json.dumps(document, indent=2, sort_keys=True) + "\n")
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    threshold: float = 0.1,
+    metrics: list[str] | None = None,
+) -> list[dict[str, Any]]:
+    """
+    The regressions of *results* against *baseline*, both run name -> metrics.
+
+    A metric regresses when it is worse than in the baseline by more than
+    *threshold*, relative to the baseline value. Runs and metrics missing from
+    either side, and zero baseline values, aren't compared.
+
+    Returns
+    -------
+    list of dict
+        The ``name``, ``metric``, ``baseline`` and ``current`` values and the
+        relative ``change`` of every regression, positive when worse.
+    """
+    regressions = []
+    for name in sorted(results.keys() & baseline.keys()):
+        for metric in metrics or METRICS:
+            current, reference = results[name].get(metric), baseline[name].get(metric)
+            if not isinstance(current, (int, float)) or not isinstance(reference, (int, float)) or not reference:
+                continue
+            change = (current - reference) / abs(reference)
+            if METRICS.get(metric, False):
+                change = -change
+            if change > threshold:
+                regressions.append(
+                    {"name": name, "metric": metric, "baseline": reference, "current": current, "change": change}
+                )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare benchmark results against a baseline.")
+    parser.add_argument("results", help="Results file of the benchmark session.")
+    parser.add_argument("baseline", help="Results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change flagged, e.g. 0.1 for 10%%.")
+    parser.add_argument(
+        "--metric", action="append", choices=sorted(METRICS), help="Metric to compare, repeatable, by default all."
+    )
+    args = parser.parse_args(argv)
+
+    results = load_results(args.results)["results"]
+    baseline = load_results(args.baseline)["results"]
+    missing = sorted(baseline.keys() - results.keys())
+    if missing:
+        logger.warning(f"Not in the results: {', '.join(missing)}")
+    regressions = compare(results, baseline, args.threshold, args.metric)
+    for regression in regressions:
+        logger.warning(
+            f"{regression['name']} {regression['metric']}: {regression['baseline']:.4g} -> "
+            f"{regression['current']:.4g} ({regression['change']:+.1%} worse)"
+        )
+    compared = len(results.keys() & baseline.keys())
+    logger.info(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} in {compared} run(s)")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,60 @@
 
 from __future__ import annotations
 
-from typing import Iterable
+import time
+from typing import TYPE_CHECKING, Any, Iterable
 
-import numpy as np
-import xarray as xr
-import icechunk.xarray as icx
-from zarr.registry import register_codec
+from ._lazy import lazy_import
+from .ratelimit import RateLimiter
+from .transfer import TransferStats, counting_store
+
+if TYPE_CHECKING:
+    import icechunk
+    import numpy as np
+    import xarray as xr
+
+    from .compression import AdaptiveCompression
+    from .dedup import Deduplicator
+    from .retry import RetryPolicy
+
+icx = lazy_import("icechunk.xarray")
+
+
+def _write(
+    ds: xr.Dataset,
+    session: "icechunk.Session",
+    stats: TransferStats | None,
+    limiter: RateLimiter | None,
+    retry: RetryPolicy | None = None,
+    compression: AdaptiveCompression | None = None,
+    dedup: Deduplicator | None = None,
+    **kwargs: object,
+) -> None:
+    """
+    Write *ds* to *session*, counting the requests in *stats*, throttled by *limiter*
+    and retrying each chunk with *retry* if given. The write is timed for the
+    throughput estimate of *compression*, and the chunks are deduplicated by *dedup*.
+    """
+    if stats is None and not limiter and retry is None and compression is None and dedup is None:
+        icx.to_icechunk(ds, session, **kwargs)  # type: ignore[arg-type]
+        return
+    stats = stats or TransferStats()
+    sent = stats.bytes("PUT", "icechunk")
+    start = time.perf_counter()
+    # to_icechunk only accepts the session's own store.
+    store = counting_store(session.store, stats, "icechunk", limiter, retry)
+    if dedup is not None:
+        store = dedup.wrap(store)
+    ds.to_zarr(store, consolidated=False, **kwargs)  # type: ignore[call-overload]
+    if compression is not None:
+        compression.observe(ds.nbytes, stats.bytes("PUT", "icechunk") - sent, time.perf_counter() - start)
+
+
+def _commit_metadata(choice: dict[str, Any] | None) -> dict[str, Any] | None:
+    """The codec *choice* made for the upload, recorded with the commit."""
+    if choice is None:
+        return None
+    return {"compression": choice}
 
 
 def clean_dataset(ds: xr.Dataset) -> xr.Dataset:
@@ -63,6 +111,11 @@ def upload_in_intervals(
     interval: np.timedelta64,
     mode_first: str = "w",
     encoding: dict[str, dict[str, object]] | None = None,
+    stats: TransferStats | None = None,
+    limiter: RateLimiter | None = None,
+    retry: RetryPolicy | None = None,
+    compression: AdaptiveCompression | None = None,
+    dedup: Deduplicator | None = None,
 ) -> None:
     """Upload *ds* to *repo* in chunks along *dim* with given *interval*.
 
@@ -83,12 +136,26 @@ def upload_in_intervals(
         If omitted, chunk encodings are inferred from the first interval so
         that variables (including the coordinate for ``dim``) share a consistent
         chunk size during subsequent appends.
+    stats : TransferStats, optional
+        Counts the requests and bytes written to the repository.
+    limiter : RateLimiter, optional
+        Throttles the chunk writes, e.g. on a shared uplink.
+    retry : RetryPolicy, optional
+        Retries failed chunk writes, instead of failing the whole upload.
+    compression : AdaptiveCompression, optional
+        Picks the codec of the arrays created by the first chunk, unless an
+        *encoding* is given. The later chunks update its throughput estimate.
+    dedup : Deduplicator, optional
+        Uploads each distinct chunk once, *repo* needs the config of
+        :meth:`~ice_stream.dedup.Deduplicator.repository_config`.
     """
 
     start = ds[dim].values[0]
     end = ds[dim].values[-1]
     first_end = start + interval
     first_slice = ds.sel({dim: slice(start, first_end)})
+    # the appends keep the codec of the arrays created by the first chunk
+    choice = None
     if encoding is None:
         chunk_size = first_slice.sizes[dim]
         encoding = {}
@@ -101,9 +168,13 @@ def upload_in_intervals(
                 if comp is not None:
                     enc["compressors"] = comp
                 encoding[name] = enc
+        if compression is not None:
+            choice = compression.choose(first_slice)
+            for name, enc in compression.encoding(first_slice, choice).items():
+                encoding.setdefault(name, {}).update(enc)
     session = repo.writable_session("main")
-    icx.to_icechunk(first_slice, session, mode=mode_first, encoding=encoding)
-    session.commit("initial chunk")
+    _write(first_slice, session, stats, limiter, retry, compression, dedup, mode=mode_first, encoding=encoding)
+    session.commit("initial chunk", metadata=_commit_metadata(choice))
 
     # Subsequent appends should not pass encodings for existing variables; xarray
     # will raise an error if encoding is specified for variables already written
@@ -114,13 +185,28 @@ def upload_in_intervals(
         chunk = ds.sel({dim: slice(current, next_t)})
         if chunk.sizes.get(dim, 0) > 0:
             session = repo.writable_session("main")
-            icx.to_icechunk(chunk, session, mode="a-", append_dim=dim)
-            session.commit("append chunk")
+            _write(chunk, session, stats, limiter, retry, compression, dedup, mode="a-", append_dim=dim)
+            session.commit("append chunk", metadata=_commit_metadata(choice))
         current = next_t
 
 
-def upload_single_chunk(repo: "icechunk.Repository", ds: xr.Dataset, message: str = "single chunk") -> None:
-    """Upload the entire dataset to the repository in one commit."""
+def upload_single_chunk(
+    repo: "icechunk.Repository",
+    ds: xr.Dataset,
+    message: str = "single chunk",
+    stats: TransferStats | None = None,
+    limiter: RateLimiter | None = None,
+    retry: RetryPolicy | None = None,
+    compression: AdaptiveCompression | None = None,
+    dedup: Deduplicator | None = None,
+) -> None:
+    """
+    Upload the entire dataset to the repository in one commit.
+
+    With *compression*, the codec is picked for this commit instead of taken from
+    the dataset encodings, and the choice is stored in the commit metadata. With
+    *dedup*, each distinct chunk is uploaded once.
+    """
     session = repo.writable_session("main")
     # Build encoding from dataset encodings (e.g., compressors) so arrays are compressed.
     enc: dict[str, dict[str, object]] = {}
@@ -128,5 +214,9 @@ def upload_single_chunk(repo: "icechunk.Repository", ds: xr.Dataset, message: st
         comp = ds[name].encoding.get("compressors")
         if comp is not None:
             enc[name] = {"compressors": comp}
-    icx.to_icechunk(ds, session, mode="w", encoding=enc)
-    session.commit(message)
+    choice = None
+    if compression is not None:
+        choice = compression.choose(ds)
+        enc.update(compression.encoding(ds, choice))
+    _write(ds, session, stats, limiter, retry, compression, dedup, mode="w", encoding=enc)
+    session.commit(message, metadata=_commit_metadata(choice))
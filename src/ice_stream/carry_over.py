@@ -0,0 +1,227 @@
+"""Local buffer for the sub-chunk remainders of streamed data.
+
+Streaming can only append whole chunks to a target, so every export ends with
+a remainder that is shorter than a chunk. Instead of dropping it and exporting
+the same time range again next run, the remainder is spilled to a small local
+NetCDF file and prepended to the next run's data. Every sample is exported from
+the Backup source exactly once.
+
+The buffer records the last timestamp of the target it continues (its *base*).
+If the target changed since, e.g. a failed transaction was rolled back, the
+buffer no longer lines up with the cloud data and is discarded, so the data is
+exported again instead of leaving a gap.
+"""
+
+from __future__ import annotations
+
+import os
+
+import numpy as np
+from loguru import logger
+
+from ._lazy import lazy_import
+
+xr = lazy_import("xarray")
+
+TIME_DIMS = ("timestamp", "high_res_timestamp")
+
+_ATTR_PREFIX = "carry_over_"
+
+
+def _to_datetime64(value: object) -> np.datetime64 | None:
+    if value is None or value == "":
+        return None
+    return np.datetime64(value, "ns")
+
+
+def _to_attr(value: object) -> str:
+    return "" if value is None else str(np.datetime64(value, "ns"))
+
+
+class CarryOverBuffer:
+    """
+    Holds partial chunks between streaming runs in ``<local_root_path>/carry_over.nc``.
+
+    Parameters
+    ----------
+    path : str
+        Location of the spill file.
+    chunk_sizes : dict[str, int]
+        Chunk size of each time dimension that has to be aligned before upload.
+        Dimensions that are not listed are uploaded as they are.
+    """
+
+    def __init__(self, path: str, chunk_sizes: dict[str, int]) -> None:
+        self.path = path
+        self.chunk_sizes = dict(chunk_sizes)
+        self._cached: xr.Dataset | None = None
+        self._loaded = False
+
+    def load(self) -> xr.Dataset | None:
+        """Return the buffered dataset, or ``None`` if nothing is buffered."""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                self._cached = xr.load_dataset(self.path)
+            except FileNotFoundError:
+                self._cached = None
+            except Exception as exc:
+                # The spill file is replaced atomically, but if it is unreadable the data
+                # will simply be exported again.
+                logger.warning(f"Ignoring unreadable carry-over buffer {self.path}: {exc}")
+                self._cached = None
+        return self._cached
+
+    def watermark(self, dim: str = "timestamp") -> np.datetime64 | None:
+        """Last value of *dim* that went into the buffer or a target before it."""
+        ds = self.load()
+        if ds is None:
+            return None
+        return _to_datetime64(ds.attrs.get(f"{_ATTR_PREFIX}watermark_{dim}"))
+
+    @property
+    def relative_path(self) -> str:
+        """Relative path of the export file the buffered rows came from."""
+        ds = self.load()
+        return "" if ds is None else ds.attrs.get(f"{_ATTR_PREFIX}relative_path", "")
+
+    def validate(self, base: object) -> bool:
+        """
+        Keep the buffer only if it continues a target ending at *base*.
+
+        Returns True if a valid buffer is available.
+        """
+        ds = self.load()
+        if ds is None:
+            return False
+        if _to_datetime64(ds.attrs.get(f"{_ATTR_PREFIX}base")) != _to_datetime64(base):
+            logger.warning("Discarding the carry-over buffer, it doesn't continue the last valid target")
+            self.clear()
+            return False
+        return True
+
+    def dataset(self) -> xr.Dataset | None:
+        """The buffered rows without the bookkeeping attributes."""
+        ds = self.load()
+        if ds is None:
+            return None
+        ds = ds.copy()
+        ds.attrs = {k: v for k, v in ds.attrs.items() if not k.startswith(_ATTR_PREFIX)}
+        return ds
+
+    def is_empty(self) -> bool:
+        """True if no rows are buffered along any time dimension."""
+        ds = self.load()
+        return ds is None or all(ds.sizes.get(dim, 0) == 0 for dim in TIME_DIMS)
+
+    def prepend(self, ds: xr.Dataset) -> xr.Dataset:
+        """
+        Put the buffered rows in front of *ds* along every time dimension.
+
+        Rows of *ds* up to the watermark were already buffered or uploaded and are
+        dropped, so overlapping exports never duplicate samples. Variables without a
+        time dimension (setup data) are taken from *ds*, the newer of the two.
+        """
+        for dim in TIME_DIMS:
+            watermark = self.watermark(dim)
+            if watermark is not None and dim in ds.dims:
+                ds = ds.isel({dim: ds[dim].values > watermark})
+
+        buffered = self.dataset()
+        if buffered is None:
+            return ds
+
+        combined = []
+        for dim in TIME_DIMS:
+            if dim not in buffered.dims or buffered.sizes[dim] == 0 or dim not in ds.dims:
+                continue
+            names = [v for v in ds.data_vars if dim in ds[v].dims]
+            combined.append(
+                xr.concat(
+                    [buffered[[v for v in names if v in buffered]], ds[names]],
+                    dim=dim,
+                    data_vars="all",
+                    coords="minimal",
+                    compat="override",
+                    join="outer",
+                )
+            )
+        if not combined:
+            return ds
+
+        dims = [c_dim for c in combined for c_dim in TIME_DIMS if c_dim in c.dims]
+        merged = ds.drop_dims(dims).merge(xr.merge(combined, compat="override", join="outer"), compat="override")
+        merged.attrs = ds.attrs
+        return merged
+
+    def split(self, ds: xr.Dataset) -> tuple[xr.Dataset, xr.Dataset]:
+        """
+        Split *ds* into the part made of whole chunks and the remainder.
+
+        If not even one chunk of the first aligned dimension is available, everything
+        (including the dimensions that don't need alignment) is remainder, as there is
+        no target to write the rest to yet.
+        """
+        aligned_index = {}
+        for dim, size in self.chunk_sizes.items():
+            if dim in ds.dims:
+                aligned_index[dim] = ds.sizes[dim] - ds.sizes[dim] % size
+
+        primary = next(iter(self.chunk_sizes))
+        if aligned_index.get(primary, 0) == 0:
+            return ds.isel({primary: slice(0, 0)}), ds
+
+        aligned = ds.isel({dim: slice(0, n) for dim, n in aligned_index.items()})
+        remainder = ds.isel({dim: slice(n, None) for dim, n in aligned_index.items()})
+        # dimensions that don't need alignment are uploaded with the aligned part.
+        for dim in TIME_DIMS:
+            if dim in ds.dims and dim not in aligned_index:
+                remainder = remainder.isel({dim: slice(0, 0)})
+        return aligned, remainder
+
+    def save(self, remainder: xr.Dataset, base: object, relative_path: str, exported: xr.Dataset) -> None:
+        """
+        Atomically replace the buffer with *remainder*.
+
+        Parameters
+        ----------
+        remainder : xr.Dataset
+            Rows that could not be uploaded yet.
+        base : datetime-like or None
+            Last timestamp of the target the remainder continues.
+        relative_path : str
+            Relative path of the export file, used if the rows end up in a new target.
+        exported : xr.Dataset
+            Everything that was exported, its ends become the watermarks.
+        """
+        attrs = {
+            f"{_ATTR_PREFIX}base": _to_attr(base),
+            f"{_ATTR_PREFIX}relative_path": relative_path,
+        }
+        for dim in TIME_DIMS:
+            watermark = self.watermark(dim)
+            if dim in exported.dims and exported.sizes[dim] > 0:
+                watermark = exported[dim].values[-1]
+            attrs[f"{_ATTR_PREFIX}watermark_{dim}"] = _to_attr(watermark)
+
+        # loaded, the remainder is read from an export folder that is removed after the run.
+        ds = remainder.load().copy()
+        for name in ds.variables:
+            ds[name].encoding.clear()
+        ds.attrs = {**ds.attrs, **attrs}
+
+        tmp_path = self.path + ".tmp"
+        ds.to_netcdf(tmp_path)
+        with open(tmp_path, "rb") as file:
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+        self._cached, self._loaded = ds, True
+
+    def clear(self) -> None:
+        """Remove the buffer."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self._cached, self._loaded = None, True
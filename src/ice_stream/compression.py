@@ -0,0 +1,193 @@
+"""Bandwidth adaptive choice of the blosc codec and level.
+
+Uploads are compressed with blosc zstd level 3 by default. That is the wrong
+trade-off at both ends of the links the field computers use: on a slow uplink
+with an idle CPU a higher zstd level finishes sooner, on a fast LAN a weak CPU
+is the bottleneck and lz4 finishes sooner.
+
+:class:`AdaptiveCompression` estimates the time until a commit is durable as::
+
+    raw / compression_speed + raw / ratio / network_throughput
+
+for every candidate codec, and picks the fastest. Compression speed and ratio
+are measured on a sample of the data being uploaded, the network throughput is
+a moving average of the recent writes. The choice is logged, kept in
+:attr:`AdaptiveCompression.choices` and stored in the commit metadata by the
+upload helpers in :mod:`ice_stream.blocks`.
+
+The codec of a zarr array is fixed when the array is created, the choice only
+applies to the arrays a commit creates. Appends keep the codec of the array and
+only update the throughput estimate.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Callable
+
+import numpy as np
+from loguru import logger
+
+from ._lazy import lazy_import
+from .ratelimit import Rate, parse_rate
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+numcodecs = lazy_import("numcodecs")
+
+# (cname, clevel), from the fastest to the strongest
+CANDIDATES: tuple[tuple[str, int], ...] = (
+    ("lz4", 1),
+    ("lz4", 5),
+    ("zstd", 1),
+    ("zstd", 3),
+    ("zstd", 6),
+    ("zstd", 9),
+)
+
+# used until the network throughput is known
+DEFAULT_CODEC = ("zstd", 3)
+
+
+def blosc_compressor(cname: str, clevel: int) -> dict[str, Any]:
+    """The zarr v3 ``compressors`` entry of a blosc codec."""
+    return {"name": "blosc", "configuration": {"cname": cname, "clevel": clevel}}
+
+
+def _compressible(ds: xr.Dataset) -> list[str]:
+    return [str(name) for name in ds.variables if ds[name].dtype.kind not in {"O", "S", "U"}]
+
+
+class AdaptiveCompression:
+    """
+    Picks the blosc codec minimising the time to upload a dataset.
+
+    Parameters
+    ----------
+    candidates : tuple of (str, int), optional
+        The ``(cname, clevel)`` pairs to choose from.
+    default : (str, int), optional
+        The codec used while the network throughput is unknown.
+    initial_throughput : rate, optional
+        A guess of the network throughput, e.g. ``"2 Mbit/s"``, used until writes
+        have been measured.
+    sample_bytes : int, optional
+        Raw bytes compressed with every candidate to measure its speed and ratio.
+    smoothing : float, optional
+        Weight of the latest write in the moving average of the throughput.
+    min_seconds, min_bytes : optional
+        Writes shorter in network time, or smaller on the wire, are not measured:
+        request latency and clock resolution dominate them.
+    clock : callable, optional
+        Clock in seconds, by default :func:`time.perf_counter`.
+    """
+
+    def __init__(
+        self,
+        candidates: tuple[tuple[str, int], ...] = CANDIDATES,
+        default: tuple[str, int] = DEFAULT_CODEC,
+        initial_throughput: Rate = None,
+        sample_bytes: int = 2 * 1024**2,
+        smoothing: float = 0.3,
+        min_seconds: float = 0.05,
+        min_bytes: int = 64 * 1024,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.candidates = candidates
+        self.default = default
+        self.throughput = parse_rate(initial_throughput)
+        self.sample_bytes = sample_bytes
+        self.smoothing = smoothing
+        self.min_seconds = min_seconds
+        self.min_bytes = min_bytes
+        self.clock = clock
+        self.choices: list[dict[str, Any]] = []
+        self._current: dict[str, Any] | None = None
+
+    def _sample(self, ds: xr.Dataset) -> list[np.ndarray]:
+        """Up to ``sample_bytes`` of contiguous raw data, shared out over the variables by size."""
+        names = _compressible(ds)
+        total = sum(ds[name].nbytes for name in names) or 1
+        sample = []
+        for name in names:
+            values = ds[name].values.reshape(-1)
+            count = max(1, int(self.sample_bytes * ds[name].nbytes / total) // max(values.itemsize, 1))
+            if values.size:
+                sample.append(np.ascontiguousarray(values[:count]))
+        return sample
+
+    def measure(self, ds: xr.Dataset) -> dict[tuple[str, int], tuple[float, float]]:
+        """Compression speed (raw bytes/s) and ratio of every candidate, on a sample of *ds*."""
+        sample = self._sample(ds)
+        raw = sum(array.nbytes for array in sample)
+        results = {}
+        for cname, clevel in self.candidates:
+            compressed = 0
+            start = self.clock()
+            for array in sample:
+                # zarr's blosc codec byte-shuffles multi-byte types and bit-shuffles single bytes.
+                shuffle = numcodecs.Blosc.SHUFFLE if array.itemsize > 1 else numcodecs.Blosc.BITSHUFFLE
+                codec = numcodecs.Blosc(cname=cname, clevel=clevel, shuffle=shuffle)
+                compressed += len(codec.encode(array))
+            seconds = max(self.clock() - start, 1e-9)
+            results[(cname, clevel)] = (raw / seconds, raw / max(compressed, 1))
+        return results
+
+    def choose(self, ds: xr.Dataset) -> dict[str, Any]:
+        """
+        Pick the codec for uploading *ds*, returns the choice as a JSON-able record.
+
+        The record holds the ``cname`` and ``clevel``, the measured ``ratio`` and
+        ``compression_bytes_per_s``, the ``network_bytes_per_s`` used and the
+        ``estimated_seconds`` to compress and send *ds*.
+        """
+        raw = sum(ds[name].nbytes for name in _compressible(ds))
+        measured = self.measure(ds)
+
+        def estimate(codec: tuple[str, int]) -> float:
+            speed, ratio = measured[codec]
+            network = raw / ratio / self.throughput if self.throughput else 0.0
+            return raw / speed + network
+
+        codec = min(measured, key=estimate) if self.throughput else self.default
+        speed, ratio = measured.get(codec, (float("nan"), float("nan")))
+        choice = {
+            "cname": codec[0],
+            "clevel": codec[1],
+            "ratio": ratio,
+            "compression_bytes_per_s": speed,
+            "network_bytes_per_s": self.throughput,
+            "estimated_seconds": estimate(codec) if codec in measured else None,
+            "raw_bytes": raw,
+        }
+        logger.info(
+            f"Compressing with blosc {codec[0]} level {codec[1]}, ratio {ratio:.2f}, "
+            + (f"network {self.throughput / 1024 / 1024:.2f} MB/s" if self.throughput else "network throughput unknown")
+        )
+        self.choices.append(choice)
+        self._current = choice
+        return choice
+
+    def encoding(self, ds: xr.Dataset, choice: dict[str, Any]) -> dict[str, dict[str, Any]]:
+        """The ``compressors`` encoding of *choice*, for every compressible variable of *ds*."""
+        compressor = blosc_compressor(choice["cname"], choice["clevel"])
+        return {name: {"compressors": [compressor]} for name in _compressible(ds)}
+
+    def observe(self, raw_bytes: int, wire_bytes: int, seconds: float) -> None:
+        """
+        Update the network throughput from a write of *raw_bytes*, sent as *wire_bytes*
+        in *seconds*. The compression time of the current choice is not network time.
+        Writes below ``min_bytes`` or ``min_seconds`` of network time are skipped.
+        """
+        if wire_bytes < max(self.min_bytes, 1):
+            return
+        if self._current is not None and self._current["compression_bytes_per_s"] > 0:
+            seconds -= raw_bytes / self._current["compression_bytes_per_s"]
+        if seconds < self.min_seconds or seconds <= 0:
+            return
+        throughput = wire_bytes / seconds
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput += self.smoothing * (throughput - self.throughput)
@@ -0,0 +1,160 @@
+"""
+Long running streaming daemon.
+
+Running `Streaming` from cron every 15-30 minutes re-imports the xarray/pandas/fsspec/clads stack, re-authenticates
+and re-discovers the timeframe on every run. The daemon keeps the streams resident instead:
+
+- **Warm state**: `Streaming` instances (and their storage clients) live as long as the process, and a stream
+  that finished cleanly skips re-validating its last target on the next cycle.
+- **Wake up**: A cycle runs every `interval_seconds`, or as soon as new local data appears in one of the
+  `watch_paths` (polled every `poll_seconds`), but no more often than every `min_interval_seconds`.
+- **Latency**: Targets grow by whole chunks (100 timestamps, 1000 high resolution timestamps, fixed by the
+  target encoding), the rows of a cycle that don't fill a chunk wait in the carry-over buffer. Waking up on new
+  data therefore bounds the lag of the upload to about one chunk, ~100 seconds of 1 Hz data, rather than to
+  `poll_seconds`. Flushing the buffer earlier would end the target with a partial chunk that can't be appended
+  to, and start a new target on every cycle, so the buffer is only flushed when the data stops continuing it
+  (a new day, changed settings) or the daemon stops.
+- **Shutdown**: SIGINT/SIGTERM finish the running cycle, upload the partial chunks waiting in the carry-over
+  buffers (unless `--keep-buffers`) and make the streaming state durable.
+
+Usage:
+
+    python -m ice_stream.daemon --settings settings.yaml --local-root ~/streaming --target-root az://backups \\
+        --watch ~/clads/data --interval 900
+
+or, for several projects, `--projects projects.yaml` with a list of `StreamingScheduler` project entries.
+"""
+
+import argparse
+import os
+import signal
+import threading
+import time
+from typing import Iterable, List, Optional
+
+import yaml
+from loguru import logger
+
+from .scheduler import StreamingScheduler
+
+
+def newest_mtime(paths: Iterable[str]) -> float:
+    """
+    The newest modification time of `paths` and their direct children.
+    Only one directory level is scanned, as new files or folders change their parent's mtime.
+    """
+    newest = 0.0
+    for path in paths:
+        try:
+            newest = max(newest, os.stat(path).st_mtime)
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        newest = max(newest, entry.stat().st_mtime)
+        except FileNotFoundError:
+            continue
+    return newest
+
+
+class StreamingDaemon:
+    """
+    Keeps the streams of a `StreamingScheduler` resident, and runs them on a schedule or on new local data.
+    """
+
+    def __init__(self,
+                 scheduler: StreamingScheduler,
+                 interval_seconds: float = 900,
+                 watch_paths: Optional[List[str]] = None,
+                 poll_seconds: float = 5,
+                 min_interval_seconds: float = 10,
+                 flush_on_stop: bool = True):
+        self.scheduler = scheduler
+        self.interval_seconds = interval_seconds
+        self.watch_paths = [os.path.abspath(os.path.expanduser(p)) for p in watch_paths or []]
+        self.poll_seconds = poll_seconds
+        self.min_interval_seconds = min_interval_seconds
+        # no rows are left behind in the carry-over buffers when the daemon stops
+        self.flush_on_stop = flush_on_stop
+
+        self.cycles = 0
+        self._stop = threading.Event()
+        self._last_cycle = float('-inf')
+        self._last_mtime = 0.0
+
+    def stop(self):
+        """Ask the daemon to stop after the running cycle."""
+        self._stop.set()
+
+    def should_wake(self) -> bool:
+        """True if it's time for a streaming cycle."""
+        elapsed = time.monotonic() - self._last_cycle
+        if elapsed < self.min_interval_seconds:
+            return False
+        if elapsed >= self.interval_seconds:
+            return True
+        return bool(self.watch_paths) and newest_mtime(self.watch_paths) > self._last_mtime
+
+    def run_cycle(self):
+        """Stream all the projects once."""
+        # sampled before streaming, so data arriving during the cycle wakes us up again.
+        self._last_mtime = newest_mtime(self.watch_paths) if self.watch_paths else 0.0
+        self._last_cycle = time.monotonic()
+
+        self.scheduler.run()
+        self.cycles += 1
+
+    def run_forever(self, max_cycles: Optional[int] = None):
+        """Run streaming cycles until `stop` is called, or `max_cycles` have run."""
+        logger.info(f"Streaming daemon started for {len(self.scheduler.projects)} project(s)")
+        try:
+            while not self._stop.is_set():
+                if self.should_wake():
+                    self.run_cycle()
+                    if max_cycles is not None and self.cycles >= max_cycles:
+                        break
+                self._stop.wait(self.poll_seconds)
+        finally:
+            self.scheduler.close(flush=self.flush_on_stop)
+            logger.info(f"Streaming daemon stopped after {self.cycles} cycle(s)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run ice_stream streaming as a long running daemon.")
+    parser.add_argument('--projects', help="YAML file with a list of streaming projects.")
+    parser.add_argument('--settings', help="clads settings file of a single project.")
+    parser.add_argument('--local-root', help="Local root path (state files) of a single project.")
+    parser.add_argument('--target-root', help="fsspec url of the upload target of a single project.")
+    parser.add_argument('--workers', type=int, default=4, help="Number of projects streamed concurrently.")
+    parser.add_argument('--bandwidth-limit', help="Upload limit of all the projects together, e.g. '1 Mbit/s'.")
+    parser.add_argument('--interval', type=float, default=900, help="Seconds between scheduled cycles.")
+    parser.add_argument('--watch', nargs='*', default=[], help="Local data paths that trigger a cycle when they change.")
+    parser.add_argument('--poll', type=float, default=5, help="Seconds between checks of the watched paths.")
+    parser.add_argument('--min-interval', type=float, default=10, help="Minimum seconds between cycles.")
+    parser.add_argument('--keep-buffers', action='store_true',
+                        help="Keep partial chunks buffered on shutdown, instead of uploading them.")
+    args = parser.parse_args(argv)
+
+    if args.projects:
+        with open(args.projects, 'r') as file:
+            projects = yaml.safe_load(file)
+    elif args.settings and args.local_root and args.target_root:
+        projects = [{'settings': args.settings, 'local_root_path': args.local_root, 'target_root': args.target_root}]
+    else:
+        parser.error("either --projects, or --settings, --local-root and --target-root are required")
+
+    daemon = StreamingDaemon(StreamingScheduler(projects, max_workers=args.workers,
+                                                bandwidth_limit=args.bandwidth_limit),
+                             interval_seconds=args.interval,
+                             watch_paths=args.watch,
+                             poll_seconds=args.poll,
+                             min_interval_seconds=args.min_interval,
+                             flush_on_stop=not args.keep_buffers)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+
+    daemon.run_forever()
+
+
+if __name__ == '__main__':
+    main()
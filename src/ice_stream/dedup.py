@@ -0,0 +1,327 @@
+"""Content addressed deduplication of uploaded chunks.
+
+Instrument data is repetitive: status flags hold the same value for hours, setup
+arrays are re-sent with every append, and mock data is tiled. Identical encoded
+chunks are uploaded once, to a *chunk pool* next to the repositories, under the
+sha256 of their bytes. The repository gets a virtual reference to the pool
+object instead of a copy of the chunk.
+
+A persistent local :class:`ChunkIndex` remembers the hashes already in the pool,
+so a duplicate costs neither an upload nor a request. A hash missing from the
+index is looked up in the pool once, the pool may be shared by several hosts.
+
+The pool is append-only. Nothing deletes objects from it, there is no garbage
+collection of chunks that no snapshot references anymore: an object can be
+referenced by any repository written with the pool, by any host. Reclaiming
+space means rewriting the repositories and replacing the pool. Each pool holds
+a ``pool.json`` marker with a random id, read once per session: an index kept
+for another (or a replaced) pool is cleared instead of trusted.
+
+Icechunk resolves the references through a virtual chunk container. Repositories
+written with deduplication need it in their config
+(:meth:`Deduplicator.repository_config`), and readers have to authorize it
+(:meth:`Deduplicator.authorize`). The pool is either local or on Azure Blob
+Storage (``az://<container>/<path>``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlparse
+
+from loguru import logger
+
+from ._lazy import lazy_import
+from .transfer import TransferStats, counting_store
+
+if TYPE_CHECKING:
+    from zarr.abc.store import Store
+    from zarr.core.buffer import Buffer
+
+    from .ratelimit import RateLimiter
+    from .retry import RetryPolicy
+
+icechunk = lazy_import("icechunk")
+zarr_buffer = lazy_import("zarr.core.buffer")
+zarr_storage = lazy_import("zarr.storage")
+
+# marker object of a pool, its id ties the local indexes to the pool
+POOL_MARKER = "pool.json"
+
+
+class ChunkIndex:
+    """
+    The hashes of the chunks known to be in the pool, kept in a local SQLite file,
+    together with the id of that pool.
+
+    Parameters
+    ----------
+    path : str
+        The SQLite file, created if needed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM chunks WHERE hash = ?", (digest,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, digest: str, size: int) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO chunks (hash, size) VALUES (?, ?)", (digest, size))
+
+    @property
+    def pool_id(self) -> str | None:
+        """Id of the pool the hashes are in, ``None`` for a new index."""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'pool_id'").fetchone()
+        return None if row is None else row[0]
+
+    def reset(self, pool_id: str) -> None:
+        """Forget every hash, the index now belongs to the pool *pool_id*."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pool_id', ?)", (pool_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _is_chunk(key: str) -> bool:
+    # zarr v3 chunk keys hold a "c" segment, e.g. "value/c/0/1", the rest is metadata.
+    return not key.endswith("zarr.json") and ("/c/" in f"/{key}" or key.endswith("/c"))
+
+
+def _virtual_ref_target(store: Any) -> Any:
+    """The icechunk store under the wrapper stores around it."""
+    while not hasattr(store, "set_virtual_ref_async"):
+        if not hasattr(store, "_store"):
+            raise TypeError("Deduplication needs the store of an icechunk session")
+        store = store._store
+    return store
+
+
+@functools.cache
+def _dedup_store_class() -> type:
+    """Define :class:`DedupStore` on first use, so importing this module doesn't import zarr."""
+
+    class DedupStore(zarr_storage.WrapperStore):
+        """
+        An icechunk session store writing chunks to the pool of a :class:`Deduplicator`.
+
+        Chunks smaller than ``min_bytes`` and the metadata are written as usual.
+        """
+
+        def __init__(self, store: Store, dedup: Deduplicator) -> None:
+            super().__init__(store)
+            self.dedup = dedup
+            self._icechunk = _virtual_ref_target(store)
+
+        def _with_store(self, store: Store) -> "DedupStore":
+            return type(self)(store, self.dedup)
+
+        async def set(self, key: str, value: Buffer) -> None:
+            if len(value) < self.dedup.min_bytes or not _is_chunk(key):
+                await self._store.set(key, value)
+                return
+            location = await self.dedup.put(value)
+            await self._icechunk.set_virtual_ref_async(key, location, offset=0, length=len(value))
+
+    return DedupStore
+
+
+class Deduplicator:
+    """
+    Uploads each distinct encoded chunk once, to a content addressed, append-only pool.
+
+    Parameters
+    ----------
+    pool_url : str
+        fsspec url of the chunk pool, e.g. ``az://container/chunk-pool``.
+    index_path : str
+        Local SQLite file of the :class:`ChunkIndex`.
+    stats : TransferStats, optional
+        Counts the requests made to the pool.
+    limiter : RateLimiter, optional
+        Throttles the uploads to the pool.
+    retry : RetryPolicy, optional
+        Retries failed requests to the pool.
+    min_bytes : int, optional
+        Smaller chunks aren't worth a reference and are written as usual.
+    pool_options : dict, optional
+        Object store options of the virtual chunk container, how icechunk reads
+        the pool, e.g. ``{"azure_storage_use_emulator": "true"}``. The Azure
+        account is taken from the ``account_name`` or ``connection_string``
+        storage option, or from the environment.
+    **storage_options
+        Passed to the fsspec filesystem of the pool.
+    """
+
+    def __init__(
+        self,
+        pool_url: str,
+        index_path: str,
+        stats: TransferStats | None = None,
+        limiter: RateLimiter | None = None,
+        retry: RetryPolicy | None = None,
+        min_bytes: int = 4096,
+        pool_options: dict[str, str] | None = None,
+        **storage_options: Any,
+    ) -> None:
+        self.pool_url = pool_url.rstrip("/")
+        if urlparse(self.pool_url).scheme not in ("", "file", "az"):
+            raise ValueError(f"Unsupported chunk pool url: {pool_url}, the pool is local or az://")
+        self.index = ChunkIndex(index_path)
+        self.stats = stats or TransferStats()
+        self.limiter = limiter
+        self.retry = retry
+        self.min_bytes = min_bytes
+        self.pool_options = dict(pool_options or {})
+        self.storage_options = storage_options
+        self._lock = threading.Lock()
+        # digest -> upload in progress, zarr writes the chunks of an array concurrently. Not bound to an
+        # event loop, the sessions of several threads (and their loops) may share the deduplicator.
+        self._pending: dict[str, concurrent.futures.Future[None]] = {}
+        # the pool marker check, once per session
+        self._pool_checked: concurrent.futures.Future[None] | None = None
+        self.chunks = 0
+        self.duplicates = 0
+        self.saved_bytes = 0
+
+    @functools.cached_property
+    def pool(self) -> Any:
+        options = {"auto_mkdir": True} if urlparse(self.pool_url).scheme in ("", "file") else {}
+        store = zarr_storage.FsspecStore.from_url(self.pool_url, storage_options={**options, **self.storage_options})
+        return counting_store(store, self.stats, self.pool_url, self.limiter, self.retry)
+
+    async def _check_pool(self) -> None:
+        """Clear the index if it was kept for another pool, marking a new pool first."""
+        with self._lock:
+            checked = self._pool_checked
+            owner = checked is None
+            if owner:
+                checked = self._pool_checked = concurrent.futures.Future()
+        if not owner:
+            await asyncio.wrap_future(checked)
+            return
+        try:
+            prototype = zarr_buffer.default_buffer_prototype()
+            marker = await self.pool.get(POOL_MARKER, prototype)
+            if marker is None:
+                pool_id = uuid.uuid4().hex
+                await self.pool.set(POOL_MARKER, prototype.buffer.from_bytes(json.dumps({"id": pool_id}).encode()))
+            else:
+                pool_id = json.loads(marker.to_bytes())["id"]
+            if pool_id != self.index.pool_id:
+                if len(self.index):
+                    logger.warning(f"The chunk index {self.index.path} was kept for another pool, clearing it")
+                self.index.reset(pool_id)
+            checked.set_result(None)
+        except BaseException as exc:
+            checked.set_exception(exc)
+            # the next put checks again
+            with self._lock:
+                self._pool_checked = None
+            raise
+
+    async def put(self, value: Buffer) -> str:
+        """Make sure the pool holds *value*, returns its url."""
+        await self._check_pool()
+        digest = hashlib.sha256(value.as_numpy_array().tobytes()).hexdigest()
+        with self._lock:
+            pending = self._pending.get(digest)
+            owner = pending is None and digest not in self.index
+            if owner:
+                pending = self._pending[digest] = concurrent.futures.Future()
+
+        if not owner:
+            if pending is not None:
+                await asyncio.wrap_future(pending)
+            duplicate = True
+        else:
+            try:
+                duplicate = await self.pool.exists(digest)
+                if not duplicate:
+                    await self.pool.set(digest, value)
+                self.index.add(digest, len(value))
+                pending.set_result(None)
+            except BaseException as exc:
+                # the waiters re-raise it
+                pending.set_exception(exc)
+                raise
+            finally:
+                with self._lock:
+                    del self._pending[digest]
+
+        with self._lock:
+            self.chunks += 1
+            if duplicate:
+                self.duplicates += 1
+                self.saved_bytes += len(value)
+        return f"{self.pool_url}/{digest}"
+
+    def wrap(self, store: Store) -> Any:
+        """Wrap the store of a writable icechunk session, deduplicating its chunks."""
+        return _dedup_store_class()(store, self)
+
+    @property
+    def container_prefix(self) -> str:
+        return f"{self.pool_url}/"
+
+    def _azure_account(self) -> str:
+        account = self.storage_options.get("account_name")
+        connection = self.storage_options.get("connection_string") or os.environ.get("AZURE_STORAGE_CONNECTION_STRING")
+        if not account and connection:
+            match = re.search(r"AccountName=([^;]+)", connection)
+            account = match.group(1) if match else None
+        account = account or os.environ.get("AZURE_STORAGE_ACCOUNT_NAME")
+        if not account:
+            raise ValueError(f"The Azure account of the chunk pool {self.pool_url} is unknown, pass account_name")
+        return account
+
+    def _store_config(self) -> Any:
+        parsed = urlparse(self.pool_url)
+        if parsed.scheme in ("", "file"):
+            return icechunk.local_filesystem_store(parsed.path)
+        return icechunk.ObjectStoreConfig.Azure({"account": self._azure_account(), **self.pool_options})
+
+    def repository_config(self, config: Any = None) -> Any:
+        """*config* (or the default repository config) with the virtual chunk container of the pool."""
+        config = config or icechunk.RepositoryConfig.default()
+        config.set_virtual_chunk_container(icechunk.VirtualChunkContainer(self.container_prefix, self._store_config()))
+        return config
+
+    def authorize(self, credentials: Any = None) -> dict[str, Any]:
+        """
+        ``authorize_virtual_chunk_access`` for opening a deduplicated repository, with
+        *credentials* of the pool, e.g. from :func:`icechunk.azure_credentials`.
+        """
+        return icechunk.containers_credentials({self.container_prefix: credentials})
+
+    def summary(self) -> str:
+        return (
+            f"{self.duplicates}/{self.chunks} chunks deduplicated, "
+            f"{self.saved_bytes / 1024 / 1024:.2f} MB not uploaded"
+        )
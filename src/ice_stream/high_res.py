@@ -0,0 +1,123 @@
+"""Chunk aligned appends of high resolution data.
+
+High resolution data goes to a ``<target>_high_res.zarr`` store next to each
+target. Whether that store exists is known from the streaming transaction: a new
+target starts a new store, an append continues it. The appender caches this,
+together with the last high resolution timestamp of each store. It never has to
+probe the store with a failing write, and it never overwrites a store it should
+append to. A target deleted or rolled back by the streaming state is forgotten,
+its store is looked up again.
+
+New stores are chunked like the carry-over buffer, and the buffer keeps the high
+resolution remainder below a whole chunk, so appends only write whole chunks.
+Partial chunks are written once, when the target is sealed.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from loguru import logger
+
+from ._lazy import lazy_import
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .transfer import TransferStats, zarr_store_kwargs
+
+xr = lazy_import("xarray")
+
+HIGH_RES_DIM = "high_res_timestamp"
+
+
+def high_res_url(target_url: str) -> str:
+    """URL of the high resolution store next to *target_url*."""
+    return target_url.replace(".zarr", "_high_res.zarr")
+
+
+class HighResAppender:
+    """
+    Writes the high resolution part of the streamed data.
+
+    Parameters
+    ----------
+    storage_options : dict
+        Storage options passed to ``to_zarr``/``open_zarr``.
+    stats : TransferStats, optional
+        Counts the requests made to the high resolution stores.
+    limiter : RateLimiter, optional
+        Throttles the writes, only used together with *stats*.
+    retry : RetryPolicy, optional
+        Retries failed chunk writes, only used together with *stats*.
+    chunk_size : int, optional
+        Chunk length of new stores along the high resolution dimension, the
+        high resolution chunk size of the carry-over buffer.
+    """
+
+    def __init__(
+        self,
+        storage_options: dict,
+        stats: TransferStats | None = None,
+        limiter: RateLimiter | None = None,
+        retry: RetryPolicy | None = None,
+        chunk_size: int = 1000,
+    ) -> None:
+        self.storage_options = storage_options
+        self.stats = stats
+        self.limiter = limiter
+        self.retry = retry
+        self.chunk_size = chunk_size
+        # high res url -> (whether the store exists, its last high resolution timestamp, None if it's empty).
+        self._stores: dict[str, tuple[bool, np.datetime64 | None]] = {}
+
+    def on_new_target(self, target_url: str) -> None:
+        """*target_url* is created by the current transaction, so is its high resolution store."""
+        self._stores[high_res_url(target_url)] = (False, None)
+
+    def forget(self, target_url: str) -> None:
+        """*target_url* was deleted or rolled back, its store is looked up again on the next append."""
+        self._stores.pop(high_res_url(target_url), None)
+
+    def _store(self, url: str) -> tuple[bool, np.datetime64 | None]:
+        """Whether the store at *url* exists and its last timestamp, looked up once per process."""
+        if url not in self._stores:
+            try:
+                with xr.open_zarr(**zarr_store_kwargs(url, self.stats, self.limiter, self.retry, **self.storage_options)) as ds:
+                    self._stores[url] = (True, ds[HIGH_RES_DIM].values[-1] if ds.sizes[HIGH_RES_DIM] else None)
+            except FileNotFoundError:
+                self._stores[url] = (False, None)
+        return self._stores[url]
+
+    def append(self, target_url: str, ds: xr.Dataset) -> int:
+        """
+        Append the high resolution rows of *ds* to the store of *target_url*.
+
+        Rows up to the last timestamp already in the store are dropped, so a retried
+        transaction doesn't duplicate data. Returns the number of rows written.
+        """
+        if HIGH_RES_DIM not in ds.dims:
+            return 0
+
+        url = high_res_url(target_url)
+        ds = ds.drop_dims(set(ds.dims) - {HIGH_RES_DIM})
+
+        exists, end = self._store(url)
+        if end is not None:
+            ds = ds.isel({HIGH_RES_DIM: ds[HIGH_RES_DIM].values > end})
+
+        size = ds.sizes[HIGH_RES_DIM]
+        if size == 0:
+            return 0
+
+        if not exists:
+            logger.info(f"Creating new high resolution data at {url}")
+            encoding = {
+                str(name): {"chunks": (self.chunk_size,) + ds[name].shape[1:]}
+                for name in ds.variables
+                if ds[name].dims[:1] == (HIGH_RES_DIM,)
+            }
+            ds.to_zarr(mode="w", encoding=encoding, **zarr_store_kwargs(url, self.stats, self.limiter, self.retry, **self.storage_options))  # type: ignore
+        else:
+            logger.info(f"Appending high resolution data to {url}")
+            ds.to_zarr(append_dim=HIGH_RES_DIM, mode="a-", **zarr_store_kwargs(url, self.stats, self.limiter, self.retry, **self.storage_options))  # type: ignore
+
+        self._stores[url] = (True, ds[HIGH_RES_DIM].values[-1])
+        return size
@@ -19,34 +19,48 @@ Key Features:
 6. **Retro and Setup Information**: During append operations, new retro and setup information is also appended, ensuring that the project setup information grows as new data is added.
 7. **Retro and Setup sideload files**: Project folders include seperate  retro and setup files, that ara guaranteed to have complete setup data, even if setup data was added after creating the project. 
 8. **Chunk Management**: Data is appended in chunks, with each variable having its own folder and chunk files. The chunk size is set to 100 timestamps, and 1000 high_freq_timestamps.
+   The sub-chunk remainder of each run is kept in a local carry-over buffer and prepended to the next run, instead of being exported again.
 9. **Settings Control**: Streaming interval and maximum append duration can be controlled via the command line, API, or settings file.
+10. **Local First**: With `streaming_local_first`, the targets are written to the local disk and pushed to the cloud after each run. 
+   A network outage becomes a backlog for the next push instead of a failed run. The local targets are kept, they are appended to.
 """
 
+from __future__ import annotations
+
 import yaml
 import os
+import posixpath
 from loguru import logger
-from typing import Dict, Union, Tuple, Optional, Any, List
-import fsspec
+from typing import Callable, Dict, Union, Tuple, Optional, Any, List
 from urllib.parse import urlparse
-import xarray as xr
 from pathlib import Path
 from datetime import datetime, timedelta
 import tempfile
-from clads import default_settings_filepath
-from clads.clads_service.backup import (Backup, 
-                                        get_cloud_files, 
-                                        append_setup, 
-                                        get_missing_setup_ds, 
-                                        ensure_fsspec_path, 
-                                        setup_sideload_path,
-                                        significant_keys,
-                                        append_missing_setup_data_to_target)
-
-import pandas as pd
 import numpy as np
 import shutil
-from tenacity import retry, stop_after_attempt, RetryError
 import subprocess
+from contextlib import closing
+
+from ._lazy import lazy_import
+
+# Heavy dependencies are imported on first use, see `ice_stream._lazy`. 
+fsspec = lazy_import('fsspec')
+xr = lazy_import('xarray')
+pd = lazy_import('pandas')
+_backup = lazy_import('clads.clads_service.backup')
+_zappend = lazy_import('zappend.api')
+_sync = lazy_import('ice_stream.sync')
+
+from .carry_over import CarryOverBuffer
+from .high_res import HighResAppender
+from .journal import StateJournal
+from .metrics import MetricsWriter, StageTimer, timed_stage
+from .pipeline import prefetch
+from .ratelimit import RateLimiter, limiter_from_settings
+from .retry import RetryPolicy
+from .target_index import TargetIndex
+from .transfer import InstrumentedFileSystem, TransferStats, zarr_store_kwargs
+from .setup_cache import SetupCache, setup_dataset
 
 zappend_config = {
     'append_dim': 'timestamp',
@@ -73,6 +87,18 @@ zappend_config = {
 default_streaming_settings = {
     'streaming_minutes': 30,
     'streaming_days_per_file': 1,
+    'streaming_pipeline': False,            # overlap Backup export with the upload
+    'streaming_pipeline_queue_size': 2,     # exported windows waiting for upload, bounds local disk use
+    'streaming_index_key': None,            # name of the project's target index, defaults to the folder of its targets, <instrument>/<project>
+    'streaming_metrics': True,              # write per-stage timings after each run
+    'streaming_metrics_textfile': None,     # Prometheus textfile-collector file, defaults to <local_root_path>/ice_stream.prom
+    'streaming_bandwidth_limit': None,      # upload limit of the project, e.g. '512 KB/s', None for unlimited
+    'streaming_bandwidth_schedule': None,   # time of day limits, [{'start': '08:00', 'end': '18:00', 'limit': '128 KB/s'}]
+    'streaming_host_bandwidth_limit': None, # upload limit shared by all the projects on the host
+    'streaming_host_bandwidth_schedule': None,
+    'streaming_host_bandwidth_file': None,  # state of the host limit, defaults to <tmp>/ice_stream_bandwidth.json
+    'streaming_retry': {'attempts': 5, 'initial_wait': 0.5, 'max_wait': 30}, # retries of failed storage requests
+    'streaming_local_first': False,         # write the targets under <local_root_path>/targets, and push them to target_root
     # Add other default settings as needed
 }
 
@@ -96,7 +122,7 @@ class Streaming:
                  keep_files: Optional[str] = None,
                  **storage_options: Dict[str, str]):
 
-        self.backup = Backup(settings)
+        self.backup = _backup.Backup(settings)
         self.settings: Dict[str, Any] = self.backup.config.settings
 
         # Update 'settings' with default values for any keys that are missing
@@ -116,11 +142,33 @@ class Streaming:
         self.local_root_path = local_root_path
         self.streamed_paths: List[str] = []  # List of local paths that were successfully streamed
 
+        # requests and bytes sent to the target, by operation and target
+        self.transfer_stats = TransferStats()
+        # bandwidth limits of the project and the host, see `ice_stream.ratelimit`
+        self.rate_limiter = limiter_from_settings(self.settings)
+        # transient storage errors are retried request by request, see `ice_stream.retry`
+        self.retry_policy = RetryPolicy.from_settings(self.settings['streaming_retry'])
+
+        # With `streaming_local_first`, the targets are written to the local disk, and pushed to `target_root`
+        # at the end of each run (see `ice_stream.sync.TargetSync`). A network outage leaves a backlog to push 
+        # instead of failing the run. Only the push is throttled. 
+        self.target_sync = None
+        self._write_limiter = self.rate_limiter
+        if self.settings['streaming_local_first']:
+            local_targets = os.path.join(self.local_root_path, 'targets')
+            self.target_sync = _sync.TargetSync(local_targets, target_root, limiter=self.rate_limiter,
+                                                retry=self.retry_policy, **storage_options)
+            # zarr writes the local files through fsspec as well, which needs to create their folders
+            target_root, storage_options = f"file://{local_targets}", {'auto_mkdir': True}
+            self._write_limiter = RateLimiter()
+        self._zappend_storage_options = storage_options if self.target_sync is not None else None
+
         self.target_root = ensure_upload_path(target_root, **storage_options)
         self.target_url = ''
         self.storage_options = storage_options
         parsed = urlparse(target_root)
-        self.fs = fsspec.filesystem(parsed.scheme, auto_mkdir=True, **storage_options)
+        self.fs = InstrumentedFileSystem(fsspec.filesystem(parsed.scheme, **{'auto_mkdir': True, **storage_options}),
+                                         self.transfer_stats, self.target_root, self._write_limiter, self.retry_policy)
         self.fs_root_path = parsed.netloc + parsed.path
 
         self.since = None 
@@ -132,21 +180,44 @@ class Streaming:
         self.last_ds : Union[xr.Dataset, None] = None
         self.source_ds : Union[xr.Dataset, None] = None
         self.keep_files = keep_files
-        self.bytes:int = 0
 
         yml_path = os.path.join(self.local_root_path, "streaming_state.yaml")
-        self.streaming_state = StreamingState(yml_path, target_root, **storage_options)
-
-
-
+        # Partial chunks are kept locally between runs, and prepended to the next export.
+        self.carry_over = CarryOverBuffer(os.path.join(self.local_root_path, "carry_over.nc"),
+                                          {'timestamp': 100, 'high_res_timestamp': 1000})
+        self.high_res = HighResAppender(storage_options, self.transfer_stats, self._write_limiter, self.retry_policy,
+                                        chunk_size=self.carry_over.chunk_sizes['high_res_timestamp'])
+
+        self.streaming_state = StreamingState(yml_path, target_root,
+                                              index_key=self.settings['streaming_index_key'] or '',
+                                              transfer_stats=self.transfer_stats,
+                                              rate_limiter=self._write_limiter,
+                                              retry_policy=self.retry_policy,
+                                              on_discard=self.high_res.forget,
+                                              **storage_options)
+        # Setup data known to be in the targets and the setup sideload files.
+        self.setup_cache = SetupCache()
+
+        # Time spent in each stage of a run, written to JSON and a Prometheus textfile after each run.
+        self.timer = StageTimer()
+        self.metrics = None
+        if self.settings['streaming_metrics']:
+            self.metrics = MetricsWriter(
+                json_path=os.path.join(self.local_root_path, 'streaming_metrics.json'),
+                textfile_path=self.settings['streaming_metrics_textfile'] or os.path.join(self.local_root_path, 'ice_stream.prom'),
+                state_path=os.path.join(self.local_root_path, 'streaming_metrics_histograms.json'),
+                project=self.settings['streaming_index_key'] or os.path.basename(self.local_root_path))
+        self.exported_until = None  # last exported timestamp, including the carry-over remainder
+
+
+
+    @timed_stage('discover')
     def _discover_timeframe(self):
 
-        # if no end date was provided:
-        if not self.until_hint:
-            self.until_hint = pd.Timestamp.now()
+        # if no end date was provided, we stream until now, see `_until_for`. 
 
         # `since` is more complicated.  We need to know if we have streamed data before.
-        is_available, result = self.streaming_state.initialize_and_validate_paths()
+        is_available, result = self._validated_last_target()
         
         if not is_available:            
             if self.since_hint is None:
@@ -165,110 +236,276 @@ class Streaming:
             if self.since_hint is not None and self.since_hint > self.since:
                 self.since = self.since_hint
 
+        # The carry-over buffer holds data that was exported after the last valid target, 
+        # unless the target was changed/rolled back since. 
+        if self.carry_over.validate(self._last_timestamp() if is_available else None):
+            watermark = self.carry_over.watermark()
+            if watermark is not None:
+                self.since = max(self.since, self.convert_to_timestamp(watermark) + pd.Timedelta(milliseconds=1))
+
         self._update_until()               
 
+    def _validated_last_target(self):
+        """ `(is_available, (last_url, last_ds))` of the last valid target, see `StreamingState.initialize_and_validate_paths` """
+        if self.last_ds is not None and self.streaming_state.is_settled(self.last_url):
+            # A resident streamer (e.g. `ice_stream.daemon`) already holds the validated last target, 
+            # and nothing happened to it since, we can skip the round trips to the cloud. 
+            return True, (self.last_url, self.last_ds)
+        with self.timer.stage('validation'):
+            return self.streaming_state.initialize_and_validate_paths()
+
+    def _last_timestamp(self):
+        """ The last timestamp of the last valid target, None if there isn't one. """
+        if self.last_ds is None or self.last_ds.timestamp.size == 0:
+            return None
+        return self.last_ds.timestamp.values[-1]
+
     def _stream(self):
 
         with tempfile.TemporaryDirectory() as tmpdirname:
 
             logger.info(f"Streaming data between {self.since} -- {self.until}")
             
-            local_paths = self.backup.to_file(tmpdirname, since=self.since, until=self.until)
+            with self.timer.stage('export'):
+                local_paths = self.backup.to_file(tmpdirname, since=self.since, until=self.until)
 
             if self.keep_files: 
                 # copy from tmpdirname to keep_files
                 shutil.copytree(tmpdirname, self.keep_files, dirs_exist_ok=True)
-            
-            for path in local_paths:
 
-                source_ds = xr.open_dataset(path, engine="zarr") # type: ignore
-                
-                # Align end to chunk size (unless it's already aligned, as slice (0, -0) ends up empty) 
-                if source_ds.timestamp.size % 100 != 0:
-                    source_ds = source_ds.isel(timestamp=slice(None, -(source_ds.timestamp.size % 100)))
-
-                if source_ds.timestamp.size == 0:
-                    # We have to, and can ignore these: 
-                    # - We have to ignore "< chunk" files, as if upload, we can't append to them later, 
-                    # - We can ignore them, as if the project data is growing they will be streamed next time. 
-                    # - Only risk, is when the project has stopped. The chunk size is small and we can live with
-                    #  a few minutes of missing data at the end. 
-                    logger.warning(f"Ignoring small file {path}")
-                    continue
-                else:
-                    self.source_ds = source_ds
+            self._upload(tmpdirname, local_paths)
 
-                # append or create new file? 
-                is_appendable = self.is_appendable(self.last_ds, 
-                                   self.source_ds, 
-                                   significant_keys)
-                
-                is_within_timeframe = self.is_within_timeframe(self.last_ds, 
-                                                               self.source_ds, 
-                                                               pd.Timedelta(days=self.settings['streaming_days_per_file'])
-                )
-                
-                if is_appendable and is_within_timeframe:
-                    
-                    # set the env variable, CLADS_BACKUP_UPLOAD_TARGET for zappend
-                    self.target_url = self.last_url
-                    os.environ['CLADS_BACKUP_UPLOAD_TARGET'] = self.target_url
+    def _stream_pipelined(self):
+        """
+        Overlaps the Backup export with the upload. A producer thread exports one `streaming_days_per_file`
+        window after the other into its own temporary folder, while the uploader works through the 
+        bounded queue of exported windows. Catch-up runs take roughly max(export, upload) instead of the sum. 
+        """
+        windows = prefetch(self._export_windows(), 
+                           maxsize=self.settings['streaming_pipeline_queue_size'],
+                           on_discard=lambda window: shutil.rmtree(window[2], ignore_errors=True))
+
+        # closed right away on a failed upload, the traceback would otherwise keep the producer exporting 
+        with closing(windows):
+            for since, until, tmpdirname, local_paths in windows:
+                try:
+                    self.since, self.until = since, until
+                    self._upload(tmpdirname, local_paths)
+                finally:
+                    shutil.rmtree(tmpdirname, ignore_errors=True)
+
+                self.streamed_paths = []
+                self.target_url = ''
+
+    def _export_windows(self):
+        """
+        Yields `(since, until, tmpdirname, local_paths)` for consecutive export windows. 
+        The next window is derived from the exported data with the same rules as `_progress`, 
+        so the producer never needs to wait for the uploader.
+        """
+        since = self.since
+        until = self._until_for(since)
 
-                    config = yaml.safe_load(os.path.expandvars(str(zappend_config)))
+        while since < until:
+            tmpdirname = tempfile.mkdtemp(prefix='ice_stream_')
+            try:
+                logger.info(f"Exporting data between {since} -- {until}")
+                with self.timer.stage('export'):
+                    local_paths = self.backup.to_file(tmpdirname, since=since, until=until)
 
-                    logger.info(f"Appending to {config['target_dir']}")
-                    self.streaming_state.on_append_transaction()
-                    zappend([path], config, slice_source=self.zappend_append_conform)
+                if self.keep_files: 
+                    shutil.copytree(tmpdirname, self.keep_files, dirs_exist_ok=True)
 
-                    self.add_high_res()
+                exported_end = self._exported_end(local_paths)
+            except BaseException:
+                shutil.rmtree(tmpdirname, ignore_errors=True)
+                raise
 
-                    # A good catch, where new setup data appeared in the newer files. 
-                    # we make sure the concatenated file has all the setup data.
-                    append_missing_setup_data_to_target(self.source_ds, self.last_ds, self.target_url, **self.storage_options)
-                    
-                else:
-                    
-                    relative_path = os.path.relpath(path, start=tmpdirname)
-                    fs_parent_path = os.path.join(self.fs_root_path, str(Path(relative_path).parent))
-
-                    self.target_url = os.path.join(self.target_root, relative_path)
-                    os.environ['CLADS_BACKUP_UPLOAD_TARGET'] = self.target_url
-                    config = yaml.safe_load(os.path.expandvars(str(zappend_config)))
-                    
-                    logger.info(f"Adding new file {config['target_dir']}")
-                    self.streaming_state.on_new_transaction(self.target_url)
-
-                    # A Workaround for zappend, as it expects the parent folder to exist.
-                    if not self.fs.exists(fs_parent_path):
-                        self.fs.touch(os.path.join(fs_parent_path, 'placeholder.txt'))
-
-                    zappend([path], config, slice_source=self.zappend_new_conform)
-
-                    self.add_high_res()
-                    
-                # continuation of the same settings or not,
-                # if it's the same project, the setup data is valid, and extendable, 
-                # We continue to append to it.
-                self.maintain_project_setup()
-
-                # complete the transaction
+            yield since, until, tmpdirname, local_paths
+
+            if exported_end is None:
+                since = since + pd.Timedelta(days=self.settings['streaming_days_per_file'])
+            else:
+                since = exported_end + pd.Timedelta(milliseconds=1)
+            until = self._until_for(since)
+
+    def _exported_end(self, local_paths):
+        """ The last timestamp in `local_paths`, None if they are empty. Remainders go to the carry-over buffer. """
+        for path in reversed(local_paths):
+            with xr.open_dataset(path, engine="zarr") as ds: # type: ignore
+                if ds.timestamp.size > 0:
+                    return self.convert_to_timestamp(ds.timestamp[-1])
+        return None
+
+    def _upload(self, tmpdirname, local_paths):
+
+        for path in local_paths:
+
+            source_ds = xr.open_dataset(path, engine="zarr") # type: ignore
+            relative_path = os.path.relpath(path, start=tmpdirname)
+
+            buffered = self.carry_over.dataset()
+            # the buffer may only hold high resolution rows, which continue the last target.
+            reference = buffered if buffered is not None and buffered.timestamp.size > 0 else self.last_ds
+            if not self.carry_over.is_empty() and not self._continues(reference, source_ds):
+                # The buffered rows are the end of a day, settings etc. the new data won't continue them. 
+                self.flush_carry_over()
+
+            # Drops anything exported before, and prepends the remainder of the last run. 
+            source_ds = self.carry_over.prepend(source_ds)
+
+            if source_ds.timestamp.size == 0:
+                logger.warning(f"Ignoring empty file {path}")
+                continue
+
+            self.exported_until = source_ds.timestamp.values[-1]
+
+            # Align end to chunk size, the remainder is kept for the next run. 
+            aligned_ds, remainder = self.carry_over.split(source_ds)
+
+            if aligned_ds.timestamp.size == 0:
+                # We have to buffer "< chunk" files, as if upload, we can't append to them later.
+                logger.info(f"Buffering small file {path} until the next run")
+                self.carry_over.save(remainder, self._last_timestamp(), relative_path, source_ds)
+                continue
+
+            self.source_ds = aligned_ds
+            self._upload_source(path, relative_path)
+            self.streamed_paths.append(path)
+
+            self.carry_over.save(remainder, self._last_timestamp(), relative_path, source_ds)
+
+    def _zappend(self, path, config, slice_source):
+        """
+        Append `path` to the target of `config`. zappend writes through its own filesystem, so the 
+        whole append is retried, zappend rolls back a failed append before it's tried again.
+        """
+        self.retry_policy.call(_zappend.zappend, [path], config, slice_source=slice_source,
+                               stats=self.transfer_stats, operation='PUT', target=config['target_dir'])
+
+    def _record_zappend(self, path):
+        """
+        zappend writes through its own filesystem, so its uploads are estimated: the size of the 
+        uploaded data, compressed like the local export. 
+        """
+        size = folder_size(path) if os.path.isdir(path) else os.path.getsize(path)
+        with xr.open_dataset(path, engine='zarr' if os.path.isdir(path) else None) as exported: # type: ignore
+            ratio = size / max(exported.nbytes, 1)
+        uploaded = self.source_ds.drop_dims('high_res_timestamp', errors='ignore')
+        nbytes = int(uploaded.nbytes * ratio)
+        self.transfer_stats.record('PUT', nbytes, self.target_url)
+        # zappend can't be throttled while it writes, the next writes wait for it instead.
+        self._write_limiter.acquire(nbytes)
+
+    def _continues(self, ds1, ds2):
+        """ True if `ds2` can be appended to `ds1` """
+        return self.is_appendable(ds1, ds2, _backup.significant_keys) and \
+            self.is_within_timeframe(ds1, ds2, pd.Timedelta(days=self.settings['streaming_days_per_file']))
+
+    def flush_carry_over(self):
+        """
+        Uploads the rows waiting in the carry-over buffer, for example when the day is over, or the project
+        has stopped. The target they are written to ends with a partial chunk and can't be appended later.
+        """
+        if self.carry_over.is_empty():
+            return
+
+        buffered = self.carry_over.dataset()
+        self.source_ds = buffered
+
+        if buffered.timestamp.size == 0:
+            # only high resolution rows are left, they complete the last target.
+            logger.info(f"Flushing {buffered.sizes['high_res_timestamp']} buffered high resolution timestamps")
+            self.target_url = self.last_url
+            self.streaming_state.on_append_transaction()
+            self.add_high_res()
+            with self.timer.stage('validation'):
                 self.last_url, self.last_ds = self.streaming_state.on_complete_transaction()
-                self.streamed_paths.append(path)
+        else:
+            logger.info(f"Flushing {buffered.timestamp.size} buffered timestamps")
+            self._upload_source(self.carry_over.path, self.carry_over.relative_path)
+
+        empty = buffered.isel({dim: slice(0, 0) for dim in ('timestamp', 'high_res_timestamp') if dim in buffered.dims})
+        self.carry_over.save(empty, self._last_timestamp(), '', buffered)
+
+    def _upload_source(self, path, relative_path):
+        """ Appends `self.source_ds` to the last target, or creates a new target at `relative_path` """
+        # append or create new file? 
+        is_appendable = self.is_appendable(self.last_ds, 
+                           self.source_ds, 
+                           _backup.significant_keys)
+        
+        is_within_timeframe = self.is_within_timeframe(self.last_ds, 
+                                                       self.source_ds, 
+                                                       pd.Timedelta(days=self.settings['streaming_days_per_file'])
+        )
+        
+        if is_appendable and is_within_timeframe:
+            
+            self.target_url = self.last_url
+            config = self.zappend_target_config(self.target_url, self._zappend_storage_options)
+
+            logger.info(f"Appending to {config['target_dir']}")
+            self.streaming_state.on_append_transaction()
+            with self.timer.stage('write'):
+                self._zappend(path, config, self.zappend_append_conform)
+            self._record_zappend(path)
+
+            self.add_high_res()
+
+            # A good catch, where new setup data appeared in the newer files. 
+            # we make sure the concatenated file has all the setup data.
+            with self.timer.stage('setup'):
+                if not self.setup_cache.is_known(self.target_url):
+                    self.setup_cache.seed(self.target_url, self.last_ds)
+                if self.setup_cache.new_entries(self.target_url, self.source_ds):
+                    _backup.append_missing_setup_data_to_target(self.source_ds, self.last_ds, self.target_url, **self.storage_options)
+                    # written by clads, we can only estimate it.
+                    self.transfer_stats.record('PUT', setup_dataset(self.source_ds).nbytes, self.target_url)
+                self.setup_cache.add(self.target_url, self.source_ds)
+            
+        else:
+            
+            fs_parent_path = os.path.join(self.fs_root_path, str(Path(relative_path).parent))
+
+            self.target_url = os.path.join(self.target_root, relative_path)
+            config = self.zappend_target_config(self.target_url, self._zappend_storage_options)
+            
+            logger.info(f"Adding new file {config['target_dir']}")
+            self.streaming_state.on_new_transaction(self.target_url)
+            self.high_res.on_new_target(self.target_url)
+
+            # A Workaround for zappend, as it expects the parent folder to exist.
+            if not self.fs.exists(fs_parent_path):
+                self.fs.touch(os.path.join(fs_parent_path, 'placeholder.txt'))
 
-                # not the most precise way to measure, as high res data is split to a seperate file, 
-                # setup side load file etc.. Good enough for now.
-                self.bytes += folder_size(path)
+            with self.timer.stage('write'):
+                self._zappend(path, config, self.zappend_new_conform)
+            self._record_zappend(path)
+            self.setup_cache.seed(self.target_url, self.source_ds)
+
+            self.add_high_res()
+            
+        # continuation of the same settings or not,
+        # if it's the same project, the setup data is valid, and extendable, 
+        # We continue to append to it.
+        self.maintain_project_setup()
+
+        # complete the transaction
+        with self.timer.stage('validation'):
+            self.last_url, self.last_ds = self.streaming_state.on_complete_transaction()
 
 
     def _progress(self):
-        if self.streamed_paths: 
-            # we made uploads 
+        if self.exported_until is not None: 
+            # we made uploads, or buffered the data for the next run
             self.streamed_paths = []
             self.target_url = ''
-            self.since = self.convert_to_timestamp(self.source_ds.timestamp[-1]) + pd.Timedelta(milliseconds=1)
+            self.since = self.convert_to_timestamp(self.exported_until) + pd.Timedelta(milliseconds=1)
+            self.exported_until = None
 
         else:
-            # we didn't make any uploads, 
+            # we didn't export any data, 
             # we should skip to the next day. 
             self.since = self.since + pd.Timedelta(days=self.settings['streaming_days_per_file'])
 
@@ -283,61 +520,142 @@ class Streaming:
     def stream(self):
 
         start = pd.Timestamp.now()
-        self._discover_timeframe()
+        self.transfer_stats.reset()
+        self.timer.reset()
+        succeeded = False
+        try:
+            self._discover_timeframe()
 
-        while True:
-            self._stream()
+            if self.settings['streaming_pipeline']:
+                self._stream_pipelined()
+            else:
+                while True:
+                    self._stream()
 
-            if not self._progress():
-                break
+                    if not self._progress():
+                        break
+            succeeded = True
+        finally:
+            self.streaming_state.flush()
+            self.push_targets()
+            self._write_metrics(succeeded)
 
         total_seconds = (pd.Timestamp.now() - start).total_seconds()
-        total_mb = self.bytes / 1024 / 1024
+        total_mb = self.transfer_stats.bytes('PUT') / 1024 / 1024
         
-        logger.info(f"Streaming completed in {total_seconds:.2f} seconds,"
+        logger.info(f"Streaming completed in {total_seconds:.2f} seconds, "
                     f"{total_mb:.2f} MB uploaded, at "
-                    f"{total_mb / total_seconds:.2f} MB/s")
+                    f"{total_mb / total_seconds:.2f} MB/s "
+                    f"({self.transfer_stats.summary()})")
 
-    
-    def add_high_res(self): 
+    def push_targets(self):
         """
-        Appends high resolution data to the same folder as the target dataset.  
+        Pushes the local targets to the remote `target_root`, with `streaming_local_first`. 
+        A failed push never fails the run, the next push picks up the backlog.
         """
-        target_url = self.target_url.replace('.zarr', '_high_res.zarr')
+        if self.target_sync is None:
+            return
+        if self.streaming_state.in_transaction():
+            # the next run recovers the transaction first, the partial writes stay local.
+            logger.warning("Not pushing the targets, a transaction is incomplete")
+            return
+        try:
+            with self.timer.stage('push'):
+                self.target_sync.sync()
+        except Exception as exc:
+            logger.warning(f"Could not push the targets to {self.target_sync.remote_url}, "
+                           f"they are pushed by the next run: {exc}")
 
-        drop_dims = set(self.source_ds.dims) - set(['high_res_timestamp'])
+    def _write_metrics(self, succeeded):
+        """ Log the stage timings, and write them to the metrics files. Metrics never fail a run. """
+        stages = self.timer.results()
+        logger.info("Stage timings: " + ", ".join(f"{name} {result['seconds']:.2f}s" for name, result in stages.items()))
 
-        ds = self.source_ds.drop_dims(drop_dims)
+        if self.metrics is None:
+            return
+        try:
+            self.metrics.write({'started': self.timer.started,
+                                'wall_seconds': self.timer.wall_seconds,
+                                'succeeded': succeeded,
+                                'stages': stages,
+                                'transfer': self.transfer_stats.totals(),
+                                'retries': self.transfer_stats.retry_totals()})
+        except Exception as exc:
+            logger.warning(f"Could not write the streaming metrics: {exc}")
 
-        try: 
-            logger.info(f"Appending high resolution data to {target_url}")
-            ds.to_zarr(target_url, append_dim='high_res_timestamp', mode='a-', storage_options=self.storage_options) # type: ignore
-        except Exception as e:
-            logger.info(f"Creating new high resolution data at {target_url}")
-            ds.to_zarr(target_url, mode='w', storage_options=self.storage_options)
+    def close(self, flush: bool = False):
+        """
+        Release the streaming state file, the instance can't stream afterwards. 
+        With `flush`, the rows waiting in the carry-over buffer are uploaded first, for when the project 
+        stops or the streamer shuts down. Otherwise they wait for the next run. 
+        """
+        try:
+            if flush and not self.carry_over.is_empty():
+                is_available, result = self._validated_last_target()
+                if is_available:
+                    self.last_url, self.last_ds = result
+                # a buffer that no longer continues the last target is discarded, and exported again.
+                if self.carry_over.validate(self._last_timestamp() if is_available else None):
+                    self.flush_carry_over()
+                self.push_targets()
+        finally:
+            self.streaming_state.close()
+
+    
+    @timed_stage('high_res')
+    def add_high_res(self): 
+        """
+        Appends high resolution data to the same folder as the target dataset.  
+        Whether to create or append is known from the transaction (see `HighResAppender`), 
+        a failing write is a failed transaction, never a reason to overwrite the data.
+        """
+        self.high_res.append(self.target_url, self.source_ds)
 
 
 
+    @timed_stage('setup')
     def maintain_project_setup(self):
 
         # build the sideload filepath, which should be in the same folder: 
         path = urlparse(self.target_url).path
-        setup_url = self.target_url.replace(path, str(Path(path).parent / setup_sideload_path))
+        setup_url = self.target_url.replace(path, str(Path(path).parent / _backup.setup_sideload_path))
+
+        # Most transactions don't change the setup, we don't need to touch the remote file at all.
+        if self.setup_cache.is_known(setup_url) and not self.setup_cache.new_entries(setup_url, self.source_ds):
+            return
 
         # TODO: There is a risk that this file could get corrupt. It would get recreated but possibly with missing data.
         try: 
-            last_setup_ds = xr.open_zarr(setup_url, storage_options=self.storage_options)
-            append_missing_setup_data_to_target(self.source_ds, last_setup_ds, setup_url, **self.storage_options)
+            last_setup_ds = xr.open_zarr(**zarr_store_kwargs(setup_url, self.transfer_stats, self._write_limiter, self.retry_policy, **self.storage_options))
+            self.setup_cache.seed(setup_url, last_setup_ds)
+            if self.setup_cache.new_entries(setup_url, self.source_ds):
+                _backup.append_missing_setup_data_to_target(self.source_ds, last_setup_ds, setup_url, **self.storage_options)
+                self.transfer_stats.record('PUT', setup_dataset(self.source_ds).nbytes, setup_url)
+            self.setup_cache.add(setup_url, self.source_ds)
         except FileNotFoundError:
-            drop_dims = set(self.source_ds.dims) - set(['retro', 'settings_id'])
-            setup_ds = self.source_ds.drop_dims(drop_dims)
-            setup_ds.to_zarr(setup_url, mode='w', storage_options=self.storage_options)
+            setup_ds = setup_dataset(self.source_ds)
+            setup_ds.to_zarr(mode='w', **zarr_store_kwargs(setup_url, self.transfer_stats, self._write_limiter, self.retry_policy, **self.storage_options))
+            self.setup_cache.seed(setup_url, setup_ds)
             logger.info(f"Created new setup dataset for the project. {setup_url}")
         except Exception as e:
             logger.warning(f"Could not load setup data for the project, will ignore. {setup_url}: {e}")
         
 
 
+    @staticmethod
+    def zappend_target_config(target_url: str, storage_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        zappend configuration for `target_url`. The target is set on the configuration itself rather than
+        through the `CLADS_BACKUP_UPLOAD_TARGET` environment variable, which is shared by all the 
+        streams running in the process. `storage_options` replace the Azure credentials, e.g. for local targets.
+        """
+        config = yaml.safe_load(os.path.expandvars(str(zappend_config)))
+        config['target_dir'] = target_url
+        if storage_options is not None:
+            config['target_storage_options'] = dict(storage_options)
+        return config
+
+    @timed_stage('conform')
     def zappend_append_conform(self, path:str) -> xr.Dataset: #
         """
         zappend expects all dimensions other than the append dimension to have the same size/contents
@@ -358,6 +676,7 @@ class Streaming:
         ds = ds.drop_dims('high_res_timestamp', errors='ignore')
         return ds
     
+    @timed_stage('conform')
     def zappend_new_conform(self, path:str) -> xr.Dataset: #
 
         ds = self.source_ds.drop_dims('high_res_timestamp', errors='ignore')
@@ -365,15 +684,19 @@ class Streaming:
 
 
     def _update_until(self):
+        self.until = self._until_for(self.since)
+
+    def _until_for(self, since):
         # Where do we stop? 
         # if we are catching up, we try to do a large pieces, at least a day:
-        cutoff = self.since.replace(hour=00, minute=00, second=00, microsecond=0) + pd.Timedelta(days=self.settings['streaming_days_per_file'])
+        cutoff = since.replace(hour=00, minute=00, second=00, microsecond=0) + pd.Timedelta(days=self.settings['streaming_days_per_file'])
 
         # we add a bit of extra, to guarantee a full chunk.
         cutoff += pd.Timedelta(minutes=self.settings['streaming_minutes'])
         
         # we shouldn't stream past any of these. 
-        self.until = min(cutoff, pd.Timestamp.now(), self.until_hint)
+        now = pd.Timestamp.now()
+        return min(cutoff, now, self.until_hint if self.until_hint is not None else now)
 
 
     @staticmethod
@@ -447,6 +770,10 @@ class StreamingState:
     """
     Manages stateful variables and their relationships for a streaming process, 
     on a local transaction safe, `streaming_state.yaml` file.
+
+    Transitions are appended to a `streaming_state.yaml.journal` file and periodically checkpointed into 
+    `streaming_state.yaml` with an atomic rename (see `ice_stream.journal`), so a power loss can't leave a 
+    torn state file behind. Each state file is locked by its owner, one state file per project stream.
     
     This class ensures the integrity and consistency of these variables throughout the lifecycle of the streaming process. 
     Users should interact with these variables through the provided methods to maintain proper state management and 
@@ -454,15 +781,22 @@ class StreamingState:
     
     Methods:
         load_state: Loads the streaming state from a YAML file, initializing state variables.
-        save_state: Persists the current state to the YAML file, ensuring data consistency.
+        save_state: Persists the current state to the journal, ensuring data consistency.
+        flush: Makes coalesced transitions durable, should be called once streaming is done. 
         on_delete: Should be called once the delete path has been deleted successfully.
         on_begin_transaction: Should be called before attempting to append/update cloud target path. 
         on_complete_transaction: Should be called once the transactions on the target path is complete. 
         on_new_file: Should be called when we are creating a new file on the cloud root path. For example when we start a new day or have to split the day for a settings change. 
     """    
 
-    def __init__(self, state_file_path: str, target_root: str, **storage_options: Dict[str, str]):
+    def __init__(self, state_file_path: str, target_root: str, index_key: str = '', 
+                 transfer_stats: Optional[TransferStats] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None, on_discard: Optional[Callable[[str], None]] = None,
+                 **storage_options: Dict[str, str]):
         self.state_file_path: str = state_file_path
+        # told about targets deleted or rolled back, e.g. to drop what is cached about them.
+        self.on_discard = on_discard
+        self._journal = StateJournal(state_file_path)
         self._state_data: Dict[str, str] = self.load_state()
         self.target_root = target_root
 
@@ -471,41 +805,71 @@ class StreamingState:
                                 'penultimate_valid_target': '', # The target path before the last valid target.
                                 'incomplete_target': ''         # Target path that is being updated, should be deleted if the transaction fails.
             }  # Initialize with default values
-            self.save_state()  # Save the state to create the file with default values
+            self._journal.checkpoint(self._state_data)  # Create the checkpoint with default values
 
         parsed = urlparse(target_root)
         self.storage_options = storage_options
-        self.fs = fsspec.filesystem(parsed.scheme, auto_mkdir=True, **storage_options)
+        self.fs = fsspec.filesystem(parsed.scheme, **{'auto_mkdir': True, **storage_options})
+        if transfer_stats is not None:
+            self.fs = InstrumentedFileSystem(self.fs, transfer_stats, target_root, rate_limiter, retry_policy)
+
+        # head pointer and index of the project's targets, for a cheap recovery of the last valid target.
+        # Without a key, the index is named after the folder of the project's targets, `<instrument>/<project>`, 
+        # unlike the local folder name it is unique at the target root. Unknown until a target is.
+        self._index_key = index_key
+        known_target = next((self._state_data[key] for key in ('incomplete_target', 'last_valid_target', 
+                                                               'penultimate_valid_target') if self._state_data[key]), '')
+        prefix = self._target_prefix(known_target)
+        self.target_index = TargetIndex(self.fs, target_root, index_key or prefix, prefix)
+        self._new_target = ''
 
     def load_state(self) -> Dict[str, str]:
-        """Load the streaming state from the YAML file."""
-        try:
-            with open(self.state_file_path, 'r') as file:
-                return yaml.safe_load(file) or {}
-        except FileNotFoundError:
-            logger.warning(f"Could not find an existing streaming state file.")            
-            return {}  # Return an empty dictionary if the file does not exist
-        except yaml.YAMLError as exc:
-            logger.warning(f"Error loading the streaming state file: {exc}")
-            return {}
-
-    def save_state(self):
-        """Save the current state to the YAML file."""
-        with open(self.state_file_path, 'w') as file:
-            try:
-                yaml.safe_dump(self._state_data, file)
-            except yaml.YAMLError as exc:
-                logger.error(f"Error saving to the streamin state file: {exc}")
+        """Load the streaming state from the YAML checkpoint and replay the journal."""
+        return self._journal.load()
+
+    def save_state(self, durable: bool = True):
+        """
+        Journal the current state. 
+        
+        Transitions that precede a change on the cloud target must be `durable`, so a failure can always be 
+        rolled back. Other transitions can be coalesced with the next durable one, losing them only costs 
+        a re-upload.
+        """
+        self._journal.append(self._state_data, durable=durable)
+
+    def flush(self):
+        """Make any coalesced transitions durable."""
+        self._journal.flush()
+
+    def close(self):
+        """Checkpoint the state and release the state file."""
+        self._journal.close(self._state_data)
+
+    def in_transaction(self) -> bool:
+        """True if a transaction was started and not completed, e.g. it failed."""
+        return bool(self._state_data['incomplete_target'])
+
+    def is_settled(self, last_url: str) -> bool:
+        """True if `last_url` is still the last valid target, and there is no transaction to recover from."""
+        return bool(last_url) and not self._state_data['incomplete_target'] and \
+            self._state_data['last_valid_target'] == last_url
 
     def on_deleted(self): 
+        self._discard(self._state_data['incomplete_target'])
         self._state_data['incomplete_target'] = ''
-        self.save_state()
+        # if lost, we will attempt to delete an already deleted target again.
+        self.save_state(durable=False)
+
+    def _discard(self, target: str):
+        if target and self.on_discard is not None:
+            self.on_discard(target)
 
     def on_new_transaction(self, file_path:str):
         self._state_data['penultimate_valid_target'] = self._state_data['last_valid_target']
         # no change on,  self._state_data['last_valid_target'], we won't corrupt it. 
         self._state_data['incomplete_target'] = file_path
         self.save_state()
+        self._new_target = file_path
 
     def on_append_transaction(self):
         self._state_data['incomplete_target'] = self._state_data['last_valid_target']
@@ -515,11 +879,36 @@ class StreamingState:
     def on_complete_transaction(self):
         self._state_data['last_valid_target'] = self._state_data['incomplete_target'] 
         self._state_data['incomplete_target'] = ''
+        # durable, a lost completion would make the next start delete the uploaded target.
         self.save_state()
 
         ds = load_validate_target_path(self._state_data['last_valid_target'], **self.storage_options)
 
+        if self._new_target and self._new_target == self._state_data['last_valid_target']:
+            self._record_target(self._new_target, ds)
+        self._new_target = ''
+
         return (self._state_data['last_valid_target'], ds)
+
+    def _target_prefix(self, target: str) -> Optional[str]:
+        """ The folder of `target` relative to the target root, e.g. `<instrument>/<project>`, None if unknown. """
+        root = self.target_root.rstrip('/') + '/'
+        if not target.startswith(root):
+            return None
+        return posixpath.dirname(target[len(root):].rstrip('/'))
+
+    def _record_target(self, target: str, ds: Optional[xr.Dataset]):
+        """ Make `target` the head of the target index. The data is safe either way, a failure only costs a slower recovery. """
+        start = None
+        if ds is not None and ds.timestamp.size > 0:
+            start = pd.Timestamp(ds.timestamp.values[0]).isoformat()
+        prefix = self._target_prefix(target)
+        if prefix is not None and prefix != self.target_index.prefix:
+            self.target_index = TargetIndex(self.fs, self.target_root, self._index_key or prefix, prefix)
+        try:
+            self.target_index.record(target, start)
+        except Exception as exc:
+            logger.warning(f"Could not update the target index with {target}: {exc}")
     
     def initialize_and_validate_paths(self) -> Tuple[bool, Optional[Tuple[str, xr.Dataset]]]:
         """
@@ -542,7 +931,7 @@ class StreamingState:
             logger.warning(f"Deleting corrupt target: {incomplete_target}")
             try:
 
-                @retry(stop=stop_after_attempt(3))
+                # `self.fs` retries the transient errors of each request, see `ice_stream.retry`.
                 def delete_data(incomplete_target:str):
                     parsed = urlparse(incomplete_target)
                     self.fs.rm(parsed.netloc + parsed.path, recursive=True)
@@ -561,7 +950,7 @@ class StreamingState:
                 self.on_deleted()
 
             # If it's missing we can safely assume it's already deleted. 
-            except (FileNotFoundError, RetryError):
+            except FileNotFoundError:
                 logger.warning(f"Could not find {incomplete_target}, assuming it's already deleted")
                 self.on_deleted()
             
@@ -587,25 +976,21 @@ class StreamingState:
                 # but can't think of an error condition where the last_valid_target disappears, 
                 # and the penultimate one is valid, if `on_append_transaction` is used correctly. 
                 
-                # instead we look for the last file in the target root path
-                # this is an expensive operation.
+                # instead we look for the project's newest target, in its head pointer and index, 
+                # and only list the target root path if they are missing. 
                 logger.warning(f"Could not validate the last valid target {self._state_data['last_valid_target']}")
+                self._discard(self._state_data['last_valid_target'])
+                logger.warning(f"Attempting to find the last valid target in the target index of {self.target_root}")
 
-                # get a list of all the files. 
-                logger.warning(f"Attempting to find the last valid target in the target root path: {self.target_root} \n"
-                               f"depending on the number of files, this may take a while")    
-                
-                urls = get_cloud_files(self.target_root, **self.storage_options)
-                                    
-                files = sorted([Path(urlparse(url).path).parts[-1] for url in urls])
-
-                if len(files):
-                    #TODO: If the found file was corrupted at some stage after it was uploaded 
-                    # it's going to cause a problem. 
-                    last_valid_target = [url for url in urls if files[-1] in url][0]
+                last_valid_target, ds = self.target_index.find_last_valid(
+                    lambda url: load_validate_target_path(url, **self.storage_options),
+                    exclude=lambda name: name.endswith('_high_res.zarr') or name == Path(_backup.setup_sideload_path).name)
+
+                if last_valid_target:
                     self._state_data['last_valid_target'] = last_valid_target
                     self.save_state()
-                    ds = load_validate_target_path(last_valid_target, **self.storage_options)
+                    # repair the head, so the next recovery doesn't have to look again.
+                    self._record_target(last_valid_target, ds)
                 else:
                     self._state_data['last_valid_target'] = ''
                     self.save_state()
@@ -623,7 +1008,7 @@ class StreamingState:
 
 def ensure_upload_path(fsspec_url: str,  **storage_options: Dict[str, str]) -> str:
     parsed = urlparse(fsspec_url)
-    fs = fsspec.filesystem(parsed.scheme, auto_mkdir=True, **storage_options)
+    fs = fsspec.filesystem(parsed.scheme, **{'auto_mkdir': True, **storage_options})
 
     if not fs.exists(parsed.netloc + parsed.path):
         fs.makedirs(parsed.netloc + parsed.path)
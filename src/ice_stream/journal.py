@@ -0,0 +1,205 @@
+"""Crash-consistent persistence for small state dictionaries.
+
+The streaming state machine only tracks a handful of target paths, but it must
+survive power loss on field computers. Rewriting a YAML file in place can leave
+it empty or torn, so state is persisted as:
+
+* an append-only journal (``<checkpoint>.journal``) with one self-checking JSON
+  record per transition, and
+* a YAML checkpoint that is replaced atomically (temp file, ``fsync``,
+  ``os.replace``) and compacts the journal.
+
+On startup the checkpoint is loaded and the journal replayed on top of it. A
+torn trailing record is ignored, which leaves the state of the last durable
+transition.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import zlib
+from typing import Any
+
+import yaml
+from loguru import logger
+
+try:  # advisory locking is not available on every platform
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+class JournalLockedError(RuntimeError):
+    """Raised when another stream already owns a state journal."""
+
+
+def _fsync_dir(path: str) -> None:
+    """Flush the directory entry of *path* so a rename survives power loss."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _encode_record(seq: int, state: dict[str, Any]) -> bytes:
+    payload = json.dumps({"seq": seq, "state": state}, sort_keys=True)
+    crc = zlib.crc32(payload.encode("utf-8"))
+    return f"{crc:08x} {payload}\n".encode("utf-8")
+
+
+def _decode_record(line: bytes) -> dict[str, Any] | None:
+    """Return the record stored in *line*, or ``None`` if it is torn/corrupt."""
+    try:
+        text = line.decode("utf-8").rstrip("\n")
+        crc, payload = text.split(" ", 1)
+        if int(crc, 16) != zlib.crc32(payload.encode("utf-8")):
+            return None
+        return json.loads(payload)
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+class StateJournal:
+    """
+    Journaled, atomically checkpointed storage for a flat state ``dict``.
+
+    Each call to :meth:`append` records a full snapshot of the state, so replay
+    simply keeps the newest intact record. Appends may be *coalesced*: a
+    non-durable append is kept in memory and written together with the next
+    durable one (or on :meth:`flush`), costing a single ``fsync`` for several
+    transitions. Only use non-durable appends for transitions whose loss is
+    recoverable, e.g. the deletion of a corrupt target, which at worst is
+    attempted again.
+
+    The journal holds an exclusive advisory lock on its file for its lifetime,
+    so two streams (threads or processes) can never share a state file by
+    accident. Independent journals do not share any state, which allows many
+    project streams to run concurrently in one process.
+
+    Parameters
+    ----------
+    checkpoint_path : str
+        Path of the YAML checkpoint. The journal lives next to it.
+    checkpoint_every : int, optional
+        Number of journal records after which the journal is compacted into a
+        new checkpoint.
+    """
+
+    def __init__(self, checkpoint_path: str, checkpoint_every: int = 32) -> None:
+        self.checkpoint_path = checkpoint_path
+        self.journal_path = checkpoint_path + ".journal"
+        self.checkpoint_every = checkpoint_every
+
+        self._lock = threading.Lock()
+        self._pending: dict[str, Any] | None = None
+        self._records = 0
+        self._seq = 0
+
+        self._fh = open(self.journal_path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as exc:
+                self._fh.close()
+                raise JournalLockedError(
+                    f"State journal {self.journal_path} is in use by another stream"
+                ) from exc
+
+    def load(self) -> dict[str, Any]:
+        """Return the checkpoint with all intact journal records replayed."""
+        state: dict[str, Any] = {}
+        try:
+            with open(self.checkpoint_path, "r") as file:
+                state = yaml.safe_load(file) or {}
+        except FileNotFoundError:
+            logger.warning("Could not find an existing streaming state file.")
+        except yaml.YAMLError as exc:
+            logger.warning(f"Error loading the streaming state file: {exc}")
+
+        replayed = 0
+        torn = False
+        with open(self.journal_path, "rb") as file:
+            for line in file:
+                record = _decode_record(line)
+                if record is None:
+                    # Only the tail can be torn, anything after it is unusable.
+                    logger.warning(f"Ignoring torn record in {self.journal_path}")
+                    torn = True
+                    break
+                state = dict(record["state"])
+                self._seq = max(self._seq, int(record["seq"]))
+                replayed += 1
+
+        if replayed:
+            logger.info(f"Replayed {replayed} streaming state transitions from the journal")
+        if replayed or torn:
+            # A torn tail must not stay in the journal, the next record would be
+            # appended to the broken line and lost on the next replay.
+            self.checkpoint(state)
+        return state
+
+    def append(self, state: dict[str, Any], durable: bool = True) -> None:
+        """Record *state*; ``durable=False`` defers the write to the next flush."""
+        with self._lock:
+            self._pending = dict(state)
+            if durable:
+                self._write_pending()
+
+    def flush(self) -> None:
+        """Write and ``fsync`` any coalesced, not yet durable state."""
+        with self._lock:
+            self._write_pending()
+
+    def checkpoint(self, state: dict[str, Any]) -> None:
+        """Atomically replace the checkpoint with *state* and truncate the journal."""
+        with self._lock:
+            self._pending = None
+            self._checkpoint(state)
+
+    def close(self, state: dict[str, Any] | None = None) -> None:
+        """Flush pending state (checkpointing *state* if given) and release the lock."""
+        if self._fh.closed:
+            return
+        if state is not None:
+            self.checkpoint(state)
+        else:
+            self.flush()
+        self._fh.close()
+
+    def _write_pending(self) -> None:
+        if self._pending is None:
+            return
+        self._seq += 1
+        self._fh.write(_encode_record(self._seq, self._pending))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._records += 1
+        state, self._pending = self._pending, None
+
+        if self._records >= self.checkpoint_every:
+            self._checkpoint(state)
+
+    def _checkpoint(self, state: dict[str, Any]) -> None:
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            yaml.safe_dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        _fsync_dir(self.checkpoint_path)
+
+        # Replaying the old records over the new checkpoint is harmless (the
+        # newest record equals the checkpoint), so a crash before this point
+        # is safe.
+        self._fh.truncate(0)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._records = 0
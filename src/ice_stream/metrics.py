@@ -0,0 +1,255 @@
+"""Per-stage timing of streaming runs.
+
+A streaming run is timed stage by stage: discover, export, conform, write,
+high_res, setup and validation. Stages nest, e.g. zappend calls the conform
+step while writing, and every stage is reported with its *exclusive* time, so
+the stages of a run add up to the time spent in them.
+
+After each run the results are written as:
+
+* a JSON document with the last run (``streaming_metrics.json``), and
+* a Prometheus textfile-collector file, with histograms of the stage and run
+  durations across runs. The histogram state is kept in a small JSON file
+  next to it, so cron runs accumulate like a long running process would.
+
+Both files are replaced atomically, the textfile collector never reads a
+partial file.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from ._io import atomic_write
+
+STAGES = ("discover", "export", "conform", "write", "high_res", "setup", "validation")
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+class StageTimer:
+    """
+    Accumulates the exclusive time spent in named stages, from any thread.
+
+    Parameters
+    ----------
+    clock : callable, optional
+        Monotonic clock in seconds, by default :func:`time.perf_counter`.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a new run."""
+        with self._lock:
+            self._seconds: dict[str, float] = {}
+            self._counts: dict[str, int] = {}
+            self.started = time.time()
+            self._start = self.clock()
+
+    @property
+    def wall_seconds(self) -> float:
+        return self.clock() - self._start
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the block as stage *name*, excluding the stages nested in it."""
+        stack = self._local.__dict__.setdefault("stack", [])
+        # [name, start, time spent in nested stages]
+        frame = [name, self.clock(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = self.clock() - frame[1]
+            if stack:
+                stack[-1][2] += elapsed
+            with self._lock:
+                self._seconds[name] = self._seconds.get(name, 0.0) + elapsed - frame[2]
+                self._counts[name] = self._counts.get(name, 0) + 1
+
+    def results(self) -> dict[str, dict[str, float]]:
+        """Exclusive seconds and number of calls of each stage that ran."""
+        with self._lock:
+            return {
+                name: {"seconds": self._seconds[name], "count": self._counts[name]}
+                for name in sorted(self._seconds, key=lambda n: (STAGES.index(n) if n in STAGES else len(STAGES), n))
+            }
+
+
+def timed_stage(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorate a method to time it as stage *name* on ``self.timer``."""
+
+    def decorator(method: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(method)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            with self.timer.stage(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: object) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_float(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class MetricsWriter:
+    """
+    Writes the metrics of streaming runs to JSON and to a Prometheus textfile.
+
+    Parameters
+    ----------
+    json_path : str
+        Where to write the last run as JSON.
+    textfile_path : str
+        Prometheus textfile-collector file (``*.prom``).
+    state_path : str
+        Where to keep the histogram state between runs.
+    project : str
+        Value of the ``project`` label.
+    buckets : tuple of float, optional
+        Upper bounds of the histogram buckets, in seconds.
+    """
+
+    def __init__(
+        self,
+        json_path: str,
+        textfile_path: str,
+        state_path: str,
+        project: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.json_path = json_path
+        self.textfile_path = textfile_path
+        self.state_path = state_path
+        self.project = project
+        self.buckets = tuple(sorted(buckets))
+
+    def _load_state(self) -> dict[str, Any]:
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {"buckets": list(self.buckets), "histograms": {}}
+        if state.get("buckets") != list(self.buckets):
+            # the buckets changed, the old observations can't be redistributed.
+            return {"buckets": list(self.buckets), "histograms": {}}
+        return state
+
+    def _observe(self, histograms: dict[str, Any], key: str, value: float) -> None:
+        histogram = histograms.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram["counts"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def write(self, run: dict[str, Any]) -> None:
+        """
+        Record *run* and rewrite the JSON and textfile outputs.
+
+        *run* holds ``started`` (unix time), ``wall_seconds``, ``succeeded``, ``stages``
+        as returned by :meth:`StageTimer.results` and optionally ``transfer``, the
+        totals of a :class:`~ice_stream.transfer.TransferStats`, and ``retries``, its
+        retry totals.
+        """
+        run = {"project": self.project, **run}
+        atomic_write(self.json_path, json.dumps(run, indent=2, default=str) + "\n")
+
+        state = self._load_state()
+        histograms = state["histograms"]
+        self._observe(histograms, "run", run["wall_seconds"])
+        for stage, result in run["stages"].items():
+            self._observe(histograms, f"stage:{stage}", result["seconds"])
+        atomic_write(self.state_path, json.dumps(state))
+
+        atomic_write(self.textfile_path, self._textfile(run, histograms))
+
+    def _histogram_lines(self, metric: str, histogram: dict[str, Any], **labels: str) -> list[str]:
+        lines = []
+        for bound, count in zip(self.buckets, histogram["counts"]):
+            lines.append(f"{metric}_bucket{_labels(**labels, le=_format_float(bound))} {count}")
+        lines.append(f"{metric}_bucket{_labels(**labels, le='+Inf')} {histogram['count']}")
+        lines.append(f"{metric}_sum{_labels(**labels)} {_format_float(histogram['sum'])}")
+        lines.append(f"{metric}_count{_labels(**labels)} {histogram['count']}")
+        return lines
+
+    def _textfile(self, run: dict[str, Any], histograms: dict[str, Any]) -> str:
+        project = self.project
+        lines = [
+            "# HELP ice_stream_run_seconds Wall time of streaming runs.",
+            "# TYPE ice_stream_run_seconds histogram",
+            *self._histogram_lines("ice_stream_run_seconds", histograms["run"], project=project),
+            "# HELP ice_stream_stage_seconds Exclusive time spent in each stage of a streaming run.",
+            "# TYPE ice_stream_stage_seconds histogram",
+        ]
+        for key in sorted(k for k in histograms if k.startswith("stage:")):
+            lines += self._histogram_lines("ice_stream_stage_seconds", histograms[key], project=project, stage=key[6:])
+
+        lines += [
+            "# HELP ice_stream_last_run_stage_seconds Exclusive time spent in each stage of the last run.",
+            "# TYPE ice_stream_last_run_stage_seconds gauge",
+        ]
+        for stage, result in run["stages"].items():
+            lines.append(
+                f"ice_stream_last_run_stage_seconds{_labels(project=project, stage=stage)} "
+                f"{_format_float(result['seconds'])}"
+            )
+
+        lines += [
+            "# HELP ice_stream_last_run_timestamp_seconds Start of the last run, unix time.",
+            "# TYPE ice_stream_last_run_timestamp_seconds gauge",
+            f"ice_stream_last_run_timestamp_seconds{_labels(project=project)} {_format_float(run['started'])}",
+            "# HELP ice_stream_last_run_success 1 if the last run succeeded.",
+            "# TYPE ice_stream_last_run_success gauge",
+            f"ice_stream_last_run_success{_labels(project=project)} {int(bool(run['succeeded']))}",
+        ]
+
+        transfer = run.get("transfer")
+        if transfer:
+            lines += [
+                "# HELP ice_stream_last_run_transfer_bytes Bytes transferred in the last run, by operation.",
+                "# TYPE ice_stream_last_run_transfer_bytes gauge",
+                *(
+                    f"ice_stream_last_run_transfer_bytes{_labels(project=project, operation=op)} {counts['bytes']}"
+                    for op, counts in transfer.items()
+                ),
+                "# HELP ice_stream_last_run_transfer_requests Requests made in the last run, by operation.",
+                "# TYPE ice_stream_last_run_transfer_requests gauge",
+                *(
+                    f"ice_stream_last_run_transfer_requests{_labels(project=project, operation=op)} {counts['requests']}"
+                    for op, counts in transfer.items()
+                ),
+            ]
+
+        retries = run.get("retries")
+        if retries:
+            lines += [
+                "# HELP ice_stream_last_run_transfer_retries Requests retried in the last run, by operation.",
+                "# TYPE ice_stream_last_run_transfer_retries gauge",
+                *(
+                    f"ice_stream_last_run_transfer_retries{_labels(project=project, operation=op)} {count}"
+                    for op, count in retries.items()
+                ),
+            ]
+        return "\n".join(lines) + "\n"
@@ -1,14 +1,23 @@
+import functools
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import xarray as xr
 import numpy as np
 import pandas as pd
-from typing import Optional, List, Union
+from typing import Callable, Iterator, Optional, List, Union
 from pathlib import Path
-from zarr.storage import ZipStore
-import icechunk
 
+from ._lazy import lazy_import
 from .blocks import upload_single_chunk
 
+icechunk = lazy_import("icechunk")
+zarr_storage = lazy_import("zarr.storage")
+
 
 # Compressor spec used for generated mock data and icechunk uploads
 DEFAULT_COMPRESSOR = {
@@ -17,15 +26,42 @@ DEFAULT_COMPRESSOR = {
 }
 
 
-def _open_seed_dataset(path: Union[str, Path]) -> xr.Dataset:
-    """Open a dataset from NetCDF or zipped zarr."""
-    p = Path(path)
+def _seed_key(path: Union[str, Path]) -> tuple[str, int, int]:
+    """Identifies a version of a seed file: its path, modification time and size."""
+    p = Path(path).resolve()
+    stat = p.stat()
+    return str(p), stat.st_mtime_ns, stat.st_size
+
+
+def _freeze(ds: xr.Dataset) -> xr.Dataset:
+    """Clear the encodings of *ds* and make its arrays read-only, it is shared by every caller."""
+    for var in ds.variables.values():
+        var.encoding = {}
+        if not isinstance(var, xr.IndexVariable) and isinstance(var.data, np.ndarray):
+            var.data.flags.writeable = False
+    return ds
+
+
+@functools.lru_cache(maxsize=8)
+def _load_seed(key: tuple[str, int, int]) -> xr.Dataset:
+    p = Path(key[0])
     if p.suffix == ".zip":
-        with ZipStore(p, mode="r") as store:
+        with zarr_storage.ZipStore(p, mode="r") as store:
             ds = xr.open_zarr(store)
             ds.load()
-        return ds
-    return xr.open_dataset(p)
+    else:
+        with xr.open_dataset(p) as ds:
+            ds.load()
+    return _freeze(ds)
+
+
+def _open_seed_dataset(path: Union[str, Path]) -> xr.Dataset:
+    """Open a dataset from NetCDF or zipped zarr, loaded and without encodings.
+
+    Seeds are loaded once per path and modification time. The arrays are shared
+    by all the callers and read-only, the returned dataset is a shallow copy.
+    """
+    return _load_seed(_seed_key(path)).copy(deep=False)
 
 
 def build_blob_base_path(ds: xr.Dataset, base: Optional[Union[str, Path]] = None) -> Path:
@@ -44,10 +80,36 @@ def build_blob_base_path(ds: xr.Dataset, base: Optional[Union[str, Path]] = None
     return root / instrument / project
 
 
+def _repository_dataset(ds_seed: xr.Dataset) -> xr.Dataset:
+    """*ds_seed* loaded, with the mock compressor as only encoding, sharing the seed's arrays."""
+    ds = ds_seed.load().copy(deep=False)
+    for name, var in ds.variables.items():
+        var.encoding = {"compressors": [DEFAULT_COMPRESSOR]} if var.dtype.kind not in {"O", "S"} else {}
+    return ds
+
+
+def _repository_name(ds: xr.Dataset, ts: np.datetime64) -> str:
+    ts_str = (
+        np.datetime_as_string(ts, unit="s")
+        .replace("T", "t")
+        .replace(":", "-")
+        + "z"
+    )
+    instrument = ds.attrs.get("instrument", "")
+    project = ds.attrs.get("project", "")
+    return f"inst-{instrument}-prj-{project}-{ts_str}l1b"
+
+
+def _local_storage(path: Path) -> "icechunk.Storage":
+    return icechunk.local_filesystem_storage(str(path))
+
+
 def generate_ice_chunk_repositories(
     seed_file: Union[str, Path],
     count: int = 1,
     base: Optional[Union[str, Path]] = None,
+    max_workers: Optional[int] = None,
+    storage_factory: Optional[Callable[[Path], "icechunk.Storage"]] = None,
 ) -> List[Path]:
     """Create *count* icechunk repositories from *seed_file*.
 
@@ -56,42 +118,647 @@ def generate_ice_chunk_repositories(
     Each repository name follows the pattern
     ``inst-<instrument>-prj-<project>-<YYYY-MM-DDtHH-mm-SSz>l1b`` and a unique
     timestamp is generated for every repository created.
+
+    The seed is loaded once and shared, read-only, by all the repositories,
+    which are created concurrently by *max_workers* threads.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Repositories created at the same time, by default the
+        :class:`~concurrent.futures.ThreadPoolExecutor` default.
+    storage_factory : callable, optional
+        Returns the icechunk storage of a repository from its path, e.g. an
+        Azure storage using the path as prefix, or ``icechunk.in_memory_storage()``.
+        By default the repositories are created on the local filesystem.
     """
 
-    ds_seed = _open_seed_dataset(seed_file)
+    ds = _repository_dataset(_open_seed_dataset(seed_file))
+    base_ts = np.datetime64(ds["timestamp"].values[0], "s")
+    repo_base = build_blob_base_path(ds, base)
+    if storage_factory is None:
+        repo_base.mkdir(parents=True, exist_ok=True)
+        storage_factory = _local_storage
+
+    def create(i: int) -> Path:
+        repo_path = repo_base / _repository_name(ds, base_ts + np.timedelta64(i, "s"))
+        repo = icechunk.Repository.create(storage_factory(repo_path))
+        upload_single_chunk(repo, ds)
+        return repo_path
 
-    paths: List[Path] = []
-    base_ts = np.datetime64(ds_seed["timestamp"].values[0], "s")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mock-repos") as pool:
+        return list(pool.map(create, range(count)))
 
-    for i in range(count):
-        ds = ds_seed.copy(deep=True)
-        for var in ds.variables:
-            ds[var].encoding.clear()
-            if ds[var].dtype.kind not in {"O", "S"}:
-                ds[var].encoding["compressors"] = [DEFAULT_COMPRESSOR]
 
-        repo_base = build_blob_base_path(ds, base)
-        repo_base.mkdir(parents=True, exist_ok=True)
+TIME_DIMS = ("timestamp", "high_res_timestamp")
 
-        ts = base_ts + np.timedelta64(i, "s")
-        ts_str = (
-            np.datetime_as_string(ts, unit="s")
-            .replace("T", "t")
-            .replace(":", "-")
-            + "z"
-        )
-        instrument = ds.attrs.get("instrument", "")
-        project = ds.attrs.get("project", "")
-        repo_name = f"inst-{instrument}-prj-{project}-{ts_str}l1b"
-        repo_path = repo_base / repo_name
 
-        storage = icechunk.local_filesystem_storage(str(repo_path))
-        repo = icechunk.Repository.create(storage)
-        upload_single_chunk(repo, ds)
+def _strictly_increasing(values: np.ndarray) -> np.ndarray:
+    """
+    Sorted *values* with each duplicate moved 1ns after its predecessor.
+
+    Equivalent to ``v[i] = max(v[i], v[i - 1] + 1ns)`` in order: shifting by the
+    index turns the repair into a running maximum.
+    """
+    ns = values.astype("datetime64[ns]").view(np.int64)
+    index = np.arange(len(ns), dtype=np.int64)
+    return (np.maximum.accumulate(ns - index) + index).view("datetime64[ns]")
+
+
+@functools.lru_cache(maxsize=8)
+def _load_prepared_seed(key: tuple[str, int, int]) -> xr.Dataset:
+    # Some test fixtures ship with unsorted coordinates which can cause slice
+    # operations using ``xarray``/``pandas`` to raise ``KeyError``. Sorting
+    # provides a stable base for our replication logic.
+    ds_seed = _load_seed(key)
+    if 'high_res_timestamp' in ds_seed.coords:
+        ds_seed = ds_seed.sortby('high_res_timestamp')
+        hrs = _strictly_increasing(ds_seed['high_res_timestamp'].values)
+        ds_seed = ds_seed.assign_coords(high_res_timestamp=('high_res_timestamp', hrs))
+    if 'timestamp' in ds_seed.coords:
+        ds_seed = ds_seed.sortby('timestamp')
+    return _freeze(ds_seed)
+
+
+def _prepare_seed(seed_file: Union[str, Path]) -> xr.Dataset:
+    """Open the seed dataset in chronological order, with strictly increasing timestamps.
+
+    Cached like :func:`_open_seed_dataset`, the arrays are read-only.
+    """
+    return _load_prepared_seed(_seed_key(seed_file)).copy(deep=False)
+
+
+def _spans(ds_seed: xr.Dataset) -> dict[str, pd.Timedelta]:
+    """Time covered by one repetition of the seed, for each time dimension."""
+    spans = {}
+    for dim in TIME_DIMS:
+        values = ds_seed[dim].values
+        interval = pd.Timedelta(values[1] - values[0])
+        spans[dim] = pd.Timedelta(values[-1] - values[0]) + interval
+    return spans
+
+
+def _multiplication_factor(
+    ds_seed: xr.Dataset,
+    seed_file: Union[str, Path],
+    target_size_mb: Optional[float],
+    target_duration_hours: Optional[float],
+) -> int:
+    """Number of repetitions of the seed reaching the target size or duration."""
+    if target_size_mb is not None:
+        # Calculate the current file size in MB based on the on-disk size of the
+        # source file instead of the in-memory representation. Using ``nbytes``
+        # can significantly overestimate the original data size because it reports
+        # the fully decompressed array sizes. This led to multiplication factors of
+        # ``1`` when the seed dataset was already smaller than ``target_size_mb``,
+        # so the generated mock data contained no additional samples. Measuring the
+        # actual file size ensures the dataset is extended whenever the target size
+        # exceeds the source file.
+        current_size_mb = Path(seed_file).stat().st_size / (1024 * 1024)
+        # Ensure at least one repetition so that the generated dataset always
+        # contains new samples even when the target size is smaller than the
+        # original file.
+        multiplication_factor = int(np.ceil(target_size_mb / current_size_mb))
+    else:
+        # Calculate based on duration and similarly guarantee at least one
+        # repetition when the requested duration does not exceed the seed.
+        timestamps = ds_seed['timestamp'].values
+        current_duration = pd.Timedelta(timestamps[-1] - timestamps[0])
+        target_duration = pd.Timedelta(hours=target_duration_hours)
+        multiplication_factor = int(np.ceil(target_duration / current_duration))
+    return max(2, multiplication_factor)
+
+
+def _extend_retros(
+    ds_seed: xr.Dataset,
+    coords: dict,
+    data_vars: dict,
+    additional_retro_ids: List[int],
+) -> None:
+    """Add *additional_retro_ids*, cycling through the data of the existing retros."""
+    existing_retro_ids = ds_seed.coords['retro'].values
+    existing_retro_count = len(existing_retro_ids)
+    indices = np.arange(len(additional_retro_ids)) % existing_retro_count
+
+    coords['retro'] = ('retro', np.concatenate([existing_retro_ids, additional_retro_ids]))
+
+    # Extend retro-related coordinates by cycling through existing data
+    retro_coords = ['retro_altitude_m', 'retro_latitude', 'retro_longitude', 'retro_name']
+    for coord_name in retro_coords:
+        if coord_name in ds_seed.coords:
+            existing_data = ds_seed.coords[coord_name].values
+            coords[coord_name] = ('retro', np.concatenate([existing_data, existing_data[indices]]))
+
+    # Extend retro-related data variables
+    for var_name, var_data in data_vars.items():
+        if 'retro' in var_data.dims:
+            retro_axis = var_data.dims.index('retro')
+            existing_data = var_data.values
+            new_retro_data = np.take(existing_data, indices, axis=retro_axis)
+
+            extended_data = np.concatenate([existing_data, new_retro_data], axis=retro_axis)
+            arr = xr.DataArray(extended_data, dims=var_data.dims, attrs=var_data.attrs)
+            if arr.dtype.kind not in {"O", "S"}:
+                arr.encoding["compressors"] = [DEFAULT_COMPRESSOR]
+            data_vars[var_name] = arr
+
+
+class SignalSynthesis:
+    """
+    Seeded variation of the repetitions of the seed.
+
+    Verbatim repetitions compress far better than instrument data. With a
+    synthesis, every repetition gets fresh noise, a slow drift and a diurnal
+    cycle scaled to the statistics of each float variable of the seed, loses
+    occasional runs of samples, and retros may appear during the run. Each
+    repetition draws from its own generator seeded by ``(seed, repetition)``,
+    so the output doesn't depend on the block size.
+
+    Parameters
+    ----------
+    seed : int, optional
+        Seed of the random generators.
+    noise : float, optional
+        Fresh noise, relative to the sample-to-sample noise of the seed.
+    drift : float, optional
+        Step of the random walk of the offset, per repetition, relative to the
+        standard deviation of the variable.
+    diurnal : float, optional
+        Amplitude of the daily cycle, relative to the standard deviation of the
+        variable.
+    gap_rate : float, optional
+        Expected gaps per ``timestamp`` sample.
+    gap_length : float, optional
+        Mean length of a gap, in ``timestamp`` samples. The high resolution
+        samples of the gap are dropped as well.
+    new_retros : int, optional
+        Retros appearing during the run, copied from the existing retros. Their
+        float variables are NaN before they appear.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        noise: float = 1.0,
+        drift: float = 0.05,
+        diurnal: float = 0.1,
+        gap_rate: float = 1e-4,
+        gap_length: float = 30,
+        new_retros: int = 0,
+    ) -> None:
+        self.seed = seed
+        self.noise = noise
+        self.drift = drift
+        self.diurnal = diurnal
+        self.gap_rate = gap_rate
+        self.gap_length = gap_length
+        self.new_retros = new_retros
+
+    def __repr__(self) -> str:
+        params = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"{type(self).__name__}({params})"
+
+    def fit(self, ds_seed: xr.Dataset, repetitions: int) -> "_SignalModel":
+        """The per-variable statistics of *ds_seed* and the draws shared by all blocks."""
+        return _SignalModel(self, ds_seed, repetitions)
+
+
+class _SignalModel:
+    """A :class:`SignalSynthesis` fitted to a seed, applied block by block."""
+
+    def __init__(self, synthesis: SignalSynthesis, ds_seed: xr.Dataset, repetitions: int) -> None:
+        self.synthesis = synthesis
+        self.sizes = {dim: ds_seed.sizes[dim] for dim in TIME_DIMS}
+        rng = np.random.default_rng([synthesis.seed, 0])
+
+        # (name, time dim, noise std, variable std) of the float variables along time
+        self.variables = []
+        for name, var in ds_seed.data_vars.items():
+            time_dim = next((d for d in TIME_DIMS if d in var.dims), None)
+            if time_dim is None or var.dtype.kind != "f":
+                continue
+            values = var.values
+            std = float(np.nanstd(values)) if np.isfinite(values).any() else 0.0
+            diffs = np.diff(values, axis=var.dims.index(time_dim))
+            noise = float(np.nanstd(diffs)) / np.sqrt(2) if np.isfinite(diffs).any() else 0.0
+            self.variables.append((str(name), time_dim, noise, std))
+
+        # random walk of the offset of each variable, at the start of every repetition
+        steps = rng.normal(0.0, synthesis.drift, (repetitions, len(self.variables)))
+        self.walk = np.vstack([np.zeros((1, len(self.variables))), np.cumsum(steps, axis=0)])
+        self.phases = rng.uniform(0.0, 2 * np.pi, len(self.variables))
+
+        self.new_retro_ids: List[int] = []
+        self.appears = np.zeros(0, dtype=int)
+        if synthesis.new_retros:
+            if 'retro' not in ds_seed.coords:
+                raise ValueError("new_retros needs a seed with a retro dimension")
+            first = int(ds_seed['retro'].values.max()) + 1
+            self.new_retro_ids = list(range(first, first + synthesis.new_retros))
+            self.appears = rng.integers(1, max(repetitions, 2), synthesis.new_retros)
+
+        # timestamp sample covering each high resolution sample, to drop them together
+        self.covering = None
+        if all(dim in ds_seed.coords for dim in TIME_DIMS):
+            covering = np.searchsorted(ds_seed['timestamp'].values, ds_seed['high_res_timestamp'].values, "right") - 1
+            self.covering = np.clip(covering, 0, None)
+
+    def _gaps(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """True for the samples lost in gaps, runs of geometric length."""
+        synthesis = self.synthesis
+        if not synthesis.gap_rate or not n:
+            return np.zeros(n, dtype=bool)
+        starts = np.flatnonzero(rng.random(n) < synthesis.gap_rate)
+        lengths = rng.geometric(1 / max(synthesis.gap_length, 1), len(starts))
+        delta = np.zeros(n + 1, dtype=int)
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, np.minimum(starts + lengths, n), -1)
+        return np.cumsum(delta[:n]) > 0
+
+    def apply(self, block: xr.Dataset, start: int, stop: int) -> xr.Dataset:
+        """Vary repetitions *start* to *stop* of *block* in place, returns it without the gaps."""
+        synthesis = self.synthesis
+        seconds = {
+            dim: (block[dim].values - block[dim].values.astype("datetime64[D]")) / np.timedelta64(1, "s")
+            for dim in TIME_DIMS
+        }
+        keep = {dim: [] for dim in TIME_DIMS}
+
+        for k, i in enumerate(range(start, stop)):
+            rng = np.random.default_rng([synthesis.seed, 1, i])
+            for j, (name, time_dim, noise, std) in enumerate(self.variables):
+                var = block[name]
+                n = self.sizes[time_dim]
+                axis = var.dims.index(time_dim)
+                index = tuple(slice(k * n, (k + 1) * n) if a == axis else slice(None) for a in range(var.ndim))
+                values = var.values[index]
+
+                frac = np.arange(n) / n
+                offset = std * (self.walk[i, j] + (self.walk[i + 1, j] - self.walk[i, j]) * frac)
+                day = 2 * np.pi * seconds[time_dim][k * n : (k + 1) * n] / 86400
+                cycle = synthesis.diurnal * std * np.sin(day + self.phases[j])
+                along_time = tuple(n if a == axis else 1 for a in range(var.ndim))
+                change = rng.normal(0.0, synthesis.noise * noise, values.shape) + (offset + cycle).reshape(along_time)
+                values += change.astype(values.dtype)
+
+                if self.new_retro_ids and 'retro' in var.dims:
+                    hidden = np.flatnonzero(self.appears > i) + var.sizes['retro'] - len(self.new_retro_ids)
+                    retro_index = tuple(hidden if d == 'retro' else slice(None) for d in var.dims)
+                    values[retro_index] = np.nan
+
+            lost = self._gaps(rng, self.sizes['timestamp'])
+            keep['timestamp'].append(~lost)
+            if self.covering is not None:
+                keep['high_res_timestamp'].append(~lost[self.covering])
+
+        selection = {dim: np.concatenate(masks) for dim, masks in keep.items() if masks}
+        block.attrs['mock_synthesis'] = repr(synthesis)
+        return block.isel(selection) if selection else block
+
+
+def _mock_block(
+    ds_seed: xr.Dataset,
+    start: int,
+    stop: int,
+    spans: dict[str, pd.Timedelta],
+    additional_retro_ids: Optional[List[int]] = None,
+    model: Optional[_SignalModel] = None,
+) -> xr.Dataset:
+    """
+    Repetitions *start* to *stop* (exclusive) of the seed, as one dataset.
+
+    Repetition ``i`` is the seed shifted by ``i`` times its span, repetition 0 is
+    the seed itself, unless varied by a fitted :class:`SignalSynthesis`.
+    """
+    repeats = stop - start
+
+    # Create the new dataset with extended dimensions
+    new_coords: dict = {}
+    new_data_vars: dict = {}
+
+    # Replicate the coordinates along the time dimensions, keep the others as is
+    for coord_name, coord_data in ds_seed.coords.items():
+        if coord_data.dims and coord_data.dims[0] in TIME_DIMS:
+            new_coords[coord_name] = (coord_data.dims, np.tile(coord_data.values, repeats))
+        else:
+            new_coords[coord_name] = coord_data
+
+    # Offset the timestamps by the span of the dataset so far, one row per repetition
+    for dim in TIME_DIMS:
+        values = ds_seed[dim].values.astype("datetime64[ns]")
+        offsets = np.arange(start, stop) * spans[dim].to_timedelta64()
+        new_coords[dim] = (dim, (values[None, :] + offsets[:, None]).ravel())
+
+    # Handle data variables
+    for var_name, var_data in ds_seed.data_vars.items():
+        time_dim = next((d for d in TIME_DIMS if d in var_data.dims), None)
+        if time_dim is not None:
+            replicated_data = np.tile(
+                var_data.values,
+                tuple(repeats if d == time_dim else 1 for d in var_data.dims),
+            )
+            arr = xr.DataArray(replicated_data, dims=var_data.dims, attrs=var_data.attrs)
+        else:
+            arr = var_data.copy()
+        arr.encoding["compressors"] = [DEFAULT_COMPRESSOR]
+        new_data_vars[var_name] = arr
+
+    # Handle retro dimension expansion if requested
+    retro_ids = list(additional_retro_ids or []) + (model.new_retro_ids if model is not None else [])
+    if retro_ids:
+        _extend_retros(ds_seed, new_coords, new_data_vars, retro_ids)
+
+    block = xr.Dataset(data_vars=new_data_vars, coords=new_coords, attrs=ds_seed.attrs.copy())
+    return model.apply(block, start, stop) if model is not None else block
+
+
+def _mock_attrs(ds: xr.Dataset, multiplication_factor: int, additional_retro_ids: Optional[List[int]]) -> None:
+    """Update attributes to reflect mock data generation."""
+    ds.attrs['mock_data'] = "True"
+    ds.attrs['mock_multiplication_factor'] = multiplication_factor
+    if additional_retro_ids:
+        ds.attrs['mock_additional_retro_ids'] = ','.join(map(str, additional_retro_ids))
+
+
+def _netcdf_encoding(ds: xr.Dataset) -> dict[str, dict]:
+    """netCDF compression of the numeric variables."""
+    return {
+        str(name): {"zlib": True, "complevel": 3}
+        for name, var in ds.variables.items()
+        if var.dtype.kind not in {"O", "S"}
+    }
+
+
+def _appended(block: xr.Dataset, dim: str) -> xr.Dataset:
+    """The variables of *block* along *dim*, the rest is written with the first block."""
+    return block.drop_vars([name for name in block.variables if dim not in block[name].dims])
+
+
+# Integer nanoseconds keep the repaired high resolution timestamps exact. Units
+# inferred from the first block would not fit the blocks appended after it.
+_TIME_ENCODING = {"units": "nanoseconds since 1970-01-01", "dtype": "int64"}
 
-        paths.append(repo_path)
 
-    return paths
+def _chunk_shape(block: xr.Dataset, var: xr.Variable, chunks: Optional[dict[str, int]]) -> tuple[int, ...]:
+    """Chunks of *var* along the time dimensions, by default one per block."""
+    return tuple(max(1, (chunks or {}).get(d, block.sizes[d])) for d in var.dims)
+
+
+def _zarr_encoding(block: xr.Dataset, chunks: Optional[dict[str, int]]) -> dict[str, dict]:
+    """Blosc compressors, time units and chunks of the Zarr arrays created for *block*."""
+    encoding: dict[str, dict] = {}
+    for name, var in block.variables.items():
+        # an explicit encoding replaces the variable's own, keep its compressors
+        if var.dtype.kind not in {"O", "S", "U"}:
+            encoding[str(name)] = {"compressors": var.encoding.get("compressors", [DEFAULT_COMPRESSOR])}
+        if var.dtype.kind == "M":
+            encoding[str(name)].update(_TIME_ENCODING)
+        if any(d in TIME_DIMS for d in var.dims):
+            encoding.setdefault(str(name), {})["chunks"] = _chunk_shape(block, var, chunks)
+    return encoding
+
+
+class _NetCDFBlockWriter:
+    """Appends blocks to a netCDF file along its unlimited time dimensions, the first block creates it."""
+
+    def __init__(self, path: Union[str, Path], chunks: Optional[dict[str, int]] = None) -> None:
+        self.path = Path(path)
+        self.chunks = chunks
+        self.encoding: dict[str, dict] = {}
+        self.sizes: dict[str, int] = {}
+
+    def write(self, block: xr.Dataset) -> None:
+        if not self.sizes:
+            self._create(block)
+            return
+        import netCDF4
+
+        with netCDF4.Dataset(self.path, "a") as nc:
+            for dim in TIME_DIMS:
+                if not block.sizes[dim]:
+                    continue
+                start = self.sizes[dim]
+                for name, var in _appended(block, dim).variables.items():
+                    var = var.copy(deep=False)
+                    var.encoding = dict(self.encoding.get(str(name), {}))
+                    encoded = xr.conventions.encode_cf_variable(var, name=str(name))
+                    axis = var.dims.index(dim)
+                    index = tuple(
+                        slice(start, start + var.shape[axis]) if i == axis else slice(None)
+                        for i in range(var.ndim)
+                    )
+                    nc.variables[str(name)][index] = encoded.values
+                self.sizes[dim] += block.sizes[dim]
+
+    def _create(self, block: xr.Dataset) -> None:
+        self.encoding = _netcdf_encoding(block)
+        for name, var in block.variables.items():
+            time_dim = next((d for d in TIME_DIMS if d in var.dims), None)
+            if time_dim is None:
+                continue
+            # the default chunk of an unlimited dimension is a single sample
+            self.encoding.setdefault(str(name), {})["chunksizes"] = _chunk_shape(block, var, self.chunks)
+            if var.dtype.kind == "M":
+                self.encoding[str(name)].update(_TIME_ENCODING)
+        block.to_netcdf(self.path, encoding=self.encoding, unlimited_dims=list(TIME_DIMS))
+        self.sizes = {dim: block.sizes[dim] for dim in TIME_DIMS}
+        # only needed to create the variables
+        for encoding in self.encoding.values():
+            encoding.pop("chunksizes", None)
+            encoding.pop("zlib", None)
+            encoding.pop("complevel", None)
+
+    def close(self) -> xr.Dataset:
+        return xr.open_dataset(self.path)
+
+
+class _ZarrBlockWriter:
+    """Appends blocks to a Zarr store, one append per time dimension."""
+
+    def __init__(self, store: object, started: bool = False, chunks: Optional[dict[str, int]] = None) -> None:
+        self.store = store
+        self.started = started
+        self.chunks = chunks
+
+    def write(self, block: xr.Dataset) -> None:
+        if not self.started:
+            block.to_zarr(self.store, mode="w", consolidated=False, encoding=_zarr_encoding(block, self.chunks))
+            self.started = True
+            return
+        for dim in TIME_DIMS:
+            if not block.sizes[dim]:
+                continue
+            _appended(block, dim).to_zarr(self.store, mode="a", append_dim=dim, consolidated=False)
+
+    def close(self) -> xr.Dataset:
+        return xr.open_zarr(self.store, consolidated=False)
+
+
+class _IcechunkBlockWriter:
+    """Appends blocks to a local icechunk repository, one commit per block."""
+
+    def __init__(self, path: Union[str, Path], chunks: Optional[dict[str, int]] = None) -> None:
+        self.repo = icechunk.Repository.create(icechunk.local_filesystem_storage(str(path)))
+        self.chunks = chunks
+        self.blocks = 0
+
+    def write(self, block: xr.Dataset) -> None:
+        session = self.repo.writable_session("main")
+        _ZarrBlockWriter(session.store, started=bool(self.blocks), chunks=self.chunks).write(block)
+        session.commit(f"mock block {self.blocks}")
+        self.blocks += 1
+
+    def close(self) -> xr.Dataset:
+        return xr.open_zarr(self.repo.readonly_session("main").store, consolidated=False)
+
+
+class _ZipBlockWriter:
+    """Appends blocks to a Zarr directory next to *path*, zipped when closed."""
+
+    # Entries of a zip file can't be rewritten, appending to a ZipStore would
+    # leave stale copies of the array metadata in the archive.
+
+    def __init__(self, path: Union[str, Path], chunks: Optional[dict[str, int]] = None) -> None:
+        self.path = Path(path)
+        self.directory = tempfile.mkdtemp(prefix=f".{self.path.name}.", dir=self.path.parent)
+        self.zarr = _ZarrBlockWriter(self.directory, chunks=chunks)
+
+    def write(self, block: xr.Dataset) -> None:
+        self.zarr.write(block)
+
+    def close(self) -> xr.Dataset:
+        # the chunks are compressed already
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED) as archive:
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    archive.write(path, os.path.relpath(path, self.directory))
+        shutil.rmtree(self.directory)
+        return xr.open_zarr(zarr_storage.ZipStore(self.path, mode="r"), consolidated=False)
+
+
+OUTPUT_FORMATS = ("netcdf", "zarr", "zip", "icechunk")
+_FORMAT_SUFFIXES = {".zarr": "zarr", ".zip": "zip", ".icechunk": "icechunk"}
+
+
+def _output_format(output_file: Union[str, Path], output_format: Optional[str]) -> str:
+    """*output_format*, by default guessed from the suffix of *output_file*."""
+    if output_format is None:
+        return _FORMAT_SUFFIXES.get(Path(output_file).suffix, "netcdf")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}, not {output_format!r}")
+    return output_format
+
+
+def _block_writer(
+    output_file: Union[str, Path],
+    chunks: Optional[dict[str, int]] = None,
+    output_format: Optional[str] = None,
+):
+    """The block writer of *output_format* for *output_file*. *chunks* default to the first block."""
+    output_format = _output_format(output_file, output_format)
+    if output_format == "zarr":
+        return _ZarrBlockWriter(str(output_file), chunks=chunks)
+    if output_format == "zip":
+        return _ZipBlockWriter(output_file, chunks)
+    if output_format == "icechunk":
+        return _IcechunkBlockWriter(output_file, chunks)
+    return _NetCDFBlockWriter(output_file, chunks)
+
+
+_CACHE_SUFFIXES = {"netcdf": ".nc", "zarr": ".zarr", "zip": ".zip", "icechunk": ".icechunk"}
+# bump when the data generated for the same parameters changes
+_CACHE_VERSION = 1
+
+
+def _cache_key(seed_file: Union[str, Path], **params: object) -> str:
+    """Key of a generated output in the mock cache."""
+    description = {"version": _CACHE_VERSION, "seed": _seed_key(seed_file), **params}
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def _remove_output(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def _copy_output(source: Path, destination: Union[str, Path]) -> None:
+    """Copy an output file or directory, replacing *destination*."""
+    destination = Path(destination)
+    _remove_output(destination)
+    if source.is_dir():
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+def _store_output(output_file: Union[str, Path], cached: Path) -> None:
+    """Copy *output_file* to the cache, atomically, other processes may be filling the same entry."""
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    partial = cached.with_name(f".{cached.name}.{os.getpid()}")
+    _copy_output(Path(output_file), partial)
+    try:
+        os.replace(partial, cached)
+    except OSError:
+        # a directory entry stored meanwhile, it holds the same data
+        _remove_output(partial)
+
+
+def _open_output(path: Union[str, Path], output_format: str) -> xr.Dataset:
+    """Open a generated output lazily."""
+    if output_format == "zarr":
+        return xr.open_zarr(str(path), consolidated=False)
+    if output_format == "zip":
+        return xr.open_zarr(zarr_storage.ZipStore(path, mode="r"), consolidated=False)
+    if output_format == "icechunk":
+        repo = icechunk.Repository.open(icechunk.local_filesystem_storage(str(path)))
+        return xr.open_zarr(repo.readonly_session("main").store, consolidated=False)
+    return xr.open_dataset(path)
+
+
+def _validate_targets(target_size_mb: Optional[float], target_duration_hours: Optional[float]) -> None:
+    if (target_size_mb is None and target_duration_hours is None):
+        raise ValueError("Either target_size_mb or target_duration_hours must be provided")
+    if (target_size_mb is not None and target_duration_hours is not None):
+        raise ValueError("Only one of target_size_mb or target_duration_hours can be provided")
+
+
+def iter_mock_blocks(
+    seed_file: Union[str, Path],
+    target_size_mb: Optional[float] = None,
+    target_duration_hours: Optional[float] = None,
+    additional_retro_ids: Optional[List[int]] = None,
+    block_repetitions: int = 1,
+    synthesis: Optional[SignalSynthesis] = None,
+) -> Iterator[xr.Dataset]:
+    """
+    Generate the mock data of :func:`generate_mock_data` block by block.
+
+    Each block holds *block_repetitions* repetitions of the seed along the time
+    dimensions, and all the other variables. Only the seed and the current block
+    are kept in memory.
+
+    Yields
+    ------
+    xr.Dataset
+        The consecutive blocks of the mock dataset.
+    """
+    _validate_targets(target_size_mb, target_duration_hours)
+    if block_repetitions < 1:
+        raise ValueError("block_repetitions must be at least 1")
+
+    ds_seed = _prepare_seed(seed_file)
+    spans = _spans(ds_seed)
+    multiplication_factor = _multiplication_factor(ds_seed, seed_file, target_size_mb, target_duration_hours)
+    model = synthesis.fit(ds_seed, multiplication_factor) if synthesis is not None else None
+
+    for start in range(0, multiplication_factor, block_repetitions):
+        stop = min(start + block_repetitions, multiplication_factor)
+        block = _mock_block(ds_seed, start, stop, spans, additional_retro_ids, model)
+        _mock_attrs(block, multiplication_factor, additional_retro_ids)
+        yield block
 
 
 def generate_mock_data(
@@ -99,7 +766,11 @@ def generate_mock_data(
     output_file: Union[str, Path],
     target_size_mb: Optional[float] = None,
     target_duration_hours: Optional[float] = None,
-    additional_retro_ids: Optional[List[int]] = None
+    additional_retro_ids: Optional[List[int]] = None,
+    block_repetitions: Optional[int] = None,
+    synthesis: Optional[SignalSynthesis] = None,
+    output_format: Optional[str] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
 ) -> xr.Dataset:
     """
     Generate mock data by extending an existing xarray dataset.
@@ -109,18 +780,36 @@ def generate_mock_data(
     seed_file : str or Path
         Path to the seed dataset file (NetCDF or zipped Zarr)
     output_file : str or Path
-        Path where the generated mock data will be saved
+        Path where the generated mock data will be saved, in *output_format*.
     target_size_mb : float, optional
         Target file size in megabytes. Cannot be used with target_duration_hours.
     target_duration_hours : float, optional
         Target duration in hours to extend the data. Cannot be used with target_size_mb.
     additional_retro_ids : list of int, optional
         List of new retro IDs to add to the dataset
+    block_repetitions : int, optional
+        Generate and write the output in blocks of this many repetitions of the
+        seed, instead of all at once. Peak memory stays at about one block,
+        whatever the target size.
+    synthesis : SignalSynthesis, optional
+        Vary the repetitions with seeded noise, drift, diurnal cycles, gaps and
+        new retros, instead of repeating the seed verbatim.
+    output_format : str, optional
+        ``"netcdf"`` (zlib compressed), ``"zarr"`` (a Zarr v3 directory),
+        ``"zip"`` (a zipped Zarr store) or ``"icechunk"`` (a local icechunk
+        repository). The Zarr formats are blosc compressed. By default guessed
+        from the suffix of *output_file*: ``.zarr``, ``.zip``, ``.icechunk``,
+        NetCDF otherwise.
+    cache_dir : str or Path, optional
+        Keep a copy of the output in this directory, keyed by the seed version
+        and the parameters. Later calls with the same parameters copy it to
+        *output_file* instead of generating it again.
         
     Returns
     -------
     xr.Dataset
-        The generated mock dataset
+        The generated mock dataset, in memory, not read back from *output_file*.
+        In block mode it is opened lazily from *output_file*.
         
     Raises
     ------
@@ -129,192 +818,49 @@ def generate_mock_data(
         or if neither is provided
     """
     # Validate input parameters
-    if (target_size_mb is None and target_duration_hours is None):
-        raise ValueError("Either target_size_mb or target_duration_hours must be provided")
-    if (target_size_mb is not None and target_duration_hours is not None):
-        raise ValueError("Only one of target_size_mb or target_duration_hours can be provided")
-    
-    # Load the seed dataset and ensure chronological order for time-based
-    # dimensions. Some test fixtures ship with unsorted coordinates which can
-    # cause slice operations using ``xarray``/``pandas`` to raise ``KeyError``.
-    # Sorting provides a stable base for our replication logic.
-    ds_seed = _open_seed_dataset(seed_file)
-    if 'high_res_timestamp' in ds_seed.coords:
-        ds_seed = ds_seed.sortby('high_res_timestamp')
-        hrs = ds_seed['high_res_timestamp'].values.copy()
-        for i in range(1, len(hrs)):
-            if hrs[i] <= hrs[i - 1]:
-                hrs[i] = hrs[i - 1] + np.timedelta64(1, 'ns')
-        ds_seed = ds_seed.assign_coords(high_res_timestamp=('high_res_timestamp', hrs))
-    if 'timestamp' in ds_seed.coords:
-        ds_seed = ds_seed.sortby('timestamp')
+    _validate_targets(target_size_mb, target_duration_hours)
+    output_format = _output_format(output_file, output_format)
 
-    # Calculate the current file size in MB based on the on-disk size of the
-    # source file instead of the in-memory representation. Using ``nbytes``
-    # can significantly overestimate the original data size because it reports
-    # the fully decompressed array sizes. This led to multiplication factors of
-    # ``1`` when the seed dataset was already smaller than ``target_size_mb``,
-    # so the generated mock data contained no additional samples. Measuring the
-    # actual file size ensures the dataset is extended whenever the target size
-    # exceeds the source file.
-    seed_path = Path(seed_file)
-    current_size_mb = seed_path.stat().st_size / (1024 * 1024)
-    
-    # Extract timestamp information
-    timestamps = ds_seed['timestamp'].values
-    high_res_timestamps = ds_seed['high_res_timestamp'].values
-    
-    # Calculate time deltas to use when repeating the dataset
-    timestamp_interval = pd.Timedelta(timestamps[1] - timestamps[0])
-    high_res_interval = pd.Timedelta(high_res_timestamps[1] - high_res_timestamps[0])
-    timestamp_span = pd.Timedelta(timestamps[-1] - timestamps[0]) + timestamp_interval
-    high_res_span = (
-        pd.Timedelta(high_res_timestamps[-1] - high_res_timestamps[0])
-        + high_res_interval
-    )
-    
-    # Determine multiplication factor based on input
-    if target_size_mb is not None:
-        # Calculate how many times to replicate data based on file size.
-        # Ensure at least one repetition so that the generated dataset always
-        # contains new samples even when the target size is smaller than the
-        # original file.
-        multiplication_factor = int(np.ceil(target_size_mb / current_size_mb))
-        multiplication_factor = max(2, multiplication_factor)
-    else:
-        # Calculate based on duration and similarly guarantee at least one
-        # repetition when the requested duration does not exceed the seed.
-        current_duration = pd.Timedelta(timestamps[-1] - timestamps[0])
-        target_duration = pd.Timedelta(hours=target_duration_hours)
-        multiplication_factor = int(np.ceil(target_duration / current_duration))
-        multiplication_factor = max(2, multiplication_factor)
-    
-    # Create extended timestamps
-    extended_timestamps = []
-    extended_high_res_timestamps = []
-    
-    # Generate new timestamps by extending from the last timestamp
-    for i in range(multiplication_factor):
-        if i == 0:
-            # Include original timestamps for the first iteration
-            extended_timestamps.extend(timestamps)
-            extended_high_res_timestamps.extend(high_res_timestamps)
-        else:
-            # Offset the timestamps by the span of the dataset so far
-            new_timestamps = timestamps + (i * timestamp_span)
-            new_high_res_timestamps = high_res_timestamps + (i * high_res_span)
+    cached = None
+    if cache_dir is not None:
+        key = _cache_key(
+            seed_file,
+            target_size_mb=target_size_mb,
+            target_duration_hours=target_duration_hours,
+            additional_retro_ids=additional_retro_ids,
+            block_repetitions=block_repetitions,
+            synthesis=repr(synthesis),
+            output_format=output_format,
+        )
+        cached = Path(cache_dir) / f"{key}{_CACHE_SUFFIXES[output_format]}"
+        if cached.exists():
+            _copy_output(cached, output_file)
+            if block_repetitions is not None:
+                return _open_output(output_file, output_format)
+            with _open_output(output_file, output_format) as ds_mock:
+                return ds_mock.load()
 
-            extended_timestamps.extend(new_timestamps)
-            extended_high_res_timestamps.extend(new_high_res_timestamps)
-    
-    # Create the new dataset with extended dimensions
-    new_coords = {}
-    new_data_vars = {}
-    
-    # Handle timestamp-based coordinates and variables
-    for coord_name, coord_data in ds_seed.coords.items():
-        if 'timestamp' in coord_data.dims and coord_data.dims[0] == 'timestamp':
-            # Replicate data for timestamp dimension
-            replicated_data = np.tile(coord_data.values, multiplication_factor)
-            new_coords[coord_name] = (coord_data.dims, replicated_data)
-        elif 'high_res_timestamp' in coord_data.dims and coord_data.dims[0] == 'high_res_timestamp':
-            # Replicate data for high_res_timestamp dimension
-            replicated_data = np.tile(coord_data.values, multiplication_factor)
-            new_coords[coord_name] = (coord_data.dims, replicated_data)
-        else:
-            # Keep other coordinates as is
-            new_coords[coord_name] = coord_data
-    
-    # Update timestamp coordinates with extended values
-    new_coords['timestamp'] = ('timestamp', np.array(extended_timestamps))
-    new_coords['high_res_timestamp'] = ('high_res_timestamp', np.array(extended_high_res_timestamps))
-    
-    # Handle data variables
-    for var_name, var_data in ds_seed.data_vars.items():
-        if 'timestamp' in var_data.dims:
-            replicated_data = np.tile(
-                var_data.values,
-                tuple(multiplication_factor if d == 'timestamp' else 1 for d in var_data.dims),
-            )
-            arr = xr.DataArray(
-                replicated_data, dims=var_data.dims, attrs=var_data.attrs
-            )
-            arr.encoding["compressors"] = [DEFAULT_COMPRESSOR]
-            new_data_vars[var_name] = arr
-        elif 'high_res_timestamp' in var_data.dims:
-            replicated_data = np.tile(
-                var_data.values,
-                tuple(
-                    multiplication_factor if d == 'high_res_timestamp' else 1
-                    for d in var_data.dims
-                ),
-            )
-            arr = xr.DataArray(
-                replicated_data, dims=var_data.dims, attrs=var_data.attrs
-            )
-            arr.encoding["compressors"] = [DEFAULT_COMPRESSOR]
-            new_data_vars[var_name] = arr
+    if block_repetitions is None:
+        ds_seed = _prepare_seed(seed_file)
+        multiplication_factor = _multiplication_factor(ds_seed, seed_file, target_size_mb, target_duration_hours)
+        model = synthesis.fit(ds_seed, multiplication_factor) if synthesis is not None else None
+        ds_mock = _mock_block(ds_seed, 0, multiplication_factor, _spans(ds_seed), additional_retro_ids, model)
+        _mock_attrs(ds_mock, multiplication_factor, additional_retro_ids)
+        if output_format == "netcdf":
+            # Save the dataset with netCDF compression
+            ds_mock.to_netcdf(output_file, encoding=_netcdf_encoding(ds_mock))
         else:
-            arr = var_data.copy()
-            arr.encoding["compressors"] = [DEFAULT_COMPRESSOR]
-            new_data_vars[var_name] = arr
-    
-    # Handle retro dimension expansion if requested
-    if additional_retro_ids:
-        # Get existing retro data
-        existing_retro_ids = ds_seed.coords['retro'].values
-        existing_retro_count = len(existing_retro_ids)
-        
-        # Create new retro IDs
-        all_retro_ids = np.concatenate([existing_retro_ids, additional_retro_ids])
-        new_coords['retro'] = ('retro', all_retro_ids)
-        
-        # Extend retro-related coordinates by cycling through existing data
-        retro_coords = ['retro_altitude_m', 'retro_latitude', 'retro_longitude', 'retro_name']
-        for coord_name in retro_coords:
-            if coord_name in ds_seed.coords:
-                existing_data = ds_seed.coords[coord_name].values
-                # Cycle through existing data for new retro IDs
-                indices = np.arange(len(additional_retro_ids)) % existing_retro_count
-                new_retro_data = existing_data[indices]
-                extended_data = np.concatenate([existing_data, new_retro_data])
-                new_coords[coord_name] = ('retro', extended_data)
-        
-        # Extend retro-related data variables
-        for var_name, var_data in new_data_vars.items():
-            if 'retro' in var_data.dims:
-                retro_axis = var_data.dims.index('retro')
-                existing_data = var_data.values
-
-                indices = np.arange(len(additional_retro_ids)) % existing_retro_count
-                new_retro_data = np.take(existing_data, indices, axis=retro_axis)
-
-                extended_data = np.concatenate([existing_data, new_retro_data], axis=retro_axis)
-                arr = xr.DataArray(
-                    extended_data, dims=var_data.dims, attrs=var_data.attrs
-                )
-                if arr.dtype.kind not in {"O", "S"}:
-                    arr.encoding["compressors"] = [DEFAULT_COMPRESSOR]
-                new_data_vars[var_name] = arr
-    
-    # Create the new dataset
-    ds_mock = xr.Dataset(
-        data_vars=new_data_vars,
-        coords=new_coords,
-        attrs=ds_seed.attrs.copy()
-    )
-    
-    # Update attributes to reflect mock data generation
-    ds_mock.attrs['mock_data'] = "True"
-    ds_mock.attrs['mock_multiplication_factor'] = multiplication_factor
-    if additional_retro_ids:
-        ds_mock.attrs['mock_additional_retro_ids'] = ','.join(map(str, additional_retro_ids))
-    
-    # Save the dataset with netCDF compression
-    nc_encoding: dict[str, dict[str, int | bool]] = {}
-    for name, var in ds_mock.variables.items():
-        if var.dtype.kind not in {"O", "S"}:
-            nc_encoding[name] = {"zlib": True, "complevel": 3}
-    ds_mock.to_netcdf(output_file, encoding=nc_encoding)
-    
+            writer = _block_writer(output_file, output_format=output_format)
+            writer.write(ds_mock)
+            writer.close()
+    else:
+        writer = _block_writer(output_file, output_format=output_format)
+        for block in iter_mock_blocks(
+            seed_file, target_size_mb, target_duration_hours, additional_retro_ids, block_repetitions, synthesis
+        ):
+            writer.write(block)
+        ds_mock = writer.close()
+
+    if cached is not None:
+        _store_output(output_file, cached)
     return ds_mock
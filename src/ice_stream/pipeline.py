@@ -0,0 +1,87 @@
+"""Producer/consumer helpers used to overlap export and upload."""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+def prefetch(
+    iterable: Iterable[T],
+    maxsize: int = 1,
+    on_discard: Callable[[T], None] | None = None,
+) -> Iterator[T]:
+    """Iterate *iterable* in a background thread, buffering up to *maxsize* items.
+
+    The producer runs ahead of the consumer by at most ``maxsize`` items, so the
+    total time approaches ``max(produce, consume)`` rather than their sum while
+    memory and disk use stay bounded. Items are yielded in order and exceptions
+    raised by the producer are re-raised in the consumer.
+
+    Parameters
+    ----------
+    iterable : Iterable
+        Source of items, typically a generator doing slow I/O.
+    maxsize : int, optional
+        Maximum number of produced items waiting to be consumed.
+    on_discard : callable, optional
+        Called for every produced item that is never handed to the consumer,
+        e.g. because the consumer stopped early or failed. Use it to release
+        resources such as temporary directories.
+    """
+    if maxsize < 1:
+        raise ValueError("maxsize must be at least 1")
+
+    items: queue.Queue = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(entry: tuple[object, BaseException | None]) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        it = iter(iterable)
+        try:
+            for item in it:
+                if not put((item, None)):
+                    if on_discard is not None:
+                        on_discard(item)
+                    return
+            put((_DONE, None))
+        except BaseException as exc:  # propagated to the consumer
+            put((_DONE, exc))
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+
+    worker = threading.Thread(target=produce, name="ice-stream-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, exc = items.get()
+            if item is _DONE:
+                if exc is not None:
+                    raise exc
+                return
+            yield item  # type: ignore[misc]
+    finally:
+        stop.set()
+        worker.join()
+        while True:
+            try:
+                item, _ = items.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _DONE and on_discard is not None:
+                on_discard(item)  # type: ignore[arg-type]
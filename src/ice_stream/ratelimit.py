@@ -0,0 +1,326 @@
+"""Bandwidth limits for uploads on shared field links.
+
+Instruments in the field often share a cellular or satellite uplink, and a
+catch-up run can saturate it for hours. Uploads are throttled with token
+buckets, refilled at a configured rate in bytes per second:
+
+* :class:`TokenBucket` limits the threads of one process, e.g. one project.
+* :class:`FairShareBandwidth` splits one budget evenly between the projects of
+  a :class:`~ice_stream.scheduler.StreamingScheduler` that are streaming.
+* :class:`HostTokenBucket` keeps its state in a locked file, and limits every
+  process on the host that uses the same file.
+* :class:`BandwidthSchedule` changes the rate by time of day, e.g. a tighter
+  limit during working hours.
+
+Writers *reserve* the bytes they are about to send and wait for as long as the
+bucket says, so a single large write is allowed through and the following
+writes pay for it. :class:`RateLimiter` combines several buckets.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Union
+
+try:  # advisory locking is not available on every platform
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+_UNITS = {
+    "b": 1,
+    "kb": 1024,
+    "mb": 1024**2,
+    "gb": 1024**3,
+    "kbit": 1000 / 8,
+    "mbit": 1000**2 / 8,
+    "gbit": 1000**3 / 8,
+}
+
+Rate = Union[float, int, str, None]
+
+
+def parse_rate(rate: Rate) -> float | None:
+    """
+    Bytes per second from a number, or a string like ``"512 KB/s"`` or ``"2 Mbit/s"``.
+
+    ``None`` and ``0`` mean unlimited.
+    """
+    if rate is None:
+        return None
+    if isinstance(rate, str):
+        match = re.fullmatch(r"\s*([\d.]+)\s*([a-zA-Z]*)(?:/s)?\s*", rate)
+        if match is None or match.group(2).lower() not in (*_UNITS, ""):
+            raise ValueError(f"Can't parse bandwidth {rate!r}, expected e.g. '512 KB/s' or '2 Mbit/s'")
+        value = float(match.group(1)) * _UNITS.get(match.group(2).lower() or "b", 1)
+    else:
+        value = float(rate)
+    if value < 0:
+        raise ValueError(f"Bandwidth must not be negative: {rate!r}")
+    return value or None
+
+
+def _parse_time(value: str) -> dt.time:
+    return dt.datetime.strptime(str(value), "%H:%M").time()
+
+
+class BandwidthSchedule:
+    """
+    A bandwidth limit that depends on the local time of day.
+
+    Parameters
+    ----------
+    default : rate
+        Limit outside of the *windows*, ``None`` for unlimited.
+    windows : iterable of dict
+        ``{'start': 'HH:MM', 'end': 'HH:MM', 'limit': rate}`` entries. A window may
+        wrap around midnight. The first matching window wins.
+    """
+
+    def __init__(self, default: Rate = None, windows: Iterable[dict[str, Any]] = ()) -> None:
+        self.default = parse_rate(default)
+        self.windows = [
+            (_parse_time(window["start"]), _parse_time(window["end"]), parse_rate(window.get("limit")))
+            for window in windows
+        ]
+
+    def rate_at(self, when: dt.datetime | None = None) -> float | None:
+        """Bytes per second allowed at *when* (now by default), ``None`` for unlimited."""
+        now = (when or dt.datetime.now()).time()
+        for start, end, rate in self.windows:
+            inside = start <= now < end if start <= end else (now >= start or now < end)
+            if inside:
+                return rate
+        return self.default
+
+
+def _as_schedule(rate: Rate | BandwidthSchedule) -> BandwidthSchedule:
+    return rate if isinstance(rate, BandwidthSchedule) else BandwidthSchedule(rate)
+
+
+class TokenBucket:
+    """
+    A token bucket shared by the threads of a process.
+
+    Parameters
+    ----------
+    rate : rate or BandwidthSchedule
+        Bytes per second, ``None`` for unlimited.
+    burst_seconds : float, optional
+        The bucket holds up to this many seconds worth of tokens.
+    clock : callable, optional
+        Clock in seconds, by default :func:`time.monotonic`.
+    """
+
+    # reserving blocks on I/O, keep it off the event loop
+    blocking = False
+
+    def __init__(
+        self,
+        rate: Rate | BandwidthSchedule,
+        burst_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.schedule = _as_schedule(rate)
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tokens: float | None = None
+        self._updated = clock()
+
+    def _reserve(self, tokens: float | None, updated: float, now: float, nbytes: int) -> tuple[float, float]:
+        """Shared bookkeeping, returns the tokens left and the seconds to wait."""
+        rate = self.schedule.rate_at()
+        if rate is None:
+            return 0.0, 0.0
+        capacity = rate * self.burst_seconds
+        tokens = capacity if tokens is None else min(capacity, tokens + (now - updated) * rate)
+        tokens -= nbytes
+        # in debt, the writer waits until the bucket is back at zero.
+        return tokens, max(0.0, -tokens / rate)
+
+    def reserve(self, nbytes: int) -> float:
+        """Take *nbytes* from the bucket, returns how many seconds the writer has to wait."""
+        with self._lock:
+            now = self.clock()
+            self._tokens, wait = self._reserve(self._tokens, self._updated, now, nbytes)
+            self._updated = now
+            return wait
+
+
+class HostTokenBucket(TokenBucket):
+    """
+    A token bucket shared by all processes using the same state *path*.
+
+    The bucket state is kept in a small JSON file, updated under an exclusive
+    ``fcntl`` lock. Wall clock time is used, as it is the only clock the
+    processes share.
+    """
+
+    # flock and file I/O
+    blocking = True
+
+    def __init__(
+        self,
+        rate: Rate | BandwidthSchedule,
+        path: str | None = None,
+        burst_seconds: float = 1.0,
+    ) -> None:
+        super().__init__(rate, burst_seconds, clock=time.time)
+        self.path = path or os.path.join(tempfile.gettempdir(), "ice_stream_bandwidth.json")
+
+    def reserve(self, nbytes: int) -> float:
+        if self.schedule.rate_at() is None:
+            return 0.0
+        with self._lock, open(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666), "r+") as file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    state = json.loads(file.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = self.clock()
+                tokens, wait = self._reserve(state.get("tokens"), state.get("updated", now), now, nbytes)
+                file.seek(0)
+                file.truncate()
+                file.write(json.dumps({"tokens": tokens, "updated": now}))
+                file.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return wait
+
+
+class _ShareSchedule(BandwidthSchedule):
+    """The rate of one member of a :class:`FairShareBandwidth`."""
+
+    def __init__(self, budget: FairShareBandwidth, name: str) -> None:
+        self.budget = budget
+        self.name = name
+
+    def rate_at(self, when: dt.datetime | None = None) -> float | None:
+        return self.budget.share_at(self.name, when)
+
+
+class FairShareBandwidth:
+    """
+    A bandwidth budget split evenly between the members that are active.
+
+    Every member throttles against a :class:`TokenBucket` of its own, refilled
+    at the budget divided by the number of active members. Together they stay
+    within the budget, and a project catching up can't take the share of the
+    others. A member streaming alone gets the whole budget.
+
+    Parameters
+    ----------
+    rate : rate or BandwidthSchedule
+        Bytes per second of all the members together, ``None`` for unlimited.
+    burst_seconds : float, optional
+        Each bucket holds up to this many seconds worth of its share.
+    clock : callable, optional
+        Clock in seconds, by default :func:`time.monotonic`.
+    """
+
+    def __init__(
+        self,
+        rate: Rate | BandwidthSchedule,
+        burst_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.schedule = _as_schedule(rate)
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._active: set[str] = set()
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def bucket(self, name: str) -> TokenBucket:
+        """The bucket of member *name*, add it to the :class:`RateLimiter` of the member."""
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = TokenBucket(_ShareSchedule(self, name), self.burst_seconds, self.clock)
+            return self._buckets[name]
+
+    @contextlib.contextmanager
+    def active(self, name: str) -> Iterator[None]:
+        """Counts *name* in the split while the block runs."""
+        with self._lock:
+            self._active.add(name)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.discard(name)
+
+    def share_at(self, name: str, when: dt.datetime | None = None) -> float | None:
+        """Bytes per second of member *name* at *when*, ``None`` for unlimited."""
+        rate = self.schedule.rate_at(when)
+        if rate is None:
+            return None
+        with self._lock:
+            members = len(self._active | {name})
+        return rate / members
+
+
+class RateLimiter:
+    """Throttles writers against all of its buckets."""
+
+    def __init__(self, *buckets: TokenBucket, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.buckets = list(buckets)
+        self.sleep = sleep
+
+    def add(self, bucket: TokenBucket) -> None:
+        self.buckets.append(bucket)
+
+    def __bool__(self) -> bool:
+        return bool(self.buckets)
+
+    def reserve(self, nbytes: int) -> float:
+        return max((bucket.reserve(nbytes) for bucket in self.buckets), default=0.0)
+
+    def acquire(self, nbytes: int) -> None:
+        """Block until *nbytes* may be sent."""
+        wait = self.reserve(nbytes)
+        if wait > 0:
+            self.sleep(wait)
+
+    async def acquire_async(self, nbytes: int) -> None:
+        """Wait, without blocking the event loop, until *nbytes* may be sent."""
+        if any(bucket.blocking for bucket in self.buckets):
+            # e.g. the lock of a :class:`HostTokenBucket` can be held by another process
+            wait = await asyncio.to_thread(self.reserve, nbytes)
+        else:
+            wait = self.reserve(nbytes)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def limiter_from_settings(settings: dict[str, Any]) -> RateLimiter:
+    """
+    A :class:`RateLimiter` from the ``streaming_bandwidth_*`` settings of a project.
+
+    ``streaming_bandwidth_limit``/``streaming_bandwidth_schedule`` limit the project,
+    ``streaming_host_bandwidth_limit``/``streaming_host_bandwidth_schedule`` all the
+    projects on the host sharing ``streaming_host_bandwidth_file``.
+    """
+    limiter = RateLimiter()
+    for prefix in ("streaming_bandwidth", "streaming_host_bandwidth"):
+        limit, windows = settings.get(f"{prefix}_limit"), settings.get(f"{prefix}_schedule") or []
+        if limit is None and not windows:
+            continue
+        schedule = BandwidthSchedule(limit, windows)
+        if prefix == "streaming_host_bandwidth":
+            limiter.add(HostTokenBucket(schedule, settings.get("streaming_host_bandwidth_file")))
+        else:
+            limiter.add(TokenBucket(schedule))
+    return limiter
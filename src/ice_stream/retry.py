@@ -0,0 +1,138 @@
+"""Retries of individual storage requests.
+
+On a flaky uplink a single dropped connection used to abort the whole upload
+transaction, and everything written so far was deleted and re-sent by the next
+run. Instead, the writes are retried where they fail: each chunk PUT of the
+counting zarr store (:mod:`ice_stream.transfer`) and each request of the
+instrumented filesystem, with exponential backoff and full jitter.
+
+Only transient errors are retried, a missing file or a permission error fails
+straight away. Every retry is counted in the :class:`~ice_stream.transfer.TransferStats`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, TypeVar
+
+from loguru import logger
+
+from ._lazy import lazy_import
+
+if TYPE_CHECKING:
+    from .transfer import TransferStats
+
+tenacity = lazy_import("tenacity")
+
+T = TypeVar("T")
+
+# errors that are not going to go away by trying again
+PERMANENT_ERRORS: tuple[type[BaseException], ...] = (
+    FileNotFoundError,
+    FileExistsError,
+    IsADirectoryError,
+    NotADirectoryError,
+    PermissionError,
+)
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    True if *exc* looks like a transient storage error worth retrying.
+
+    Connection resets and timeouts are ``OSError``/``TimeoutError``. The Azure and
+    aiohttp clients raise their own exception types, they are recognised by name
+    so neither has to be imported here.
+    """
+    if isinstance(exc, PERMANENT_ERRORS):
+        return False
+    if isinstance(exc, (OSError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & {"ClientError", "ServiceRequestError", "ServiceResponseError", "IncompleteReadError"}:
+        return True
+    # HTTP 408/429/5xx from the blob service
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    return isinstance(status, int) and (status in (408, 429) or status >= 500)
+
+
+class RetryPolicy:
+    """
+    How often and how long to retry a failed request.
+
+    Parameters
+    ----------
+    attempts : int, optional
+        Attempts in total, including the first one. ``1`` disables retries.
+    initial_wait : float, optional
+        Scale of the backoff in seconds, the n-th retry waits a random time up to
+        ``initial_wait * 2**n``.
+    max_wait : float, optional
+        Upper bound of a single wait in seconds.
+    retry_on : callable, optional
+        Decides whether an exception is retried, by default :func:`is_transient`.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 5,
+        initial_wait: float = 0.5,
+        max_wait: float = 30.0,
+        retry_on: Callable[[BaseException], bool] = is_transient,
+    ) -> None:
+        if attempts < 1:
+            raise ValueError("attempts must be at least 1")
+        self.attempts = attempts
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self.retry_on = retry_on
+
+    @classmethod
+    def from_settings(cls, settings: dict[str, Any] | None) -> RetryPolicy:
+        """A policy from the ``streaming_retry`` setting, e.g. ``{'attempts': 5, 'max_wait': 30}``."""
+        return cls(**(settings or {}))
+
+    def _kwargs(self, stats: TransferStats | None, operation: str, target: str) -> dict[str, Any]:
+        def before_sleep(state: Any) -> None:
+            if stats is not None:
+                stats.record_retry(operation, target)
+            logger.warning(
+                f"{operation} {target or 'request'} failed ({state.outcome.exception()!r}), "
+                f"retry {state.attempt_number}/{self.attempts - 1} in {state.next_action.sleep:.2f}s"
+            )
+
+        return {
+            "stop": tenacity.stop_after_attempt(self.attempts),
+            "wait": tenacity.wait_random_exponential(multiplier=self.initial_wait, max=self.max_wait),
+            "retry": tenacity.retry_if_exception(self.retry_on),
+            "before_sleep": before_sleep,
+            "reraise": True,
+        }
+
+    def call(
+        self,
+        fn: Callable[..., T],
+        *args: Any,
+        stats: TransferStats | None = None,
+        operation: str = "PUT",
+        target: str = "",
+        **kwargs: Any,
+    ) -> T:
+        """Call ``fn(*args, **kwargs)``, retrying transient failures."""
+        if self.attempts == 1:
+            return fn(*args, **kwargs)
+        return tenacity.Retrying(**self._kwargs(stats, operation, target))(fn, *args, **kwargs)
+
+    async def call_async(
+        self,
+        fn: Callable[..., Awaitable[T]],
+        *args: Any,
+        stats: TransferStats | None = None,
+        operation: str = "PUT",
+        target: str = "",
+        **kwargs: Any,
+    ) -> T:
+        """Await ``fn(*args, **kwargs)``, retrying transient failures without blocking the event loop."""
+        if self.attempts == 1:
+            return await fn(*args, **kwargs)
+        return await tenacity.AsyncRetrying(**self._kwargs(stats, operation, target))(fn, *args, **kwargs)
@@ -0,0 +1,137 @@
+"""
+Runs the streaming of several instruments/projects from a single process.
+
+A host often carries several instruments, and running a `Streaming` process per project from cron means paying
+the interpreter start-up, imports and authentication once per project. The `StreamingScheduler` runs all of them
+from one process, on a bounded worker pool:
+
+- **Concurrency budget**: At most `max_workers` projects stream at the same time, the rest wait for a free worker.
+- **Fair share**: A project is never streamed by two workers at once (the state machine is sequential), and
+  projects that were served least recently are started first, so no project starves when there are more
+  projects than workers.
+- **Isolation**: Every project has its own `local_root_path`, and therefore its own streaming state file.
+  A failing project is logged and reported, it doesn't stop the others.
+- **Shared clients**: fsspec caches filesystem instances by their arguments, so projects with the same
+  storage options share the same (already authenticated) storage client.
+- **Resident streams**: `Streaming` instances are kept between runs, so a long running process
+  (see `ice_stream.daemon`) reuses their connections and validated targets. A project that fails is
+  re-created on the next run.
+- **Shared uplink**: `bandwidth_limit` caps the upload rate of all the projects together, on top of the
+  limits in their own settings (see `ice_stream.ratelimit`). The budget is split evenly between the projects
+  that are streaming, a project catching up can't starve the others of bandwidth.
+"""
+
+import os
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from .icestream import Streaming
+from .ratelimit import FairShareBandwidth, Rate
+
+
+class StreamingScheduler:
+    """
+    Streams many projects concurrently in a worker pool.
+
+    Each project is described by the keyword arguments of `Streaming`, plus an optional `name`:
+
+        scheduler = StreamingScheduler([
+            {'name': 'inst-a', 'settings': 'a.yaml', 'local_root_path': '~/streaming/a', 'target_root': 'az://backups'},
+            {'name': 'inst-b', 'settings': 'b.yaml', 'local_root_path': '~/streaming/b', 'target_root': 'az://backups'},
+        ], max_workers=2)
+        errors = scheduler.run()
+    """
+
+    def __init__(self, projects: List[Dict[str, Any]], max_workers: int = 4, bandwidth_limit: Rate = None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.projects: Dict[str, Dict[str, Any]] = {}
+        state_paths = set()
+
+        for project in projects:
+            kwargs = dict(project)
+            name = kwargs.pop('name', None) or os.path.basename(os.path.normpath(kwargs['local_root_path']))
+
+            if name in self.projects:
+                raise ValueError(f"Duplicate streaming project name: {name}")
+
+            # each project needs its own state file, sharing one would corrupt both streams.
+            state_path = os.path.abspath(os.path.expanduser(kwargs['local_root_path']))
+            if state_path in state_paths:
+                raise ValueError(f"Projects must not share a local root path: {state_path}")
+            state_paths.add(state_path)
+
+            self.projects[name] = kwargs
+
+        self.max_workers = max_workers
+        self.last_served: Dict[str, float] = {name: 0.0 for name in self.projects}
+        self.streams: Dict[str, Streaming] = {}
+        # one budget for all the projects of this process, shared by those streaming
+        self.bandwidth = FairShareBandwidth(bandwidth_limit) if bandwidth_limit else None
+
+    def get_streaming(self, name: str) -> Streaming:
+        """Return the resident `Streaming` instance for project `name`, creating it if needed."""
+        if name not in self.streams:
+            streaming = Streaming(**self.projects[name])
+            if self.bandwidth is not None:
+                streaming.rate_limiter.add(self.bandwidth.bucket(name))
+            self.streams[name] = streaming
+        return self.streams[name]
+
+    def run_project(self, name: str) -> Optional[BaseException]:
+        """Stream a single project, returns the exception if it failed."""
+        logger.info(f"Streaming project {name}")
+        try:
+            streaming = self.get_streaming(name)
+            with self.bandwidth.active(name) if self.bandwidth is not None else nullcontext():
+                streaming.stream()
+            return None
+        except Exception as exc:
+            logger.error(f"Streaming project {name} failed: {exc}")
+            # start from a clean slate next time, re-validating the targets.
+            streaming = self.streams.pop(name, None)
+            if streaming is not None:
+                streaming.close()
+            return exc
+        finally:
+            self.last_served[name] = time.monotonic()
+
+    def close(self, flush: bool = False):
+        """
+        Release the state files of all the resident streams. With `flush`, the rows waiting in their
+        carry-over buffers are uploaded first, see `Streaming.close`.
+        """
+        for name, streaming in self.streams.items():
+            try:
+                streaming.close(flush=flush)
+            except Exception as exc:
+                # the buffer is kept, the next run of the project uploads it.
+                logger.error(f"Flushing project {name} failed: {exc}")
+        self.streams = {}
+
+    def run(self) -> Dict[str, Optional[BaseException]]:
+        """
+        Stream all the projects once. Returns the exception for each failed project,
+        or None for the projects that were streamed successfully.
+        """
+        # least recently served first
+        order = sorted(self.projects, key=lambda name: self.last_served[name])
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(order) or 1),
+                                thread_name_prefix='ice-stream') as pool:
+            futures = {name: pool.submit(self.run_project, name) for name in order}
+            results = {name: future.result() for name, future in futures.items()}
+
+        failed = [name for name, exc in results.items() if exc is not None]
+        logger.info(f"Streamed {len(results) - len(failed)}/{len(results)} projects in "
+                    f"{time.monotonic() - start:.2f} seconds")
+        if failed:
+            logger.warning(f"Failed projects: {', '.join(failed)}")
+
+        return results
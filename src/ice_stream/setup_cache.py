@@ -0,0 +1,105 @@
+"""In-memory cache of the project setup data already written to a target.
+
+Every streaming transaction carries the project setup (the ``retro`` and
+``settings_id`` dimensions), but the setup rarely changes. The cache remembers
+which setup entries each target, or setup sideload file, already holds. A
+transaction only has to touch the remote setup data when the vectorized set
+difference against the cache is non-empty.
+
+Setups that were seen before are recognised by their content hash, without
+looking at the entries at all.
+"""
+
+from __future__ import annotations
+
+import hashlib
+
+import numpy as np
+
+from ._lazy import lazy_import
+
+xr = lazy_import("xarray")
+
+SETUP_DIMS = ("retro", "settings_id")
+
+
+def setup_dataset(ds: xr.Dataset) -> xr.Dataset:
+    """The setup part of *ds*, everything that doesn't depend on a time dimension."""
+    return ds.drop_dims(set(ds.dims) - set(SETUP_DIMS))
+
+
+def content_hash(ds: xr.Dataset) -> str:
+    """Hash of the setup variables of *ds*, names, dtypes and values."""
+    digest = hashlib.sha1()
+    setup = setup_dataset(ds)
+    for name in sorted(map(str, setup.variables)):
+        values = np.asarray(setup[name].values)
+        digest.update(f"{name}:{values.dtype}:{values.shape}".encode())
+        if values.dtype.hasobject:
+            digest.update("\x00".join(map(str, values.ravel())).encode())
+        else:
+            digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def _ids(ds: xr.Dataset, dim: str) -> np.ndarray:
+    if dim not in ds.dims:
+        return np.array([])
+    if dim in ds.coords:
+        return np.asarray(ds[dim].values)
+    return np.arange(ds.sizes[dim])
+
+
+class SetupCache:
+    """
+    Setup entries known to be in each target, by url.
+
+    The cache never reads the remote data itself. Callers :meth:`seed` it with
+    what they already loaded, and :meth:`add` what they wrote.
+    """
+
+    def __init__(self) -> None:
+        self._ids: dict[str, dict[str, np.ndarray]] = {}
+        self._hashes: dict[str, set[str]] = {}
+
+    def is_known(self, url: str) -> bool:
+        return url in self._ids
+
+    def seed(self, url: str, ds: xr.Dataset) -> None:
+        """Reset the entries of *url* to the setup of *ds*, the current content of the target."""
+        self._ids[url] = {dim: _ids(ds, dim) for dim in SETUP_DIMS}
+        self._hashes[url] = {content_hash(ds)}
+
+    def new_entries(self, url: str, ds: xr.Dataset) -> dict[str, np.ndarray]:
+        """
+        Setup entries of *ds* that *url* doesn't hold yet, by dimension.
+
+        Returns an empty dict if there is nothing to add. An unknown *url* holds nothing.
+        """
+        known = self._ids.get(url)
+        if known is None:
+            return {dim: ids for dim in SETUP_DIMS if (ids := _ids(ds, dim)).size}
+        if content_hash(ds) in self._hashes[url]:
+            return {}
+
+        new = {}
+        for dim in SETUP_DIMS:
+            ids = _ids(ds, dim)
+            missing = ids[np.isin(ids, known[dim], invert=True)]
+            if missing.size:
+                new[dim] = missing
+        return new
+
+    def add(self, url: str, ds: xr.Dataset) -> None:
+        """Record that the setup of *ds* is now in *url*."""
+        known = self._ids.setdefault(url, {dim: np.array([]) for dim in SETUP_DIMS})
+        for dim in SETUP_DIMS:
+            ids = _ids(ds, dim)
+            if ids.size:
+                known[dim] = np.union1d(known[dim], ids) if known[dim].size else np.unique(ids)
+        self._hashes.setdefault(url, set()).add(content_hash(ds))
+
+    def discard(self, url: str) -> None:
+        """Forget *url*, e.g. when its content is no longer known."""
+        self._ids.pop(url, None)
+        self._hashes.pop(url, None)
@@ -0,0 +1,270 @@
+"""Live instrument simulator for load testing the streamer.
+
+:class:`InstrumentSimulator` replays the output of the mock data generator as if
+an instrument was recording it now: the timestamps are shifted to start at the
+current time, and samples are appended to a local Zarr, NetCDF or icechunk
+source once their time has come. A ``.zip`` source is only written when the
+simulation ends, entries of a zip file can't be appended to. ``speed`` accelerates the clock, e.g. ``60``
+emits an hour of data per minute.
+
+:class:`Simulator` drives several instruments from one loop. Every append is
+recorded with the wall clock time and the last timestamp it contains, so the
+lag of the daemon or cron streaming paths can be measured against the upload
+targets. Nothing leaves the machine, the sources can be streamed to Azurite or
+local storage::
+
+    ice-stream-simulate seed.nc --output inst1.zarr --output inst2.nc --speed 60
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import signal
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from loguru import logger
+
+from .mock_data_generator import TIME_DIMS, SignalSynthesis, _block_writer, iter_mock_blocks
+
+
+class InstrumentSimulator:
+    """
+    One instrument appending mock data to a local source as time passes.
+
+    Parameters
+    ----------
+    seed_file : str or Path
+        Seed dataset of the mock data generator.
+    output : str or Path
+        The source written, ``.zarr``, ``.zip`` or ``.icechunk``, NetCDF otherwise.
+    hours : float, optional
+        Hours of data recorded before the instrument stops.
+    speed : float, optional
+        Simulated seconds per wall clock second.
+    start : timestamp, optional
+        Timestamp of the first sample, by default the wall clock time when the
+        simulator starts.
+    synthesis : SignalSynthesis, optional
+        Varies the repetitions of the seed, by default a :class:`SignalSynthesis`
+        seeded by the name of *output*.
+    instrument : str, optional
+        Overrides the ``instrument`` attribute of the seed.
+    project : str, optional
+        Overrides the ``project`` attribute of the seed.
+    """
+
+    def __init__(
+        self,
+        seed_file: str | Path,
+        output: str | Path,
+        hours: float = 24,
+        speed: float = 1.0,
+        start: Any = None,
+        synthesis: SignalSynthesis | None = None,
+        instrument: str | None = None,
+        project: str | None = None,
+    ) -> None:
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.seed_file = seed_file
+        self.output = Path(output)
+        self.hours = hours
+        self.speed = speed
+        self.start = None if start is None else pd.Timestamp(start).to_datetime64()
+        # crc32 and not hash(), the name has to give the same data in every process
+        self.synthesis = synthesis or SignalSynthesis(seed=zlib.crc32(self.output.name.encode()))
+        self.attrs = {
+            key: value for key, value in (("instrument", instrument), ("project", project)) if value is not None
+        }
+        self.samples = 0
+        self.appends = 0
+        self.last_timestamp: np.datetime64 | None = None
+        self._blocks: Iterator[xr.Dataset] | None = None
+        self._pending: xr.Dataset | None = None
+        self._writer: Any = None
+        self._source: xr.Dataset | None = None
+        self._offset: dict[str, np.timedelta64] = {}
+        self._started_at = 0.0
+        self.done = False
+
+    @property
+    def name(self) -> str:
+        return self.output.name
+
+    def begin(self, now: float) -> None:
+        """Start recording at wall clock time *now*."""
+        self._started_at = now
+        self._blocks = iter_mock_blocks(self.seed_file, target_duration_hours=self.hours, synthesis=self.synthesis)
+        start = self.start if self.start is not None else np.datetime64(pd.Timestamp(now, unit="s"), "ns")
+        first = next(self._blocks)
+        # appends are a few samples each, chunk by repetition of the seed instead
+        self._writer = _block_writer(self.output, chunks={dim: first.sizes[dim] for dim in TIME_DIMS})
+        # both time dimensions move by the offset of the low resolution timestamps
+        offset = start - first["timestamp"].values[0]
+        self._offset = {dim: offset for dim in TIME_DIMS}
+        self._pending = self._shift(first)
+        self.start = start
+
+    def _shift(self, block: xr.Dataset) -> xr.Dataset:
+        block = block.assign_coords({dim: block[dim].values + self._offset[dim] for dim in TIME_DIMS})
+        block.attrs.update(self.attrs)
+        return block
+
+    def simulated_time(self, now: float) -> np.datetime64:
+        """The instrument clock at wall clock time *now*."""
+        elapsed = np.timedelta64(int((now - self._started_at) * self.speed * 1e9), "ns")
+        return self.start + elapsed
+
+    def _due(self, until: np.datetime64) -> list[xr.Dataset]:
+        """The samples recorded up to *until*, in consecutive parts."""
+        parts = []
+        while self._pending is not None:
+            block = self._pending
+            if block["timestamp"].values[-1] <= until:
+                parts.append(block)
+                self._pending = next((self._shift(b) for b in self._blocks), None)
+                continue
+            count = {dim: int(np.searchsorted(block[dim].values, until, "right")) for dim in TIME_DIMS}
+            # the first append creates the source, wait until it has samples in every dimension
+            if count["timestamp"] and (self.appends or parts or count["high_res_timestamp"]):
+                parts.append(block.isel({dim: slice(None, n) for dim, n in count.items()}))
+                self._pending = block.isel({dim: slice(n, None) for dim, n in count.items()})
+            break
+        if self._pending is None:
+            self.done = True
+        return parts
+
+    def close(self) -> xr.Dataset | None:
+        """Finish the source, a ``.zip`` is written now. Returns the source, None if nothing was appended."""
+        if self._writer is not None and self.appends:
+            self._source = self._writer.close()
+        self._writer = None
+        return self._source
+
+    def tick(self, now: float) -> dict[str, Any] | None:
+        """Append the samples due at wall clock time *now*, returns the record of the append."""
+        parts = self._due(self.simulated_time(now))
+        if not parts:
+            return None
+        for part in parts:
+            self._writer.write(part)
+        self.appends += 1
+        samples = {dim: sum(part.sizes[dim] for part in parts) for dim in TIME_DIMS}
+        self.samples += samples["timestamp"]
+        self.last_timestamp = parts[-1]["timestamp"].values[-1]
+        return {
+            "instrument": self.name,
+            "wall_time": now,
+            "last_timestamp": str(self.last_timestamp),
+            "samples": samples["timestamp"],
+            "high_res_samples": samples["high_res_timestamp"],
+        }
+
+
+class Simulator:
+    """
+    Runs several :class:`InstrumentSimulator` from one loop.
+
+    Parameters
+    ----------
+    instruments : list of InstrumentSimulator
+        The simulated instruments.
+    interval : float, optional
+        Wall clock seconds between appends.
+    log_path : str or Path, optional
+        JSON lines file receiving the record of every append.
+    clock : callable, optional
+        Wall clock in seconds, by default :func:`time.time`.
+    sleep : callable, optional
+        By default :func:`time.sleep`.
+    """
+
+    def __init__(
+        self,
+        instruments: list[InstrumentSimulator],
+        interval: float = 1.0,
+        log_path: str | Path | None = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.instruments = instruments
+        self.interval = interval
+        self.log_path = Path(log_path) if log_path else None
+        self.clock = clock
+        self.sleep = sleep
+        self.records: list[dict[str, Any]] = []
+        self._stopped = False
+
+    def stop(self) -> None:
+        self._stopped = True
+
+    def _record(self, record: dict[str, Any]) -> None:
+        self.records.append(record)
+        if self.log_path is not None:
+            with self.log_path.open("a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+
+    def run(self, duration: float | None = None) -> dict[str, Any]:
+        """
+        Append data until every instrument is done, or for *duration* wall clock
+        seconds, and close the sources. Returns the ``appends`` and ``samples``
+        of every instrument.
+        """
+        begin = self.clock()
+        for instrument in self.instruments:
+            instrument.begin(begin)
+        logger.info(f"Simulating {len(self.instruments)} instrument(s) from {self.instruments[0].start}")
+
+        try:
+            while not self._stopped:
+                now = self.clock()
+                for instrument in self.instruments:
+                    if not instrument.done:
+                        record = instrument.tick(now)
+                        if record is not None:
+                            self._record(record)
+                if all(instrument.done for instrument in self.instruments):
+                    break
+                if duration is not None and now - begin >= duration:
+                    break
+                self.sleep(max(0.0, begin + self.interval * (int((now - begin) / self.interval) + 1) - self.clock()))
+        finally:
+            for instrument in self.instruments:
+                instrument.close()
+
+        return {
+            instrument.name: {"appends": instrument.appends, "samples": instrument.samples}
+            for instrument in self.instruments
+        }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Simulate live instruments writing to local sources.")
+    parser.add_argument("seed", help="Seed dataset of the mock data generator.")
+    parser.add_argument("--output", action="append", required=True, help="Source of one instrument, repeatable.")
+    parser.add_argument("--hours", type=float, default=24, help="Hours of data recorded by each instrument.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Simulated seconds per second.")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between appends.")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds.")
+    parser.add_argument("--log", help="JSON lines file receiving a record of every append.")
+    args = parser.parse_args(argv)
+
+    instruments = [
+        InstrumentSimulator(args.seed, output, hours=args.hours, speed=args.speed, instrument=Path(output).stem)
+        for output in args.output
+    ]
+    simulator = Simulator(instruments, interval=args.interval, log_path=args.log)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: simulator.stop())
+    logger.info(f"Simulation finished: {simulator.run(args.duration)}")
+
+
+if __name__ == "__main__":
+    main()
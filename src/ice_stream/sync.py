@@ -0,0 +1,341 @@
+"""Incremental sync of local repositories and targets to remote storage.
+
+Writing straight to Azure makes ingestion wait for the network, and an outage
+fails the upload. Instead, data can be committed to a local repository
+(:func:`local_repository`) and pushed to the remote repository by
+:class:`IcechunkSync`, in its own process or loop. An outage then becomes a
+backlog of objects to push, not a failure. :class:`TargetSync` does the same
+for the zarr targets of :class:`~ice_stream.icestream.Streaming`, see its
+``streaming_local_first`` setting.
+
+Icechunk objects are immutable and named by their id, except for the refs. A
+sync reads the local refs first, then pushes the objects in dependency order::
+
+    chunks -> manifests -> transactions -> snapshots -> config.yaml, refs
+
+so a remote branch never points at a snapshot whose chunks are missing.
+
+What was pushed is kept in a local record next to the local copy (a
+:class:`SyncRecord`), a sync only compares the local files against it and
+doesn't list the remote. Every batch is verified by the sizes of the uploaded
+objects, and recorded, before the next batch starts, so an interrupted sync
+resumes where it stopped. Without a record, e.g. on the first sync from this
+host, the remote is listed once to seed it. ``full=True`` lists it again, for
+when the remote may have lost objects.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import fsspec
+from loguru import logger
+
+from ._io import atomic_write
+from ._lazy import lazy_import
+from .ratelimit import RateLimiter, TokenBucket
+from .retry import RetryPolicy
+from .transfer import InstrumentedFileSystem, TransferStats
+
+icechunk = lazy_import("icechunk")
+
+# immutable objects, in the order they are pushed
+OBJECT_PREFIXES = ("chunks", "manifests", "transactions", "snapshots")
+# mutable objects, pushed last
+REF_PREFIX = "refs"
+CONFIG_FILE = "config.yaml"
+# zarr metadata of the targets, pushed after the chunks it describes
+ZARR_METADATA = frozenset({"zarr.json", ".zarray", ".zattrs", ".zgroup", ".zmetadata"})
+
+
+class SyncError(RuntimeError):
+    """An uploaded object doesn't match its local copy."""
+
+
+def local_repository(path: str) -> Any:
+    """Open the local icechunk repository at *path*, creating it if needed."""
+    storage = icechunk.local_filesystem_storage(os.path.abspath(os.path.expanduser(path)))
+    return icechunk.Repository.open_or_create(storage)
+
+
+class SyncRecord:
+    """
+    The objects pushed to *remote_url*, relative path -> ``[size, mtime_ns]``, in a local JSON file.
+
+    A record written for another remote is ignored. :attr:`objects` is None as
+    long as nothing is known about the remote.
+    """
+
+    def __init__(self, path: str, remote_url: str) -> None:
+        self.path = path
+        self.remote_url = remote_url
+        self.objects: dict[str, list] | None = None
+        try:
+            with open(path, encoding="utf-8") as file:
+                document = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning(f"Ignoring the corrupt sync record {path}")
+            return
+        if document.get("remote") == remote_url:
+            self.objects = document.get("objects", {})
+
+    def update(self, objects: dict[str, list]) -> None:
+        self.objects = {**(self.objects or {}), **objects}
+        self.save()
+
+    def remove(self, relatives: list[str]) -> None:
+        for relative in relatives:
+            (self.objects or {}).pop(relative, None)
+        self.save()
+
+    def save(self) -> None:
+        atomic_write(self.path, json.dumps({"remote": self.remote_url, "objects": self.objects or {}}) + "\n")
+
+
+class _Sync:
+    """Pushes the files under a local path to a remote fsspec location, in verified batches."""
+
+    def __init__(
+        self,
+        local_path: str,
+        remote_url: str,
+        stats: TransferStats | None = None,
+        limiter: RateLimiter | None = None,
+        retry: RetryPolicy | None = None,
+        batch_size: int = 64,
+        max_workers: int = 8,
+        record_path: str | None = None,
+        **storage_options: Any,
+    ) -> None:
+        self.local_path = os.path.abspath(os.path.expanduser(local_path))
+        self.remote_url = remote_url.rstrip("/")
+        self.stats = stats or TransferStats()
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        fs, self.remote_root = fsspec.core.url_to_fs(self.remote_url, **{"auto_mkdir": True, **storage_options})
+        self.fs = InstrumentedFileSystem(fs, self.stats, self.remote_url, limiter, retry or RetryPolicy())
+        # next to the local copy, never pushed itself
+        self.record = SyncRecord(record_path or f"{self.local_path}.sync.json", self.remote_url)
+
+    def _remote(self, relative: str) -> str:
+        return f"{self.remote_root}/{relative}"
+
+    def _local_objects(self, prefix: str = "") -> dict[str, list]:
+        """Relative path -> ``[size, mtime_ns]`` of the local files under *prefix*."""
+        objects = {}
+        for root, _, files in os.walk(os.path.join(self.local_path, prefix)):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                objects[os.path.relpath(path, self.local_path).replace(os.sep, "/")] = [stat.st_size, stat.st_mtime_ns]
+        return objects
+
+    def _remote_objects(self, prefix: str = "") -> dict[str, list]:
+        """Relative path -> ``[size, None]`` of the remote objects under *prefix*, one listing."""
+        root = self._remote(prefix) if prefix else self.remote_root
+        try:
+            found = self.fs.find(root, detail=True)
+        except FileNotFoundError:
+            return {}
+        # found paths are relative to the filesystem, like the remote root
+        start = len(self.remote_root.rstrip("/")) + 1
+        return {path[start:]: [info.get("size") or 0, None] for path, info in found.items()}
+
+    def _pushed(self, prefixes: tuple[str, ...], full: bool) -> dict[str, list]:
+        """The record of the pushed objects, seeded by listing *prefixes* on the remote if needed."""
+        if full or self.record.objects is None:
+            listed: dict[str, list] = {}
+            for prefix in prefixes:
+                listed.update(self._remote_objects(prefix))
+            # what the remote holds with the size of the local copy, counts as pushed
+            known = self.record.objects or {}
+            self.record.objects = {
+                relative: known.get(relative, entry) if known.get(relative, [None])[0] == entry[0] else entry
+                for relative, entry in listed.items()
+            }
+            self.record.save()
+        return self.record.objects
+
+    def _push_batch(self, batch: list[str], local: dict[str, list]) -> None:
+        def upload(relative: str) -> None:
+            self.fs.put_file(os.path.join(self.local_path, relative), self._remote(relative))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ice-sync") as pool:
+            list(pool.map(upload, batch))
+
+        # only the batch is verified, the rest of the remote isn't listed
+        uploaded = self.fs.sizes([self._remote(relative) for relative in batch])
+        wrong = [relative for relative, size in zip(batch, uploaded) if size != local[relative][0]]
+        if wrong:
+            raise SyncError(f"{len(wrong)} object(s) don't match their local copy after upload, e.g. {wrong[0]}")
+        self.record.update({relative: local[relative] for relative in batch})
+
+    def _push(self, names: list[str], local: dict[str, list]) -> int:
+        """Push *names* in batches, returns the bytes uploaded."""
+        nbytes = 0
+        for i in range(0, len(names), self.batch_size):
+            batch = names[i : i + self.batch_size]
+            self._push_batch(batch, local)
+            nbytes += sum(local[name][0] for name in batch)
+        return nbytes
+
+
+class IcechunkSync(_Sync):
+    """
+    Pushes a local icechunk repository to a remote fsspec location.
+
+    Parameters
+    ----------
+    local_path : str
+        Path of the local repository.
+    remote_url : str
+        fsspec url of the remote repository, e.g. ``az://container/inst/project.icechunk``.
+    stats : TransferStats, optional
+        Counts the requests made to the remote.
+    limiter : RateLimiter, optional
+        Throttles the uploads.
+    retry : RetryPolicy, optional
+        Retries failed requests, by default a :class:`~ice_stream.retry.RetryPolicy`.
+    batch_size : int, optional
+        Objects uploaded, then verified, together.
+    max_workers : int, optional
+        Concurrent uploads within a batch.
+    record_path : str, optional
+        The :class:`SyncRecord` of the pushed objects, ``<local_path>.sync.json`` by default.
+    **storage_options
+        Passed to the remote fsspec filesystem.
+    """
+
+    def pending(self, full: bool = False) -> dict[str, dict[str, int]]:
+        """The immutable objects not pushed yet, by prefix, relative path -> size."""
+        pushed = self._pushed(OBJECT_PREFIXES, full)
+        pending = {}
+        for prefix in OBJECT_PREFIXES:
+            # immutable, the size tells whether the object made it
+            pending[prefix] = {
+                relative: entry[0]
+                for relative, entry in self._local_objects(prefix).items()
+                if pushed.get(relative, [None])[0] != entry[0]
+            }
+        return pending
+
+    def _read_mutable(self) -> dict[str, bytes]:
+        """The refs and the config, read before the objects they point to are pushed."""
+        contents = {}
+        for relative in [*self._local_objects(REF_PREFIX), CONFIG_FILE]:
+            path = os.path.join(self.local_path, relative)
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    contents[relative] = file.read()
+        return contents
+
+    def sync(self, full: bool = False) -> dict[str, int]:
+        """
+        Push everything that wasn't pushed yet, *full* lists the remote to find
+        out. Returns the number of ``objects`` and ``bytes`` uploaded, and the
+        number of ``refs`` updated.
+        """
+        start = time.monotonic()
+        # refs first: objects committed while syncing are pushed, but not referenced, until the next sync.
+        mutable = self._read_mutable()
+        objects = nbytes = refs = 0
+
+        for prefix, missing in self.pending(full).items():
+            names = sorted(missing)
+            nbytes += self._push(names, {name: [size, None] for name, size in missing.items()})
+            objects += len(names)
+            if names:
+                logger.info(f"Synced {len(names)} {prefix} to {self.remote_url}")
+
+        for relative, content in mutable.items():
+            try:
+                current = self.fs.cat_file(self._remote(relative))
+            except FileNotFoundError:
+                current = None
+            if current != content:
+                self.fs.pipe_file(self._remote(relative), content)
+                refs += 1
+
+        logger.info(
+            f"Sync of {self.local_path} completed in {time.monotonic() - start:.2f} seconds, "
+            f"{objects} objects, {nbytes / 1024 / 1024:.2f} MB, {refs} refs updated"
+        )
+        return {"objects": objects, "bytes": nbytes, "refs": refs}
+
+
+class TargetSync(_Sync):
+    """
+    Mirrors a local folder of zarr targets to a remote fsspec location.
+
+    Unlike icechunk objects, the files of a zarr target change as it grows. A
+    file is pushed again when its size or modification time differs from the
+    record. The chunks of a sync are pushed before the metadata that describes
+    them, and files removed locally, e.g. by a rolled back transaction, are
+    removed from the remote. Takes the parameters of :class:`IcechunkSync`.
+    """
+
+    def pending(self, full: bool = False) -> dict[str, list]:
+        """The files changed since they were pushed, relative path -> ``[size, mtime_ns]``."""
+        pushed = self._pushed(("",), full)
+        return {relative: entry for relative, entry in self._local_objects().items() if pushed.get(relative) != entry}
+
+    def sync(self, full: bool = False) -> dict[str, int]:
+        """
+        Push the changed files, *full* lists the remote to find out. Returns the
+        number of ``objects`` and ``bytes`` uploaded, and of ``deleted`` objects.
+        """
+        start = time.monotonic()
+        changed = self.pending(full)
+        names = sorted(changed, key=lambda relative: (relative.rsplit("/", 1)[-1] in ZARR_METADATA, relative))
+        nbytes = self._push(names, changed)
+
+        local = self._local_objects()
+        deleted = [relative for relative in self.record.objects or {} if relative not in local]
+        for relative in deleted:
+            try:
+                self.fs.rm_file(self._remote(relative))
+            except FileNotFoundError:
+                pass
+        if deleted:
+            self.record.remove(deleted)
+
+        logger.info(
+            f"Sync of {self.local_path} completed in {time.monotonic() - start:.2f} seconds, "
+            f"{len(names)} objects, {nbytes / 1024 / 1024:.2f} MB, {len(deleted)} deleted"
+        )
+        return {"objects": len(names), "bytes": nbytes, "deleted": len(deleted)}
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Push a local icechunk repository to remote storage.")
+    parser.add_argument("local", help="Path of the local repository.")
+    parser.add_argument("remote", help="fsspec url of the remote repository.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent uploads.")
+    parser.add_argument("--bandwidth-limit", help="Upload limit, e.g. '1 Mbit/s'.")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between syncs, 0 to sync once.")
+    args = parser.parse_args(argv)
+
+    limiter = RateLimiter(TokenBucket(args.bandwidth_limit)) if args.bandwidth_limit else None
+    syncer = IcechunkSync(args.local, args.remote, limiter=limiter, max_workers=args.workers)
+    while True:
+        try:
+            syncer.sync()
+        except Exception as exc:
+            if not args.interval:
+                raise
+            # offline: the backlog is pushed by a later sync.
+            logger.warning(f"Sync failed, retrying in {args.interval:.0f} seconds: {exc}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Head pointer and index of the targets streamed by a project.
+
+Finding the last valid target used to mean listing every file under the target
+root. Each project now keeps two small objects at the target root, under
+``_streaming/<key>/``:
+
+* ``head.yaml`` with the url of the last target the project created, and
+* ``index.yaml`` with all of the project's targets, sorted by their first
+  timestamp.
+
+Both are written when a new target completes. Recovery reads the head, then walks
+the index newest first. A missing or corrupt object is treated as empty. A bounded,
+concurrent, newest-first listing of the project's folder is only used if both are
+missing or stale. Other projects share the target root, so while the project's
+folder is unknown nothing is listed.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+from urllib.parse import urlparse
+
+import yaml
+from loguru import logger
+
+INDEX_DIR = "_streaming"
+
+
+def _name(path: str) -> str:
+    return os.path.basename(path.rstrip("/"))
+
+
+class TargetIndex:
+    """
+    The head pointer and target index of one project.
+
+    Parameters
+    ----------
+    fs : fsspec.AbstractFileSystem
+        Filesystem of the target root.
+    target_root : str
+        fsspec url of the target root.
+    key : str or None
+        Name of the project, the objects are stored under ``_streaming/<key>/``.
+        ``None`` if the project isn't known yet, there is no head or index to read.
+    prefix : str, optional
+        Folder of the project's targets relative to the target root, e.g.
+        ``<instrument>/<project>``, the only folder listed. ``None`` if unknown.
+    """
+
+    def __init__(self, fs: Any, target_root: str, key: str | None, prefix: str | None = None) -> None:
+        self.fs = fs
+        self.target_root = target_root
+        self.key = key
+        self.prefix = prefix
+        parsed = urlparse(target_root)
+        self.root_path = (parsed.netloc + parsed.path).rstrip("/")
+        self.path = f"{self.root_path}/{INDEX_DIR}/{key}".rstrip("/")
+        self._entries: list[dict[str, str]] | None = None
+
+    def _read(self, name: str) -> dict[str, Any]:
+        """The mapping in object *name*, empty if it is missing or corrupt."""
+        if self.key is None:
+            return {}
+        try:
+            data = yaml.safe_load(self.fs.cat_file(f"{self.path}/{name}"))
+        except FileNotFoundError:
+            return {}
+        except yaml.YAMLError as exc:
+            logger.warning(f"Ignoring the corrupt {name} of the target index {self.path}: {exc}")
+            return {}
+        if not isinstance(data, dict):
+            logger.warning(f"Ignoring the {name} of the target index {self.path}, not a mapping")
+            return {}
+        return data
+
+    def _write(self, name: str, data: Any) -> None:
+        self.fs.pipe_file(f"{self.path}/{name}", yaml.safe_dump(data, sort_keys=False).encode("utf-8"))
+
+    def _url(self, path: str) -> str:
+        """The url of a listed *path*, in the form of the target root url."""
+        relative = path.lstrip("/")[len(self.root_path.lstrip("/")):]
+        return self.target_root.rstrip("/") + relative
+
+    def head(self) -> str:
+        """Url of the last target created by the project, empty if unknown."""
+        target = self._read("head.yaml").get("target", "")
+        return target if isinstance(target, str) else ""
+
+    def entries(self) -> list[dict[str, str]]:
+        """The indexed targets, oldest first."""
+        if self._entries is None:
+            targets = self._read("index.yaml").get("targets", [])
+            self._entries = [
+                entry for entry in (targets if isinstance(targets, list) else [])
+                if isinstance(entry, dict) and isinstance(entry.get("target"), str)
+            ]
+        return self._entries
+
+    def record(self, target_url: str, start: object = None) -> None:
+        """Add *target_url* to the index, starting at *start*, and make it the head."""
+        if self.key is None:
+            raise ValueError("The target index has no key")
+        entries = [entry for entry in self.entries() if entry["target"] != target_url]
+        entries.append({"target": target_url, "start": "" if start is None else str(start)})
+        entries.sort(key=lambda entry: (entry["start"], _name(entry["target"])))
+        # the index first, a head that isn't indexed would be lost once the head moves on.
+        self._write("index.yaml", {"targets": entries})
+        self._write("head.yaml", {"target": target_url})
+        self._entries = entries
+
+    def candidates(self) -> Iterable[str]:
+        """Targets to try as the last valid target, newest first."""
+        seen = set()
+        head = self.head()
+        if head:
+            seen.add(head)
+            yield head
+        for entry in reversed(self.entries()):
+            if entry["target"] not in seen:
+                seen.add(entry["target"])
+                yield entry["target"]
+
+    def list_targets(self, exclude: Callable[[str], bool] = lambda name: False,
+                     max_workers: int = 8, max_depth: int = 8) -> list[str]:
+        """
+        List the targets (``.zarr`` folders) in the project's folder, newest (by name) first.
+        Nothing is listed while the folder is unknown.
+
+        Folders are listed one level at a time by at most *max_workers* concurrent
+        requests. The listing never descends into the targets, the index folder, or
+        more than *max_depth* levels.
+        """
+        found: list[str] = []
+        if self.prefix is None:
+            return found
+        level = [f"{self.root_path}/{self.prefix}".rstrip("/")]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ice-stream-list") as pool:
+            for _ in range(max_depth):
+                if not level:
+                    break
+                children = []
+                for listing in pool.map(lambda path: self.fs.ls(path, detail=True), level):
+                    for info in listing:
+                        if info.get("type") != "directory":
+                            continue
+                        path = info["name"].rstrip("/")
+                        name = _name(path)
+                        if name == INDEX_DIR:
+                            continue
+                        if name.endswith(".zarr"):
+                            if not exclude(name):
+                                found.append(self._url(path))
+                        else:
+                            children.append(path)
+                level = children
+        return sorted(found, key=_name, reverse=True)
+
+    def find_last_valid(self, validate: Callable[[str], Any],
+                        exclude: Callable[[str], bool] = lambda name: False) -> tuple[str, Any]:
+        """
+        Return the newest target that passes *validate*, and what *validate* returned.
+
+        Returns ``("", None)`` if no target is valid.
+        """
+        for target in self.candidates():
+            ds = validate(target)
+            if ds is not None:
+                return target, ds
+            logger.warning(f"Indexed target {target} is not valid, trying the next one")
+
+        if self.prefix is None:
+            logger.warning(f"No valid target in the index, the folder of the project under {self.target_root} is unknown")
+            return "", None
+        logger.warning(f"No valid target in the index, listing {self.target_root.rstrip('/')}/{self.prefix}")
+        for target in self.list_targets(exclude):
+            ds = validate(target)
+            if ds is not None:
+                return target, ds
+
+        return "", None
@@ -0,0 +1,371 @@
+"""Accounting of the requests and bytes ice_stream sends to storage.
+
+The size of the local export is a poor estimate of what goes over the wire, it
+misses the high resolution and setup stores and the metadata. Host-wide network
+counters pick up every other process. Instead, the storage ice_stream writes to
+is wrapped, and every request is counted by operation type and target:
+
+* :class:`CountingStore` wraps a zarr store, e.g. the ``store`` of an icechunk
+  session, or an fsspec backed zarr store (see :func:`counting_store`).
+* :class:`InstrumentedFileSystem` wraps an fsspec filesystem.
+
+Both report to a :class:`TransferStats`, which is safe to share between threads
+and streams. Both optionally retry failed requests (see :mod:`ice_stream.retry`)
+and throttle writes (see :mod:`ice_stream.ratelimit`).
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import threading
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterable
+
+from ._lazy import lazy_import
+
+if TYPE_CHECKING:
+    from zarr.abc.store import ByteRequest, Store
+    from zarr.core.buffer import Buffer, BufferPrototype
+
+    from .ratelimit import RateLimiter
+    from .retry import RetryPolicy
+
+zarr_storage = lazy_import("zarr.storage")
+
+OPERATIONS = ("GET", "PUT", "LIST", "DELETE")
+
+
+class TransferStats:
+    """Thread-safe request and byte counters, by operation type and target."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (target, operation) -> [requests, bytes]
+        self._counts: dict[tuple[str, str], list[int]] = defaultdict(lambda: [0, 0])
+        # (target, operation) -> retried requests
+        self._retries: dict[tuple[str, str], int] = defaultdict(int)
+
+    def record(self, operation: str, nbytes: int = 0, target: str = "", requests: int = 1) -> None:
+        """Count *requests* of *operation* moving *nbytes* to or from *target*."""
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {OPERATIONS}")
+        with self._lock:
+            counts = self._counts[(target, operation)]
+            counts[0] += requests
+            counts[1] += int(nbytes)
+
+    def record_retry(self, operation: str, target: str = "") -> None:
+        """Count a retry of a failed *operation* on *target*."""
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {OPERATIONS}")
+        with self._lock:
+            self._retries[(target, operation)] += 1
+
+    def retries(self, operation: str | None = None, target: str | None = None) -> int:
+        """Number of retried requests, optionally of one *operation* and/or *target*."""
+        with self._lock:
+            return sum(
+                count
+                for (t, op), count in self._retries.items()
+                if (operation is None or op == operation) and (target is None or t == target)
+            )
+
+    def retry_totals(self) -> dict[str, int]:
+        """Retried requests by operation, over all targets."""
+        totals = dict.fromkeys(OPERATIONS, 0)
+        with self._lock:
+            for (_, op), count in self._retries.items():
+                totals[op] += count
+        return totals
+
+    def _sum(self, index: int, operation: str | None, target: str | None) -> int:
+        with self._lock:
+            return sum(
+                counts[index]
+                for (t, op), counts in self._counts.items()
+                if (operation is None or op == operation) and (target is None or t == target)
+            )
+
+    def requests(self, operation: str | None = None, target: str | None = None) -> int:
+        """Number of requests, optionally of one *operation* and/or *target*."""
+        return self._sum(0, operation, target)
+
+    def bytes(self, operation: str | None = None, target: str | None = None) -> int:
+        """Number of bytes, optionally of one *operation* and/or *target*."""
+        return self._sum(1, operation, target)
+
+    def totals(self) -> dict[str, dict[str, int]]:
+        """Requests and bytes by operation, over all targets."""
+        totals = {op: {"requests": 0, "bytes": 0} for op in OPERATIONS}
+        with self._lock:
+            for (_, op), (requests, nbytes) in self._counts.items():
+                totals[op]["requests"] += requests
+                totals[op]["bytes"] += nbytes
+        return totals
+
+    def by_target(self) -> dict[str, dict[str, dict[str, int]]]:
+        """Requests and bytes by target and operation."""
+        result: dict[str, dict[str, dict[str, int]]] = {}
+        with self._lock:
+            for (target, op), (requests, nbytes) in self._counts.items():
+                result.setdefault(target, {})[op] = {"requests": requests, "bytes": nbytes}
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self._retries.clear()
+
+    def summary(self) -> str:
+        """One line summary, e.g. for the final log line of a run."""
+        summary = ", ".join(
+            f"{op} {counts['requests']} req/{counts['bytes'] / 1024 / 1024:.2f} MB"
+            for op, counts in self.totals().items()
+            if counts["requests"]
+        ) or "no requests"
+        retries = self.retries()
+        return f"{summary}, {retries} retries" if retries else summary
+
+
+@functools.cache
+def _counting_store_class() -> type:
+    """Define :class:`CountingStore` on first use, so importing this module doesn't import zarr."""
+
+    class CountingStore(zarr_storage.WrapperStore):
+        """
+        A zarr store counting the requests made to the wrapped store.
+
+        Parameters
+        ----------
+        store : zarr.abc.store.Store
+            The store to wrap.
+        stats : TransferStats
+            Where to count the requests.
+        target : str, optional
+            Name of the target in *stats*, e.g. its url.
+        limiter : RateLimiter, optional
+            Throttles the writes.
+        retry : RetryPolicy, optional
+            Retries failed requests, every chunk on its own.
+        """
+
+        def __init__(
+            self,
+            store: Store,
+            stats: TransferStats,
+            target: str = "",
+            limiter: RateLimiter | None = None,
+            retry: RetryPolicy | None = None,
+        ) -> None:
+            super().__init__(store)
+            self.stats = stats
+            self.target = target
+            self.limiter = limiter
+            self.retry = retry
+
+        def _with_store(self, store: Store) -> "CountingStore":
+            return type(self)(store, self.stats, self.target, self.limiter, self.retry)
+
+        async def _call(self, operation: str, fn: Any, *args: Any) -> Any:
+            if self.retry is None:
+                return await fn(*args)
+            return await self.retry.call_async(fn, *args, stats=self.stats, operation=operation, target=self.target)
+
+        async def _put(self, fn: Any, key: str, value: Buffer) -> None:
+            # a retried chunk is sent again, and waits for the limiter again.
+            if self.limiter:
+                await self.limiter.acquire_async(len(value))
+            await fn(key, value)
+
+        @property
+        def supports_consolidated_metadata(self) -> bool:
+            return self._store.supports_consolidated_metadata
+
+        async def get(self, key: str, prototype: BufferPrototype, byte_range: ByteRequest | None = None) -> Buffer | None:
+            value = await self._call("GET", self._store.get, key, prototype, byte_range)
+            self.stats.record("GET", 0 if value is None else len(value), self.target)
+            return value
+
+        async def get_partial_values(
+            self, prototype: BufferPrototype, key_ranges: Iterable[tuple[str, ByteRequest | None]]
+        ) -> list[Buffer | None]:
+            key_ranges = list(key_ranges)
+            values = await self._call("GET", self._store.get_partial_values, prototype, key_ranges)
+            self.stats.record(
+                "GET", sum(len(v) for v in values if v is not None), self.target, requests=len(values)
+            )
+            return values
+
+        async def exists(self, key: str) -> bool:
+            self.stats.record("GET", 0, self.target)
+            return await self._call("GET", self._store.exists, key)
+
+        async def set(self, key: str, value: Buffer) -> None:
+            await self._call("PUT", self._put, self._store.set, key, value)
+            self.stats.record("PUT", len(value), self.target)
+
+        async def set_if_not_exists(self, key: str, value: Buffer) -> None:
+            await self._call("PUT", self._put, self._store.set_if_not_exists, key, value)
+            self.stats.record("PUT", len(value), self.target)
+
+        async def delete(self, key: str) -> None:
+            await self._store.delete(key)
+            self.stats.record("DELETE", 0, self.target)
+
+        async def _counted_listing(self, listing: AsyncIterator[str]) -> AsyncIterator[str]:
+            self.stats.record("LIST", 0, self.target)
+            async for key in listing:
+                yield key
+
+        def list(self) -> AsyncIterator[str]:
+            return self._counted_listing(self._store.list())
+
+        def list_prefix(self, prefix: str) -> AsyncIterator[str]:
+            return self._counted_listing(self._store.list_prefix(prefix))
+
+        def list_dir(self, prefix: str) -> AsyncIterator[str]:
+            return self._counted_listing(self._store.list_dir(prefix))
+
+    return CountingStore
+
+
+def counting_store(
+    store: Store,
+    stats: TransferStats,
+    target: str = "",
+    limiter: RateLimiter | None = None,
+    retry: RetryPolicy | None = None,
+) -> Any:
+    """
+    Wrap the zarr *store* in a :class:`CountingStore`.
+
+    Icechunk sessions only accept their own store in ``to_icechunk``, write through
+    ``Dataset.to_zarr(counting_store(session.store, stats), consolidated=False)`` instead.
+    Chunks and metadata are counted as zarr writes them, the manifests and snapshot
+    written by the commit aren't.
+    """
+    return _counting_store_class()(store, stats, target, limiter, retry)
+
+
+def counting_zarr_store(
+    url: str,
+    stats: TransferStats,
+    limiter: RateLimiter | None = None,
+    retry: RetryPolicy | None = None,
+    **storage_options: Any,
+) -> Any:
+    """A :class:`CountingStore` over the fsspec zarr store at *url*, counted as target *url*."""
+    store = zarr_storage.FsspecStore.from_url(url, storage_options=storage_options or None)
+    return counting_store(store, stats, url, limiter, retry)
+
+
+def zarr_store_kwargs(
+    url: str,
+    stats: TransferStats | None,
+    limiter: RateLimiter | None = None,
+    retry: RetryPolicy | None = None,
+    **storage_options: Any,
+) -> dict[str, Any]:
+    """
+    Keyword arguments opening *url* with ``xr.open_zarr``/``Dataset.to_zarr``,
+    through a counting (throttled, retrying) store if *stats* are collected.
+    """
+    if stats is None:
+        return {"store": url, "storage_options": storage_options}
+    return {"store": counting_zarr_store(url, stats, limiter, retry, **storage_options)}
+
+
+def _size(value: Any) -> int:
+    if isinstance(value, dict):
+        return sum(_size(v) for v in value.values())
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+class InstrumentedFileSystem:
+    """
+    An fsspec filesystem proxy counting the requests made through it.
+
+    Only the calls ice_stream makes are counted by type, and retried if a *retry*
+    policy is given. Anything else is passed through uncounted.
+    """
+
+    _GET = ("cat", "cat_file", "get", "get_file", "exists", "info", "isdir", "isfile", "size")
+    _PUT = ("pipe", "pipe_file", "touch", "makedirs", "mkdir")
+    _LIST = ("ls", "find", "glob", "walk", "du")
+    _DELETE = ("rm", "rm_file", "rmdir")
+
+    def __init__(
+        self,
+        fs: Any,
+        stats: TransferStats,
+        target: str = "",
+        limiter: RateLimiter | None = None,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        self.fs = fs
+        self.stats = stats
+        self.target = target
+        self.limiter = limiter
+        self.retry = retry
+
+    def _call(self, operation: str, fn: Any, *args: Any, **kwargs: Any) -> Any:
+        if self.retry is None:
+            return fn(*args, **kwargs)
+        return self.retry.call(fn, *args, stats=self.stats, operation=operation, target=self.target, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.fs, name)
+        if not callable(attr):
+            return attr
+        for operation, names in (("GET", self._GET), ("PUT", self._PUT), ("LIST", self._LIST), ("DELETE", self._DELETE)):
+            if name in names:
+                return self._counted(attr, name, operation)
+        return attr
+
+    def _counted(self, method: Any, name: str, operation: str) -> Any:
+        def counted(*args: Any, **kwargs: Any) -> Any:
+            nbytes = 0
+            if name in ("pipe", "pipe_file"):
+                value = kwargs.get("value", args[1] if len(args) > 1 else None)
+                nbytes = _size(value) if value is not None else _size(args[0] if args else {})
+
+            def attempt() -> Any:
+                # a retried write is sent again, and waits for the limiter again.
+                if self.limiter and nbytes:
+                    self.limiter.acquire(nbytes)
+                return method(*args, **kwargs)
+
+            result = self._call(operation, attempt)
+            if name in ("cat", "cat_file"):
+                nbytes = _size(result)
+            self.stats.record(operation, nbytes, self.target)
+            return result
+
+        return counted
+
+    def put_file(self, lpath: str, rpath: str, **kwargs: Any) -> Any:
+        nbytes = os.path.getsize(lpath)
+
+        def attempt() -> Any:
+            if self.limiter:
+                self.limiter.acquire(nbytes)
+            return self.fs.put_file(lpath, rpath, **kwargs)
+
+        result = self._call("PUT", attempt)
+        self.stats.record("PUT", nbytes, self.target)
+        return result
+
+    def open(self, path: str, mode: str = "rb", **kwargs: Any) -> Any:
+        # only the request is counted, the size of streamed reads/writes isn't known here.
+        self.stats.record("PUT" if any(c in mode for c in "wax") else "GET", 0, self.target)
+        return self.fs.open(path, mode, **kwargs)
+
+
+def __getattr__(name: str) -> Any:
+    if name == "CountingStore":
+        return _counting_store_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,6 +6,8 @@ import json
 from pathlib import Path
 import pytest
 
+from tests.helpers import synthetic_seed  # noqa: F401, shared fixture
+
 
 def _is_azurite_running(host: str = "127.0.0.1", port: int = 10000) -> bool:
     """Return True if Azurite is listening on the specified port."""
@@ -134,6 +136,25 @@ def azurite_env(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setenv("AZURITE_BLOB_STORAGE_URL", "http://127.0.0.1:10000")
 
 
+@pytest.fixture(params=["memory", "local", "azurite"])
+def storage_factory(request: pytest.FixtureRequest, tmp_path: Path):
+    """Return a factory of benchmark storages, once for every backend.
+
+    In memory measures the encoding and CPU cost alone, the local filesystem
+    adds the cost of writing the objects, and Azurite the transport. Azurite is
+    skipped when it is not running.
+    """
+    from tests.helpers import BenchmarkStorage
+
+    if request.param == "azurite" and not _is_azurite_running():
+        pytest.skip("Azurite is not running")
+
+    def factory(container: str, prefix: str) -> BenchmarkStorage:
+        return BenchmarkStorage(request.param, tmp_path, container, prefix)
+
+    return factory
+
+
 @pytest.fixture(scope="session")
 def blob_root(tmp_path_factory: pytest.TempPathFactory) -> Path:
     """Return temporary path used as CLADS backup target."""
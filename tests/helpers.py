@@ -3,16 +3,32 @@ from __future__ import annotations
 
 import os
 import re
+import shutil
 from pathlib import Path
 from typing import Optional
 
+import numpy as np
+import pandas as pd
 import psutil
+import pytest
 
 from azure.storage.blob import BlobServiceClient
-from zarr.storage import ZipStore
 import xarray as xr
 
 
+class FakeClock:
+    """A clock in seconds, moved by the test or by its ``sleep``."""
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
 class AzuriteStorageClient:
     """Lightweight client for the Azurite blob storage emulator used in tests."""
 
@@ -98,21 +114,68 @@ def get_test_data_path() -> Path:
     return Path(__file__).resolve().parent / "data" / "small_data.zarr.zip"
 
 
+def write_synthetic_seed(
+    path: Path,
+    seconds: int = 600,
+    high_res_per_second: int = 4,
+    retro_ids: tuple[int, ...] = (1, 2, 3),
+    setup: bool = False,
+    attrs: dict | None = None,
+) -> Path:
+    """Write a small synthetic seed for the mock data generator to *path*.
+
+    ``ts_var`` holds random values on ``timestamp`` (and ``retro`` if there are
+    *retro_ids*), ``hf_var`` on ``high_res_timestamp`` unless
+    *high_res_per_second* is 0. *setup* adds the setup variable ``setup_var`` and
+    the ``retro_latitude`` coordinate. The *attrs* default to instrument ``inst``
+    of project ``prj``.
+    """
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2020-01-01", periods=seconds, freq="1s")
+    coords: dict = {"timestamp": timestamps}
+    if retro_ids:
+        variables: dict = {"ts_var": (("timestamp", "retro"), rng.random((seconds, len(retro_ids))))}
+        coords["retro"] = list(retro_ids)
+    else:
+        variables = {"ts_var": ("timestamp", rng.random(seconds))}
+    if high_res_per_second:
+        high_res = pd.date_range(
+            "2020-01-01", periods=seconds * high_res_per_second, freq=f"{1000 // high_res_per_second}ms"
+        )
+        variables["hf_var"] = ("high_res_timestamp", rng.random(len(high_res)))
+        coords["high_res_timestamp"] = high_res
+    if setup:
+        variables["setup_var"] = ("retro", np.arange(float(len(retro_ids))))
+        coords["retro_latitude"] = ("retro", rng.random(len(retro_ids)))
+    attrs = {"instrument": "inst", "project": "prj"} if attrs is None else attrs
+    xr.Dataset(variables, coords=coords, attrs=attrs).to_netcdf(path)
+    return path
+
+
+@pytest.fixture
+def synthetic_seed(request: pytest.FixtureRequest, tmp_path: Path) -> Path:
+    """A synthetic seed file, parametrize it indirectly with the arguments of :func:`write_synthetic_seed`."""
+    return write_synthetic_seed(tmp_path / "seed.nc", **getattr(request, "param", {}))
+
+
 def open_test_dataset() -> xr.Dataset:
-    """Open the small test dataset from the zipped zarr file."""
-    path = get_test_data_path()
-    with ZipStore(path, mode="r") as store:
-        ds = xr.open_zarr(store)
-        ds.load()
-    for var in ds.variables:
-        ds[var].encoding.clear()
-    return ds
-
-
-def setup_icechunk_repo(container_name: str, prefix: str):
-    """Create an icechunk repository in a new Azurite container."""
-    import icechunk
+    """Open the small test dataset from the zipped zarr file.
+
+    The dataset is loaded once per session, its arrays are shared and read-only.
+    """
+    from ice_stream.mock_data_generator import _open_seed_dataset
+
+    return _open_seed_dataset(get_test_data_path())
+
 
+AZURITE_STORE_OPTIONS = {
+    "azure_storage_use_emulator": "true",
+    "azure_allow_http": "true",
+}
+
+
+def new_azurite_container(container_name: str) -> None:
+    """Create an empty Azurite container, deleting an earlier one."""
     client = AzuriteStorageClient()
     client.container_name = container_name
     try:
@@ -121,17 +184,67 @@ def setup_icechunk_repo(container_name: str, prefix: str):
         pass
     client.create_container()
 
-    storage = icechunk.azure_storage(
+
+def azurite_icechunk_storage(container_name: str, prefix: str):
+    """The icechunk storage of *prefix* in an Azurite container."""
+    import icechunk
+
+    return icechunk.azure_storage(
         account=os.environ["AZURE_STORAGE_ACCOUNT_NAME"],
-        container=client.container_name,
+        container=container_name,
         prefix=prefix,
         from_env=True,
-        config={
-            "azure_storage_use_emulator": "true",
-            "azure_allow_http": "true",
-        },
+        config=dict(AZURITE_STORE_OPTIONS),
     )
-    return icechunk.Repository.create(storage)
+
+
+def setup_icechunk_repo(container_name: str, prefix: str, **kwargs):
+    """Create an icechunk repository in a new Azurite container, *kwargs* go to ``Repository.create``."""
+    import icechunk
+
+    new_azurite_container(container_name)
+    return icechunk.Repository.create(azurite_icechunk_storage(container_name, prefix), **kwargs)
+
+
+class BenchmarkStorage:
+    """Icechunk storage of a benchmark repository on one backend.
+
+    The backend is ``"memory"``, ``"local"`` (under *root*) or ``"azurite"``. The
+    repository starts empty, a previous run on the same location is removed.
+    """
+
+    def __init__(self, backend: str, root: Path, container: str, prefix: str):
+        import icechunk
+
+        self.backend = backend
+        self.container = container
+        self.prefix = prefix
+        if backend == "memory":
+            self.storage = icechunk.in_memory_storage()
+        elif backend == "local":
+            self.path = root / container / prefix
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.storage = icechunk.local_filesystem_storage(str(self.path))
+        elif backend == "azurite":
+            self.client = AzuriteStorageClient()
+            self.client.container_name = container
+            try:
+                self.client.blob_service_client.delete_container(container)
+            except Exception:
+                pass
+            self.client.create_container()
+            self.storage = azurite_icechunk_storage(container, prefix)
+        else:
+            raise ValueError(f"Unknown storage backend: {backend}")
+
+    def store_bytes(self) -> int | None:
+        """Bytes of all the objects of the repository, ``None`` in memory where they can't be listed."""
+        if self.backend == "local":
+            return sum(f.stat().st_size for f in self.path.rglob("*") if f.is_file())
+        if self.backend == "azurite":
+            container_client = self.client.blob_service_client.get_container_client(self.container)
+            return sum(blob.size for blob in container_client.list_blobs(name_starts_with=self.prefix))
+        return None
 
 
 def total_sent_bytes(interface: Optional[str] = None) -> int:
@@ -7,6 +7,7 @@ import icechunk.xarray as icx
 import pytest
 import zarr
 
+from ice_stream.dedup import Deduplicator
 from ice_stream.mock_data_generator import generate_mock_data
 from ice_stream.blocks import (
     select_minimal_variables,
@@ -18,8 +19,11 @@ from ice_stream.blocks import (
 )
 
 from tests.helpers import (
+    AZURITE_STORE_OPTIONS,
     AzuriteStorageClient,
+    azurite_icechunk_storage,
     get_test_data_path,
+    new_azurite_container,
     open_test_dataset,
     setup_icechunk_repo,
     total_sent_bytes,
@@ -66,6 +70,44 @@ def test_azure_icechunk():
     assert repo is not None
 
 
+def test_azure_deduplicated_upload(tmp_path):
+    """Write a repository deduplicated to a chunk pool on Azurite, and read it back."""
+    new_azurite_container("dedup-pool")
+    dedup = Deduplicator(
+        "az://dedup-pool/chunks",
+        str(tmp_path / "index.sqlite"),
+        pool_options=AZURITE_STORE_OPTIONS,
+        connection_string=os.environ["AZURE_STORAGE_CONNECTION_STRING"],
+    )
+    credentials = icechunk.azure_credentials(access_key=os.environ["AZURE_STORAGE_ACCOUNT_KEY"])
+    repo = setup_icechunk_repo(
+        "dedup-container",
+        "dedup-prefix",
+        config=dedup.repository_config(),
+        authorize_virtual_chunk_access=dedup.authorize(credentials),
+    )
+
+    # a block of values tiled along the time axis, one distinct chunk
+    values = np.tile(np.random.default_rng(0).random(10_000), 10)
+    ds = xr.Dataset({"value": ("timestamp", values)})
+    ds["value"].encoding["chunks"] = (10_000,)
+    upload_single_chunk(repo, ds, dedup=dedup)
+    assert (dedup.chunks, dedup.duplicates) == (10, 9)
+
+    client = AzuriteStorageClient()
+    client.container_name = "dedup-pool"
+    container_client = client.blob_service_client.get_container_client("dedup-pool")
+    assert len(list(container_client.list_blobs(name_starts_with="chunks/"))) == 2  # the chunk and the marker
+
+    # a reader only needs the virtual chunk container, stored with the repository, and the credentials
+    reopened = icechunk.Repository.open(
+        azurite_icechunk_storage("dedup-container", "dedup-prefix"),
+        authorize_virtual_chunk_access=dedup.authorize(credentials),
+    )
+    result = xr.open_zarr(reopened.readonly_session("main").store, consolidated=False).load()
+    xr.testing.assert_equal(result, ds)
+
+
 def test_azure_icechunk_xarray_upload(tmp_path):
     """Upload a NetCDF file to Azurite via icechunk using xarray."""
     repo = setup_icechunk_repo("xarray-container", "xarray-prefix")
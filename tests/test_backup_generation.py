@@ -1,6 +1,10 @@
+import icechunk
 import numpy as np
+import pytest
+import xarray as xr
 from pathlib import Path
 
+from ice_stream.mock_data_generator import generate_ice_chunk_repositories
 from tests.helpers import open_test_dataset
 
 
@@ -30,3 +34,36 @@ def test_generated_repositories_structure(blob_root: Path, generated_repos: list
     assert sorted(generated_repos) == sorted(expected)
     for path in expected:
         assert path.is_dir()
+
+
+# 100 seconds of timestamps only
+small_seed = pytest.mark.parametrize(
+    "synthetic_seed", [{"seconds": 100, "high_res_per_second": 0, "retro_ids": ()}], indirect=True
+)
+
+
+@small_seed
+def test_repositories_are_created_concurrently(tmp_path: Path, synthetic_seed: Path):
+    paths = generate_ice_chunk_repositories(synthetic_seed, count=6, base=tmp_path / "blob", max_workers=3)
+
+    assert [path.name for path in paths] == [
+        f"inst-inst-prj-prj-2020-01-01t00-00-0{i}zl1b" for i in range(6)
+    ]
+    for path in paths:
+        repo = icechunk.Repository.open(icechunk.local_filesystem_storage(str(path)))
+        ds = xr.open_zarr(repo.readonly_session("main").store, consolidated=False)
+        xr.testing.assert_equal(ds["ts_var"], xr.open_dataset(synthetic_seed)["ts_var"])
+
+
+@small_seed
+def test_repositories_use_the_storage_factory(tmp_path: Path, synthetic_seed: Path):
+    requested: list[Path] = []
+
+    def in_memory(path: Path) -> icechunk.Storage:
+        requested.append(path)
+        return icechunk.in_memory_storage()
+
+    paths = generate_ice_chunk_repositories(synthetic_seed, count=3, base=tmp_path / "blob", storage_factory=in_memory)
+
+    assert sorted(requested) == paths
+    assert not (tmp_path / "blob").exists()
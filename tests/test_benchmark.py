@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from ice_stream.benchmark import BenchmarkResults, BenchmarkRun, compare, load_results, main
+from tests.helpers import FakeClock
+
+
+class FakeSession:
+    def commit(self, message: str) -> str:
+        return f"snapshot {message}"
+
+
+def test_run_metrics() -> None:
+    clock = FakeClock()
+    with BenchmarkRun("incremental", raw_bytes=8 * 1024**2, clock=clock) as run:
+        run.stats.record("PUT", 1000, "icechunk")
+        run.stats.record("PUT", 500, "icechunk")
+        run.stats.record("GET", 10, "icechunk")
+        for i in range(4):
+            assert run.commit(FakeSession(), str(i)) == f"snapshot {i}"
+        clock.now += 2
+
+    result = run.result(store_bytes=1200, variables=["a"])
+    assert result["wall_seconds"] == 2
+    assert result["mb_per_s"] == 4
+    assert result["commits_per_s"] == 2
+    assert result["bytes_sent"] == 1500
+    assert result["requests"] == 3
+    assert result["requests_by_operation"]["PUT"] == 2
+    assert result["store_bytes"] == 1200
+    assert result["variables"] == ["a"]
+    assert result["peak_rss_bytes"] > 0
+    json.dumps(result)
+
+
+def test_compare_flags_regressions_by_direction() -> None:
+    baseline = {
+        "incremental": {"wall_seconds": 10.0, "mb_per_s": 5.0, "requests": 100, "store_bytes": 0},
+        "gone": {"wall_seconds": 1.0},
+    }
+    results = {
+        # slower and less throughput beyond 10%, fewer requests is an improvement
+        "incremental": {"wall_seconds": 12.0, "mb_per_s": 4.0, "requests": 50, "store_bytes": 10},
+        "new": {"wall_seconds": 100.0},
+    }
+
+    regressions = compare(results, baseline, threshold=0.1)
+    assert [(r["name"], r["metric"]) for r in regressions] == [
+        ("incremental", "wall_seconds"),
+        ("incremental", "mb_per_s"),
+    ]
+    assert regressions[0]["change"] == pytest.approx(0.2)
+    assert regressions[1]["change"] == pytest.approx(0.2)
+
+    assert compare(results, baseline, threshold=0.25) == []
+    assert [r["metric"] for r in compare(results, baseline, metrics=["mb_per_s"])] == ["mb_per_s"]
+
+
+def test_results_file_keeps_runs(tmp_path: Path) -> None:
+    path = tmp_path / "results.json"
+    results = BenchmarkResults(path, meta={"duration_hours": 24})
+    results.record("single_shot[full]", {"wall_seconds": 1.0})
+    results.record("incremental", {"wall_seconds": 2.0})
+
+    document = load_results(path)
+    assert document["meta"]["duration_hours"] == 24
+    assert set(document["meta"]) >= {"created", "ice_stream", "python", "platform"}
+
+    # a later session replaces the runs it repeats
+    BenchmarkResults(path).record("incremental", {"wall_seconds": 3.0})
+    assert load_results(path)["results"] == {
+        "single_shot[full]": {"wall_seconds": 1.0},
+        "incremental": {"wall_seconds": 3.0},
+    }
+
+    (tmp_path / "other.json").write_text("[]")
+    with pytest.raises(ValueError):
+        load_results(tmp_path / "other.json")
+
+
+def test_compare_command(tmp_path: Path) -> None:
+    BenchmarkResults(tmp_path / "baseline.json").record("incremental", {"wall_seconds": 10.0, "mb_per_s": 5.0})
+    BenchmarkResults(tmp_path / "results.json").record("incremental", {"wall_seconds": 11.5, "mb_per_s": 5.0})
+    args = [str(tmp_path / "results.json"), str(tmp_path / "baseline.json")]
+
+    main([*args, "--threshold", "0.2"])
+    main([*args, "--metric", "mb_per_s"])
+    with pytest.raises(SystemExit) as exc_info:
+        main(args)
+    assert exc_info.value.code == 1
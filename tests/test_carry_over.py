@@ -0,0 +1,85 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ice_stream.carry_over import CarryOverBuffer
+
+
+def _dataset(start: str, n: int, n_high_res: int = 0) -> xr.Dataset:
+    timestamps = pd.date_range(start, periods=n, freq="1s").values
+    high_res = pd.date_range(start, periods=n_high_res, freq="100ms").values
+    return xr.Dataset(
+        {
+            "concentration": ("timestamp", np.arange(n, dtype="float32")),
+            "high_res": ("high_res_timestamp", np.arange(n_high_res, dtype="float32")),
+            "retro_name": ("retro", np.array(["r1", "r2"])),
+        },
+        coords={"timestamp": timestamps, "high_res_timestamp": high_res, "retro": [0, 1]},
+    )
+
+
+def test_split_aligns_to_chunks(tmp_path: Path) -> None:
+    buffer = CarryOverBuffer(str(tmp_path / "carry_over.nc"), {"timestamp": 100})
+    aligned, remainder = buffer.split(_dataset("2024-01-01", 250, 30))
+
+    assert aligned.sizes["timestamp"] == 200
+    assert remainder.sizes["timestamp"] == 50
+    # unaligned dimensions go out with the aligned part
+    assert aligned.sizes["high_res_timestamp"] == 30
+    assert remainder.sizes["high_res_timestamp"] == 0
+
+
+def test_split_buffers_everything_below_a_chunk(tmp_path: Path) -> None:
+    buffer = CarryOverBuffer(str(tmp_path / "carry_over.nc"), {"timestamp": 100})
+    aligned, remainder = buffer.split(_dataset("2024-01-01", 40, 30))
+
+    assert aligned.sizes["timestamp"] == 0
+    assert remainder.sizes["timestamp"] == 40
+    assert remainder.sizes["high_res_timestamp"] == 30
+
+
+def test_save_and_reload_watermarks(tmp_path: Path) -> None:
+    path = str(tmp_path / "carry_over.nc")
+    exported = _dataset("2024-01-01", 250, 30)
+    _, remainder = CarryOverBuffer(path, {"timestamp": 100}).split(exported)
+    CarryOverBuffer(path, {"timestamp": 100}).save(remainder, exported.timestamp.values[199], "day.zarr", exported)
+
+    reloaded = CarryOverBuffer(path, {"timestamp": 100})
+    assert reloaded.watermark("timestamp") == exported.timestamp.values[-1]
+    assert reloaded.watermark("high_res_timestamp") == exported.high_res_timestamp.values[-1]
+    assert reloaded.relative_path == "day.zarr"
+    assert reloaded.dataset().sizes["timestamp"] == 50
+    assert not any(key.startswith("carry_over_") for key in reloaded.dataset().attrs)
+    assert not Path(path + ".tmp").exists()
+
+
+def test_prepend_drops_overlap(tmp_path: Path) -> None:
+    buffer = CarryOverBuffer(str(tmp_path / "carry_over.nc"), {"timestamp": 100})
+    exported = _dataset("2024-01-01", 250)
+    _, remainder = buffer.split(exported)
+    buffer.save(remainder, exported.timestamp.values[199], "day.zarr", exported)
+
+    # the next export overlaps the buffered rows by 10 seconds
+    following = _dataset(str(pd.Timestamp(exported.timestamp.values[-1]) - pd.Timedelta(seconds=9)), 60)
+    combined = buffer.prepend(following)
+
+    assert combined.sizes["timestamp"] == 50 + 50
+    assert np.all(np.diff(combined.timestamp.values) > np.timedelta64(0))
+    assert combined.sizes["retro"] == 2
+
+
+def test_validate_discards_a_stale_buffer(tmp_path: Path) -> None:
+    path = str(tmp_path / "carry_over.nc")
+    buffer = CarryOverBuffer(path, {"timestamp": 100})
+    exported = _dataset("2024-01-01", 250)
+    _, remainder = buffer.split(exported)
+    buffer.save(remainder, exported.timestamp.values[199], "day.zarr", exported)
+
+    assert CarryOverBuffer(path, {"timestamp": 100}).validate(exported.timestamp.values[199])
+
+    stale = CarryOverBuffer(path, {"timestamp": 100})
+    assert not stale.validate(exported.timestamp.values[99])
+    assert stale.dataset() is None
+    assert not Path(path).exists()
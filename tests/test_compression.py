@@ -0,0 +1,94 @@
+import icechunk
+import numpy as np
+import xarray as xr
+
+from ice_stream.blocks import upload_in_intervals, upload_single_chunk
+from ice_stream.compression import AdaptiveCompression
+
+# (cname, clevel) -> (compression bytes/s, ratio)
+MEASURED = {
+    ("lz4", 1): (1000e6, 2.0),
+    ("zstd", 3): (200e6, 3.0),
+    ("zstd", 9): (10e6, 4.0),
+}
+
+
+def _dataset(n: int = 100_000) -> xr.Dataset:
+    rng = np.random.default_rng(0)
+    timestamps = np.datetime64("2024-01-01") + np.arange(n) * np.timedelta64(1, "s")
+    signal = np.sin(np.arange(n) / 50.0) + rng.normal(0, 0.01, n)
+    return xr.Dataset({"value": ("timestamp", signal)}, coords={"timestamp": timestamps})
+
+
+class Measured(AdaptiveCompression):
+    def measure(self, ds: xr.Dataset) -> dict:
+        return MEASURED
+
+
+def test_choice_follows_the_network() -> None:
+    ds = _dataset()
+
+    # unknown network, the default codec
+    default = Measured(candidates=tuple(MEASURED)).choose(ds)
+    assert (default["cname"], default["clevel"]) == ("zstd", 3)
+
+    slow = Measured(candidates=tuple(MEASURED), initial_throughput="256 KB/s").choose(ds)
+    assert (slow["cname"], slow["clevel"]) == ("zstd", 9)
+
+    fast = Measured(candidates=tuple(MEASURED), initial_throughput="10 Gbit/s").choose(ds)
+    assert (fast["cname"], fast["clevel"]) == ("lz4", 1)
+    assert fast["estimated_seconds"] > 0
+
+
+def test_measure_and_observe() -> None:
+    compression = AdaptiveCompression(sample_bytes=64 * 1024, smoothing=0.5)
+    measured = compression.measure(_dataset())
+    assert set(measured) == set(compression.candidates)
+    assert all(speed > 0 and ratio > 1 for speed, ratio in measured.values())
+
+    compression.observe(0, 1_000_000, 1.0)
+    assert compression.throughput == 1_000_000
+    compression.observe(0, 3_000_000, 1.0)
+    assert compression.throughput == 2_000_000
+
+
+def test_short_and_small_writes_are_not_measured() -> None:
+    compression = Measured(candidates=tuple(MEASURED), initial_throughput="1 MB/s")
+    compression.choose(_dataset())
+    throughput = compression.throughput
+
+    # a few KB in a millisecond is latency, not bandwidth
+    compression.observe(0, 4096, 0.001)
+    # mostly compression time, leaving next to no network time
+    compression.observe(1_000_000_000, 1_000_000, 1.0001)
+    compression.observe(0, 1_000_000, 0.01)
+    assert compression.throughput == throughput
+
+
+def test_upload_records_the_choice() -> None:
+    repo = icechunk.Repository.create(icechunk.in_memory_storage())
+    compression = Measured(candidates=tuple(MEASURED), initial_throughput="10 Gbit/s")
+
+    upload_single_chunk(repo, _dataset(), compression=compression)
+
+    snapshot = next(iter(repo.ancestry(branch="main")))
+    assert snapshot.metadata["compression"]["cname"] == "lz4"
+    stored = xr.open_zarr(repo.readonly_session("main").store, consolidated=False)
+    assert stored["value"].encoding["compressors"][0].cname.value == "lz4"
+    # the write updated the throughput estimate
+    assert compression.throughput != 10e9 / 8
+
+
+def test_only_the_choice_of_the_upload_is_recorded() -> None:
+    compression = Measured(candidates=tuple(MEASURED), initial_throughput="10 Gbit/s")
+    upload_single_chunk(icechunk.Repository.create(icechunk.in_memory_storage()), _dataset(), compression=compression)
+
+    # an explicit encoding, no codec is chosen for this repository
+    repo = icechunk.Repository.create(icechunk.in_memory_storage())
+    ds = _dataset(10_000)
+    encoding = {name: {"chunks": (2_500,)} for name in ds.variables}
+    upload_in_intervals(repo, ds, "timestamp", np.timedelta64(2_500, "s"), encoding=encoding, compression=compression)
+
+    snapshots = [snapshot for snapshot in repo.ancestry(branch="main") if snapshot.message != "Repository initialized"]
+    assert len(snapshots) == 4
+    assert all("compression" not in snapshot.metadata for snapshot in snapshots)
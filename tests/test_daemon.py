@@ -0,0 +1,138 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import ice_stream.daemon as daemon_module
+from ice_stream.daemon import StreamingDaemon, main, newest_mtime
+from tests.helpers import FakeClock
+
+
+class FakeScheduler:
+    def __init__(self) -> None:
+        self.projects = {"inst-a": {}}
+        self.runs = 0
+        self.closed: list = []
+
+    def run(self) -> dict:
+        self.runs += 1
+        return {"inst-a": None}
+
+    def close(self, flush: bool = False) -> None:
+        self.closed.append(flush)
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock(1000.0)
+    monkeypatch.setattr(daemon_module, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def _touch(path: Path, mtime: float) -> None:
+    path.touch()
+    os.utime(path, (mtime, mtime))
+
+
+def test_newest_mtime(tmp_path: Path) -> None:
+    _touch(tmp_path / "old.zarr", 1000)
+    os.utime(tmp_path, (500, 500))
+    assert newest_mtime([str(tmp_path), str(tmp_path / "missing")]) == 1000
+    # only the direct children are scanned
+    (tmp_path / "day").mkdir()
+    _touch(tmp_path / "day" / "new.zarr", 2000)
+    os.utime(tmp_path / "day", (1500, 1500))
+    os.utime(tmp_path, (500, 500))
+    assert newest_mtime([str(tmp_path)]) == 1500
+    assert newest_mtime([]) == 0.0
+
+
+def test_wakes_on_new_data_but_not_too_often(tmp_path: Path, clock: FakeClock) -> None:
+    _touch(tmp_path / "a.zarr", 1000)
+    os.utime(tmp_path, (1000, 1000))
+    daemon = StreamingDaemon(FakeScheduler(), interval_seconds=900, watch_paths=[str(tmp_path)],
+                             min_interval_seconds=10)
+    assert daemon.should_wake()
+    daemon.run_cycle()
+
+    # nothing new
+    clock.now += 60
+    assert not daemon.should_wake()
+
+    # new data, within the minimum interval
+    clock.now -= 55
+    _touch(tmp_path / "b.zarr", 2000)
+    os.utime(tmp_path, (1000, 1000))
+    assert not daemon.should_wake()
+    clock.now += 5
+    assert daemon.should_wake()
+    daemon.run_cycle()
+    assert not daemon.should_wake()
+
+    # the scheduled cycle runs without new data
+    clock.now += 900
+    assert daemon.should_wake()
+
+
+def test_wakes_on_the_interval_without_watch_paths(clock: FakeClock) -> None:
+    daemon = StreamingDaemon(FakeScheduler(), interval_seconds=900, min_interval_seconds=10)
+    daemon.run_cycle()
+    clock.now += 899
+    assert not daemon.should_wake()
+    clock.now += 1
+    assert daemon.should_wake()
+
+
+def test_runs_max_cycles(clock: FakeClock) -> None:
+    scheduler = FakeScheduler()
+
+    class Ticking(StreamingDaemon):
+        def run_cycle(self) -> None:
+            super().run_cycle()
+            clock.now += 900
+
+    daemon = Ticking(scheduler, interval_seconds=900, poll_seconds=0)
+    daemon.run_forever(max_cycles=3)
+    assert scheduler.runs == daemon.cycles == 3
+    assert scheduler.closed == [True]
+
+
+def test_stop_flushes_the_buffers() -> None:
+    scheduler = FakeScheduler()
+    StreamingDaemon(scheduler, poll_seconds=0, min_interval_seconds=0).run_forever(max_cycles=1)
+    assert scheduler.closed == [True]
+
+    scheduler = FakeScheduler()
+    StreamingDaemon(scheduler, poll_seconds=0, min_interval_seconds=0, flush_on_stop=False).run_forever(max_cycles=1)
+    assert scheduler.closed == [False]
+
+
+def test_main(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    schedulers, daemons = [], []
+
+    def scheduler(projects: list, max_workers: int, bandwidth_limit: str) -> FakeScheduler:
+        schedulers.append((projects, max_workers, bandwidth_limit))
+        return FakeScheduler()
+
+    monkeypatch.setattr(daemon_module, "StreamingScheduler", scheduler)
+    monkeypatch.setattr(StreamingDaemon, "run_forever", lambda self: daemons.append(self))
+    monkeypatch.setattr(daemon_module.signal, "signal", lambda *args: None)
+
+    main(["--settings", "a.yaml", "--local-root", "~/a", "--target-root", "az://backups", "--workers", "2",
+          "--watch", str(tmp_path), "--interval", "60", "--keep-buffers"])
+    assert schedulers[-1] == (
+        [{"settings": "a.yaml", "local_root_path": "~/a", "target_root": "az://backups"}], 2, None)
+    assert daemons[-1].interval_seconds == 60
+    assert daemons[-1].watch_paths == [str(tmp_path)]
+    assert not daemons[-1].flush_on_stop
+
+    projects = tmp_path / "projects.yaml"
+    projects.write_text("- {name: inst-a, settings: a.yaml, local_root_path: ~/a, target_root: az://backups}\n")
+    main(["--projects", str(projects), "--bandwidth-limit", "1 Mbit/s"])
+    assert schedulers[-1][0][0]["name"] == "inst-a"
+    assert schedulers[-1][2] == "1 Mbit/s"
+    assert daemons[-1].flush_on_stop
+
+    with pytest.raises(SystemExit):
+        main(["--settings", "a.yaml"])
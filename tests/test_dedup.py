@@ -0,0 +1,149 @@
+import asyncio
+import json
+import shutil
+import threading
+from pathlib import Path
+
+import icechunk
+import numpy as np
+import pytest
+import xarray as xr
+from zarr.core.buffer import default_buffer_prototype
+
+from ice_stream.blocks import upload_single_chunk
+from ice_stream.dedup import ChunkIndex, Deduplicator
+from ice_stream.transfer import TransferStats
+
+
+def _tiled(repeats: int = 10, block: int = 10_000) -> xr.Dataset:
+    # like the mock data, a block of values tiled along the time axis
+    values = np.tile(np.random.default_rng(0).random(block), repeats)
+    ds = xr.Dataset({"value": ("timestamp", values)})
+    ds["value"].encoding["chunks"] = (block,)
+    return ds
+
+
+def _repository(path: Path, dedup: Deduplicator) -> icechunk.Repository:
+    storage = icechunk.local_filesystem_storage(str(path))
+    return icechunk.Repository.create(
+        storage, config=dedup.repository_config(), authorize_virtual_chunk_access=dedup.authorize()
+    )
+
+
+def _read(path: Path, dedup: Deduplicator) -> xr.Dataset:
+    repo = icechunk.Repository.open(
+        icechunk.local_filesystem_storage(str(path)), authorize_virtual_chunk_access=dedup.authorize()
+    )
+    return xr.open_zarr(repo.readonly_session("main").store, consolidated=False).load()
+
+
+def test_identical_chunks_are_uploaded_once(tmp_path: Path) -> None:
+    stats = TransferStats()
+    dedup = Deduplicator(f"file://{tmp_path / 'pool'}", str(tmp_path / "index.sqlite"), stats=stats)
+    ds = _tiled()
+
+    upload_single_chunk(_repository(tmp_path / "a", dedup), ds, dedup=dedup)
+
+    assert (dedup.chunks, dedup.duplicates) == (10, 9)
+    # the chunk and the pool marker
+    assert stats.requests("PUT", dedup.pool_url) == 2
+    assert stats.bytes("PUT", dedup.pool_url) < ds.nbytes / 5
+    xr.testing.assert_equal(_read(tmp_path / "a", dedup), ds)
+
+
+def test_index_persists_between_processes(tmp_path: Path) -> None:
+    index_path = str(tmp_path / "index.sqlite")
+    first = Deduplicator(f"file://{tmp_path / 'pool'}", index_path)
+    upload_single_chunk(_repository(tmp_path / "a", first), _tiled(), dedup=first)
+    first.index.close()
+
+    stats = TransferStats()
+    second = Deduplicator(f"file://{tmp_path / 'pool'}", index_path, stats=stats)
+    assert len(second.index) == 1
+    upload_single_chunk(_repository(tmp_path / "b", second), _tiled(), dedup=second)
+
+    # known from the index, the pool marker is the only request, nothing is uploaded
+    assert second.duplicates == second.chunks == 10
+    assert stats.requests(target=second.pool_url) == stats.requests("GET", second.pool_url) == 1
+    xr.testing.assert_equal(_read(tmp_path / "b", second), _tiled())
+
+
+def test_index_of_a_replaced_pool_is_cleared(tmp_path: Path) -> None:
+    index_path = str(tmp_path / "index.sqlite")
+    first = Deduplicator(f"file://{tmp_path / 'pool'}", index_path)
+    upload_single_chunk(_repository(tmp_path / "a", first), _tiled(), dedup=first)
+    first.index.close()
+    shutil.rmtree(tmp_path / "pool")
+
+    stats = TransferStats()
+    second = Deduplicator(f"file://{tmp_path / 'pool'}", index_path, stats=stats)
+    upload_single_chunk(_repository(tmp_path / "b", second), _tiled(), dedup=second)
+
+    # the new marker and the chunk
+    assert stats.requests("PUT", second.pool_url) == 2
+    assert (second.chunks, second.duplicates) == (10, 9)
+    assert second.index.pool_id == json.loads((tmp_path / "pool" / "pool.json").read_text())["id"]
+    xr.testing.assert_equal(_read(tmp_path / "b", second), _tiled())
+
+
+def test_uploads_are_shared_between_event_loops(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    dedup = Deduplicator(f"file://{tmp_path / 'pool'}", str(tmp_path / "index.sqlite"), min_bytes=0)
+    value = default_buffer_prototype().buffer.from_bytes(b"chunk" * 1000)
+    uploading, release = threading.Event(), threading.Event()
+    set_ = dedup.pool.set
+
+    async def slow_set(key: str, value: object) -> None:
+        uploading.set()
+        await asyncio.to_thread(release.wait)
+        await set_(key, value)
+
+    monkeypatch.setattr(dedup.pool, "set", slow_set)
+    locations = []
+    threads = [
+        threading.Thread(target=lambda: locations.append(asyncio.run(dedup.put(value))), daemon=True) for _ in range(2)
+    ]
+    threads[0].start()
+    assert uploading.wait(5)
+    # the second loop waits for the upload of the first one
+    threads[1].start()
+    threads[1].join(0.2)
+    assert threads[1].is_alive()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(locations) == 2 and locations[0] == locations[1]
+    assert (dedup.chunks, dedup.duplicates) == (2, 1)
+    digest = locations[0].rsplit("/", 1)[1]
+    assert sorted(path.name for path in (tmp_path / "pool").iterdir()) == sorted([digest, "pool.json"])
+
+
+def test_chunk_index(tmp_path: Path) -> None:
+    index = ChunkIndex(str(tmp_path / "sub" / "index.sqlite"))
+    assert "abc" not in index
+    index.add("abc", 10)
+    index.add("abc", 10)
+    assert "abc" in index
+    assert len(index) == 1
+
+    assert index.pool_id is None
+    index.reset("pool-a")
+    assert index.pool_id == "pool-a"
+    assert len(index) == 0
+
+
+def test_pool_schemes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    with pytest.raises(ValueError, match="Unsupported chunk pool url"):
+        Deduplicator("s3://bucket/pool", str(tmp_path / "index.sqlite"))
+
+    for name in ("AZURE_STORAGE_CONNECTION_STRING", "AZURE_STORAGE_ACCOUNT_NAME"):
+        monkeypatch.delenv(name, raising=False)
+    with pytest.raises(ValueError, match="Azure account"):
+        Deduplicator("az://container/pool", str(tmp_path / "index.sqlite")).repository_config()
+
+    dedup = Deduplicator(
+        "az://container/pool", str(tmp_path / "index.sqlite"), connection_string="AccountName=account;AccountKey=a2V5"
+    )
+    assert dedup._azure_account() == "account"
+    containers = dedup.repository_config().virtual_chunk_containers
+    assert list(containers) == ["az://container/pool/"]
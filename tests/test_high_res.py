@@ -0,0 +1,121 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ice_stream.high_res import HighResAppender, high_res_url
+from ice_stream.icestream import StreamingState
+from ice_stream.transfer import TransferStats
+
+OPTIONS = {"auto_mkdir": True}
+
+
+def _dataset(start: str, n_high_res: int) -> xr.Dataset:
+    high_res = pd.date_range(start, periods=n_high_res, freq="100ms").values
+    return xr.Dataset(
+        {
+            "concentration": ("timestamp", np.arange(3, dtype="float32")),
+            "high_res": ("high_res_timestamp", np.arange(n_high_res, dtype="float32")),
+        },
+        coords={"timestamp": pd.date_range(start, periods=3, freq="1s").values, "high_res_timestamp": high_res},
+    )
+
+
+def test_new_target_then_append(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/day.zarr"
+    appender = HighResAppender(OPTIONS)
+    appender.on_new_target(target)
+
+    first = _dataset("2024-01-01", 1000)
+    assert appender.append(target, first) == 1000
+    # a retried transaction re-sends rows that are already in the store
+    second = _dataset(str(pd.Timestamp(first.high_res_timestamp.values[500])), 1500)
+    assert appender.append(target, second) == 1000
+
+    stored = xr.open_zarr(high_res_url(target))
+    assert stored.sizes["high_res_timestamp"] == 2000
+    assert "timestamp" not in stored.dims
+    assert np.all(np.diff(stored.high_res_timestamp.values) > np.timedelta64(0))
+
+
+def test_cold_cache_reads_the_store_end(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/day.zarr"
+    first = _dataset("2024-01-01", 1000)
+    HighResAppender(OPTIONS).append(target, first)
+
+    # a new process, appending to a target created by an earlier run
+    later = _dataset(str(pd.Timestamp(first.high_res_timestamp.values[-1])), 1001)
+    assert HighResAppender(OPTIONS).append(target, later) == 1000
+    assert xr.open_zarr(high_res_url(target)).sizes["high_res_timestamp"] == 2000
+
+
+def test_nothing_to_write(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/day.zarr"
+    appender = HighResAppender(OPTIONS)
+    appender.on_new_target(target)
+
+    assert appender.append(target, _dataset("2024-01-01", 0)) == 0
+    assert not Path(tmp_path / "day_high_res.zarr").exists()
+
+
+def test_counts_requests(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/day.zarr"
+    stats = TransferStats()
+    appender = HighResAppender(OPTIONS, stats)
+    appender.on_new_target(target)
+
+    appender.append(target, _dataset("2024-01-01", 1000))
+    assert stats.requests("PUT", high_res_url(target)) > 0
+    assert stats.bytes("PUT") > 0
+
+
+def test_new_stores_are_chunked_like_the_carry_over(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/day.zarr"
+    appender = HighResAppender(OPTIONS, chunk_size=1000)
+    appender.on_new_target(target)
+
+    # the first write is longer than a chunk, it mustn't set the chunk size
+    first = _dataset("2024-01-01", 3000)
+    appender.append(target, first)
+    assert xr.open_zarr(high_res_url(target)).high_res.encoding["chunks"] == (1000,)
+
+    appender.append(target, _dataset(str(pd.Timestamp(first.high_res_timestamp.values[-1])), 1001))
+    stored = xr.open_zarr(high_res_url(target))
+    assert stored.sizes["high_res_timestamp"] == 4000
+    assert stored.high_res.encoding["chunks"] == (1000,)
+
+
+def test_empty_store_is_appended_to(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/day.zarr"
+    empty = _dataset("2024-01-01", 0).drop_dims("timestamp")
+    empty.to_zarr(tmp_path / "day_high_res.zarr", mode="w",
+                  encoding={"high_res_timestamp": {"units": "milliseconds since 1970-01-01", "dtype": "int64"}})
+    (tmp_path / "day_high_res.zarr" / "marker").write_text("kept")
+
+    appender = HighResAppender(OPTIONS)
+    assert appender.append(target, _dataset("2024-01-01", 1000)) == 1000
+    # appended, not overwritten
+    assert (tmp_path / "day_high_res.zarr" / "marker").exists()
+    assert xr.open_zarr(high_res_url(target)).sizes["high_res_timestamp"] == 1000
+
+
+def test_deleted_target_is_forgotten(tmp_path: Path) -> None:
+    target = f"file://{tmp_path}/target/day.zarr"
+    (tmp_path / "target" / "day.zarr").mkdir(parents=True)
+    appender = HighResAppender(OPTIONS)
+    state = StreamingState(str(tmp_path / "streaming_state.yaml"), f"file://{tmp_path}/target",
+                           on_discard=appender.forget)
+    state.on_new_transaction(target)
+    appender.on_new_target(target)
+    first = _dataset("2024-01-01", 1000)
+    appender.append(target, first)
+
+    # the transaction failed, the next run deletes the target
+    state.initialize_and_validate_paths()
+    assert not (tmp_path / "target" / "day_high_res.zarr").exists()
+
+    # the rows are written again, to a new store
+    assert appender.append(target, first) == 1000
+    assert xr.open_zarr(high_res_url(target)).sizes["high_res_timestamp"] == 1000
+    state.close()
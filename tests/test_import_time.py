@@ -0,0 +1,77 @@
+"""Import-time budget for the ice_stream entry points.
+
+Each entry point is imported in a fresh interpreter, so the measurement
+includes everything a cron run pays for before doing any work. Budgets can be
+scaled for slow machines with ``ICE_STREAM_IMPORT_BUDGET_SCALE``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BUDGET_SCALE = float(os.environ.get("ICE_STREAM_IMPORT_BUDGET_SCALE", 1.0))
+REPEATS = 3
+
+# module -> (budget in ms, heavy modules that must not be imported)
+ENTRY_POINTS = {
+    "ice_stream.icestream": (
+        500,
+        ["xarray", "pandas", "fsspec", "tenacity", "clads", "zappend", "zarr", "icechunk"],
+    ),
+    "ice_stream.daemon": (
+        500,
+        ["xarray", "pandas", "fsspec", "tenacity", "clads", "zappend", "zarr", "icechunk"],
+    ),
+    "ice_stream.blocks": (300, ["xarray", "zarr", "icechunk"]),
+    "ice_stream.mock_data_generator": (1500, ["zarr", "icechunk"]),
+}
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _measure(module: str) -> tuple[float, set[str]]:
+    """Return the fastest of ``REPEATS`` cold imports and the loaded modules."""
+    best = float("inf")
+    loaded: set[str] = set()
+    for _ in range(REPEATS):
+        out = subprocess.run(
+            [sys.executable, "-c", _SCRIPT.format(module=module)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        best = min(best, result["ms"])
+        loaded = set(result["modules"])
+    return best, loaded
+
+
+@pytest.mark.parametrize("module", list(ENTRY_POINTS))
+def test_import_time_budget(module: str, artifacts) -> None:
+    budget_ms, heavy = ENTRY_POINTS[module]
+    elapsed_ms, loaded = _measure(module)
+
+    eager = sorted(name for name in heavy if name in loaded)
+    artifacts.save_text(
+        "import_time.json",
+        json.dumps(
+            {"module": module, "ms": round(elapsed_ms, 1), "budget_ms": budget_ms * BUDGET_SCALE, "eager": eager},
+            indent=2,
+        ),
+    )
+
+    assert not eager, f"{module} eagerly imports {', '.join(eager)}"
+    assert elapsed_ms <= budget_ms * BUDGET_SCALE, (
+        f"Importing {module} took {elapsed_ms:.0f} ms, budget is {budget_ms * BUDGET_SCALE:.0f} ms"
+    )
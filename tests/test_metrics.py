@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+
+from ice_stream.metrics import MetricsWriter, StageTimer, timed_stage
+from tests.helpers import FakeClock
+
+
+def test_nested_stages_report_exclusive_time() -> None:
+    clock = FakeClock()
+    timer = StageTimer(clock)
+
+    with timer.stage("write"):
+        clock.now += 2
+        with timer.stage("conform"):
+            clock.now += 1
+        clock.now += 3
+    with timer.stage("conform"):
+        clock.now += 0.5
+
+    assert timer.results() == {
+        "conform": {"seconds": 1.5, "count": 2},
+        "write": {"seconds": 5.0, "count": 1},
+    }
+    assert timer.wall_seconds == 6.5
+
+    timer.reset()
+    assert timer.results() == {}
+
+
+def test_timed_stage_decorator() -> None:
+    clock = FakeClock()
+
+    class Stream:
+        timer = StageTimer(clock)
+
+        @timed_stage("setup")
+        def maintain(self, seconds: float) -> str:
+            clock.now += seconds
+            return "done"
+
+    stream = Stream()
+    assert stream.maintain(2.0) == "done"
+    assert Stream.timer.results()["setup"] == {"seconds": 2.0, "count": 1}
+
+
+def _run(seconds: float) -> dict:
+    return {
+        "started": 1700000000.0,
+        "wall_seconds": seconds,
+        "succeeded": True,
+        "stages": {"export": {"seconds": seconds / 2, "count": 1}},
+        "transfer": {"PUT": {"requests": 3, "bytes": 1024}},
+        "retries": {"PUT": 2},
+    }
+
+
+def test_writer_accumulates_histograms_across_runs(tmp_path: Path) -> None:
+    def writer() -> MetricsWriter:
+        return MetricsWriter(
+            json_path=str(tmp_path / "streaming_metrics.json"),
+            textfile_path=str(tmp_path / "textfile" / "ice_stream.prom"),
+            state_path=str(tmp_path / "histograms.json"),
+            project="inst-a",
+            buckets=(1.0, 10.0),
+        )
+
+    writer().write(_run(4.0))
+    writer().write(_run(40.0))
+
+    last = json.loads((tmp_path / "streaming_metrics.json").read_text())
+    assert last["project"] == "inst-a"
+    assert last["wall_seconds"] == 40.0
+
+    prom = (tmp_path / "textfile" / "ice_stream.prom").read_text().splitlines()
+    assert 'ice_stream_run_seconds_bucket{project="inst-a",le="1.0"} 0' in prom
+    assert 'ice_stream_run_seconds_bucket{project="inst-a",le="10.0"} 1' in prom
+    assert 'ice_stream_run_seconds_bucket{project="inst-a",le="+Inf"} 2' in prom
+    assert 'ice_stream_run_seconds_count{project="inst-a"} 2' in prom
+    assert 'ice_stream_run_seconds_sum{project="inst-a"} 44.0' in prom
+    assert 'ice_stream_stage_seconds_count{project="inst-a",stage="export"} 2' in prom
+    assert 'ice_stream_last_run_stage_seconds{project="inst-a",stage="export"} 20.0' in prom
+    assert 'ice_stream_last_run_transfer_bytes{project="inst-a",operation="PUT"} 1024' in prom
+    assert 'ice_stream_last_run_transfer_retries{project="inst-a",operation="PUT"} 2' in prom
+    assert 'ice_stream_last_run_success{project="inst-a"} 1' in prom
+    assert not list(tmp_path.rglob("*.tmp"))
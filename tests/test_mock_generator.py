@@ -5,9 +5,9 @@ from pathlib import Path
 import tempfile
 import os
 import pandas as pd
-from tests.helpers import open_test_dataset
+from tests.helpers import open_test_dataset, write_synthetic_seed
 
-from ice_stream.mock_data_generator import generate_mock_data
+from ice_stream.mock_data_generator import SignalSynthesis, generate_mock_data, iter_mock_blocks
 
 
 class TestMockDataGenerator:
@@ -30,18 +30,7 @@ class TestMockDataGenerator:
     @pytest.fixture
     def high_freq_seed_file(self, tmp_path):
         """Create a temporary high frequency dataset"""
-        timestamps = pd.date_range("2020-01-01", periods=2, freq="1S")
-        high_res = pd.date_range("2020-01-01", periods=4, freq="250ms")
-        ds = xr.Dataset(
-            {
-                "ts_var": ("timestamp", np.arange(len(timestamps))),
-                "hf_var": ("high_res_timestamp", np.arange(len(high_res))),
-            },
-            coords={"timestamp": timestamps, "high_res_timestamp": high_res},
-        )
-        path = tmp_path / "high_freq.nc"
-        ds.to_netcdf(path)
-        return path
+        return write_synthetic_seed(tmp_path / "high_freq.nc", seconds=2, retro_ids=())
     
     def test_generate_by_file_size(self, seed_file, temp_output_file):
         """Test generating mock data by target file size"""
@@ -188,6 +177,178 @@ class TestMockDataGenerator:
         ratio_mock = len(ds_mock['high_res_timestamp']) / len(ds_mock['timestamp'])
         assert ratio_mock == ratio_seed
     
+    @pytest.fixture
+    def long_seed_file(self, tmp_path):
+        """A seed with enough samples to measure memory use"""
+        return write_synthetic_seed(tmp_path / "long.nc", seconds=1000, setup=True)
+
+    @pytest.mark.parametrize("suffix", [".nc", ".zarr", ".zip", ".icechunk"])
+    def test_block_mode_matches_in_memory(self, long_seed_file, tmp_path, suffix):
+        """Writing in blocks gives the same data as generating all at once"""
+        kwargs = dict(target_duration_hours=2, additional_retro_ids=[7])
+        ds_mock = generate_mock_data(long_seed_file, tmp_path / "all.nc", **kwargs)
+        ds_blocks = generate_mock_data(
+            long_seed_file, tmp_path / f"blocks{suffix}", block_repetitions=3, **kwargs
+        )
+
+        xr.testing.assert_equal(ds_blocks.load(), ds_mock)
+        assert ds_blocks.attrs["mock_multiplication_factor"] == ds_mock.attrs["mock_multiplication_factor"]
+
+    @pytest.mark.parametrize("output_format", ["zarr", "zip", "icechunk"])
+    def test_zarr_output_formats(self, long_seed_file, tmp_path, output_format):
+        """The Zarr based outputs hold the generated data, blosc compressed"""
+        import icechunk
+        import zarr
+
+        path = tmp_path / "mock.out"
+        ds_mock = generate_mock_data(
+            long_seed_file, path, target_duration_hours=2, output_format=output_format
+        )
+
+        if output_format == "zarr":
+            store = str(path)
+        elif output_format == "zip":
+            store = zarr.storage.ZipStore(path, mode="r")
+        else:
+            repo = icechunk.Repository.open(icechunk.local_filesystem_storage(str(path)))
+            store = repo.readonly_session("main").store
+        written = xr.open_zarr(store, consolidated=False)
+        xr.testing.assert_equal(written.load(), ds_mock)
+        for name in ("ts_var", "hf_var", "timestamp"):
+            assert type(written[name].encoding["compressors"][0]).__name__ == "BloscCodec"
+
+    def test_invalid_output_format(self, long_seed_file, tmp_path):
+        with pytest.raises(ValueError, match="output_format"):
+            generate_mock_data(long_seed_file, tmp_path / "mock.h5", target_duration_hours=2, output_format="hdf5")
+
+    def test_seed_is_loaded_once(self, long_seed_file):
+        """The seed is cached by path and modification time, read-only"""
+        from ice_stream.mock_data_generator import _open_seed_dataset, _prepare_seed
+
+        first = _open_seed_dataset(long_seed_file)
+        second = _open_seed_dataset(long_seed_file)
+        assert first is not second
+        assert np.shares_memory(first["hf_var"].values, second["hf_var"].values)
+        assert not first["hf_var"].values.flags.writeable
+        assert not first["hf_var"].encoding
+        prepared = [_prepare_seed(long_seed_file)["hf_var"].values for _ in range(2)]
+        assert np.shares_memory(*prepared)
+
+        ds = first.load()
+        ds["setup_var"] = ds["setup_var"] * 2
+        ds.to_netcdf(long_seed_file)
+        reloaded = _open_seed_dataset(long_seed_file)
+        np.testing.assert_array_equal(reloaded["setup_var"].values, np.arange(3.0) * 2)
+
+    def test_mock_cache(self, long_seed_file, tmp_path, monkeypatch):
+        """Generated outputs are reused from the cache for the same parameters"""
+        import ice_stream.mock_data_generator as generator
+
+        kwargs = dict(target_duration_hours=3, synthesis=SignalSynthesis(seed=4), cache_dir=tmp_path / "cache")
+        ds_mock = generate_mock_data(long_seed_file, tmp_path / "first.zarr", **kwargs)
+        assert len(list((tmp_path / "cache").iterdir())) == 1
+
+        def not_generated(*args, **kwargs):
+            raise AssertionError("generated again")
+
+        monkeypatch.setattr(generator, "_mock_block", not_generated)
+        ds_cached = generate_mock_data(long_seed_file, tmp_path / "second.zarr", **kwargs)
+        xr.testing.assert_equal(ds_cached, ds_mock)
+        xr.testing.assert_equal(xr.open_zarr(tmp_path / "second.zarr", consolidated=False).load(), ds_mock)
+
+        # other parameters are another entry
+        with pytest.raises(AssertionError, match="generated again"):
+            generate_mock_data(long_seed_file, tmp_path / "third.zarr", **{**kwargs, "target_duration_hours": 4})
+
+    def test_blocks_bound_memory(self, long_seed_file):
+        """Peak memory follows the block size, not the target size"""
+        import tracemalloc
+
+        list(iter_mock_blocks(long_seed_file, target_duration_hours=1))  # warm up the imports
+        tracemalloc.start()
+        total = 0
+        for block in iter_mock_blocks(long_seed_file, target_duration_hours=20, block_repetitions=2):
+            total += block.nbytes
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert peak < total / 4
+
+    def test_high_res_repair_matches_loop(self):
+        """The vectorized repair moves duplicates like the sequential loop"""
+        from ice_stream.mock_data_generator import _strictly_increasing
+
+        rng = np.random.default_rng(0)
+        values = np.sort(rng.integers(0, 50, 500)).astype("datetime64[ns]")
+        expected = values.copy()
+        for i in range(1, len(expected)):
+            if expected[i] <= expected[i - 1]:
+                expected[i] = expected[i - 1] + np.timedelta64(1, "ns")
+
+        np.testing.assert_array_equal(_strictly_increasing(values), expected)
+
+    def test_generation_rate(self, long_seed_file, artifacts):
+        """Benchmark of the samples generated per second"""
+        import time
+
+        start = time.perf_counter()
+        samples = 0
+        for block in iter_mock_blocks(long_seed_file, target_duration_hours=24, block_repetitions=16):
+            samples += block.sizes["timestamp"] + block.sizes["high_res_timestamp"]
+        elapsed = time.perf_counter() - start
+
+        rate = samples / elapsed
+        artifacts.save_text(
+            "generation_rate.txt",
+            f"samples: {samples}\nseconds: {elapsed:.3f}\nsamples_per_second: {rate:.0f}\n",
+        )
+        assert samples == 87 * 5000
+
+    def test_synthesis_is_reproducible(self, long_seed_file, tmp_path):
+        """The same seed gives the same data, whatever the block size"""
+        synthesis = SignalSynthesis(seed=1, gap_rate=1e-3, new_retros=1)
+        kwargs = dict(target_duration_hours=3, synthesis=synthesis)
+        ds_mock = generate_mock_data(long_seed_file, tmp_path / "all.nc", **kwargs)
+        ds_blocks = generate_mock_data(long_seed_file, tmp_path / "blocks.nc", block_repetitions=2, **kwargs)
+        ds_other = generate_mock_data(
+            long_seed_file, tmp_path / "other.nc", target_duration_hours=3, synthesis=SignalSynthesis(seed=2)
+        )
+
+        xr.testing.assert_equal(ds_blocks.load(), ds_mock)
+        assert not np.array_equal(ds_other["hf_var"].values[:4000], ds_mock["hf_var"].values[:4000])
+
+    def test_synthesis_varies_repetitions(self, long_seed_file, tmp_path):
+        """Repetitions are no longer copies of the seed"""
+        ds_mock = generate_mock_data(
+            long_seed_file, tmp_path / "mock.nc", target_duration_hours=2, synthesis=SignalSynthesis(gap_rate=0)
+        )
+        hf = ds_mock["hf_var"].values
+
+        assert not np.allclose(hf[:4000], hf[4000:8000])
+        # the seed statistics are kept
+        assert abs(hf.mean() - 0.5) < 0.1
+        np.testing.assert_array_equal(ds_mock["setup_var"].values, np.arange(3.0))
+
+    def test_synthesis_gaps_and_new_retros(self, long_seed_file, tmp_path):
+        """Gaps drop samples of both time dimensions, new retros are NaN before they appear"""
+        ds_plain = generate_mock_data(long_seed_file, tmp_path / "plain.nc", target_duration_hours=10)
+        ds_mock = generate_mock_data(
+            long_seed_file,
+            tmp_path / "mock.nc",
+            target_duration_hours=10,
+            synthesis=SignalSynthesis(gap_rate=1e-3, gap_length=10, new_retros=2),
+        )
+
+        assert ds_mock.sizes["timestamp"] < ds_plain.sizes["timestamp"]
+        dropped = ds_plain.sizes["timestamp"] - ds_mock.sizes["timestamp"]
+        assert ds_plain.sizes["high_res_timestamp"] - ds_mock.sizes["high_res_timestamp"] == 4 * dropped
+        assert list(ds_mock["retro"].values) == [1, 2, 3, 4, 5]
+
+        new = ds_mock["ts_var"].sel(retro=[4, 5]).values
+        assert np.isnan(new[0]).all()
+        assert not np.isnan(new[-1]).any()
+        assert not np.isnan(ds_mock["ts_var"].sel(retro=[1, 2, 3]).values).any()
+
     def test_large_file_generation(self, seed_file, temp_output_file):
         """Test generating a large file (700MB as mentioned in requirements)"""
         # This test might take a while, so it's marked for optional execution
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from ice_stream.pipeline import prefetch
+
+
+def _slow_range(n: int, delay: float):
+    for i in range(n):
+        time.sleep(delay)
+        yield i
+
+
+def test_prefetch_preserves_order() -> None:
+    assert list(prefetch(range(10), maxsize=3)) == list(range(10))
+
+
+def test_prefetch_overlaps_producer_and_consumer() -> None:
+    start = time.perf_counter()
+    for _ in prefetch(_slow_range(5, 0.05), maxsize=2):
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    # serial execution would take 0.5 s
+    assert elapsed < 0.45
+
+
+def test_prefetch_propagates_producer_errors() -> None:
+    def failing():
+        yield 1
+        raise RuntimeError("export failed")
+
+    it = prefetch(failing())
+    assert next(it) == 1
+    with pytest.raises(RuntimeError, match="export failed"):
+        next(it)
+
+
+def test_prefetch_discards_unconsumed_items() -> None:
+    discarded: list[int] = []
+    it = prefetch(range(10), maxsize=2, on_discard=discarded.append)
+    assert next(it) == 0
+    it.close()
+    # nothing is produced past the bounded queue, and every produced item is released
+    assert discarded and sorted(discarded) == list(range(1, 1 + len(discarded)))
+    assert len(discarded) <= 3
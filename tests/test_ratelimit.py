@@ -0,0 +1,135 @@
+import asyncio
+import datetime as dt
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+import zarr
+
+from ice_stream.ratelimit import (
+    BandwidthSchedule,
+    FairShareBandwidth,
+    HostTokenBucket,
+    RateLimiter,
+    TokenBucket,
+    limiter_from_settings,
+    parse_rate,
+)
+from ice_stream.transfer import TransferStats, counting_store
+from tests.helpers import FakeClock
+
+
+def test_parse_rate() -> None:
+    assert parse_rate(None) is None
+    assert parse_rate(0) is None
+    assert parse_rate(2048) == 2048
+    assert parse_rate("512 KB/s") == 512 * 1024
+    assert parse_rate("2 Mbit/s") == 250_000
+    assert parse_rate("100") == 100
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_schedule_windows_wrap_around_midnight() -> None:
+    schedule = BandwidthSchedule(
+        "1 MB/s",
+        [
+            {"start": "08:00", "end": "18:00", "limit": "128 KB/s"},
+            {"start": "22:00", "end": "02:00", "limit": None},
+        ],
+    )
+    day = dt.datetime(2024, 1, 1)
+    assert schedule.rate_at(day.replace(hour=9)) == 128 * 1024
+    assert schedule.rate_at(day.replace(hour=20)) == 1024**2
+    assert schedule.rate_at(day.replace(hour=23)) is None
+    assert schedule.rate_at(day.replace(hour=1, minute=59)) is None
+    assert schedule.rate_at(day.replace(hour=2)) == 1024**2
+
+
+def test_token_bucket_waits_off_its_debt() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(1000, burst_seconds=1.0, clock=clock)
+
+    # a full bucket lets a burst through
+    assert bucket.reserve(1000) == 0.0
+    # the next writer pays for it
+    assert bucket.reserve(500) == pytest.approx(0.5)
+    clock.now += 1.5
+    assert bucket.reserve(1000) == pytest.approx(0.0)
+    assert TokenBucket(None).reserve(10**9) == 0.0
+
+
+def test_host_bucket_is_shared_through_its_file(tmp_path: Path) -> None:
+    path = str(tmp_path / "bandwidth.json")
+    first = HostTokenBucket(1000, path)
+    second = HostTokenBucket(1000, path)
+
+    assert first.reserve(1000) == 0.0
+    # the second process sees the tokens the first one took
+    assert second.reserve(1000) == pytest.approx(1.0, abs=0.1)
+
+
+def test_fair_share_splits_the_budget_between_active_members() -> None:
+    clock = FakeClock()
+    budget = FairShareBandwidth(1000, clock=clock)
+    first, second = budget.bucket("a"), budget.bucket("b")
+    assert budget.bucket("a") is first
+
+    # alone, a member gets the whole budget
+    with budget.active("a"):
+        assert first.reserve(1000) == 0.0
+        assert first.reserve(1000) == pytest.approx(1.0)
+        clock.now += 1.0
+        with budget.active("b"):
+            # two members refill at half the rate each, together within the budget
+            assert budget.share_at("a") == budget.share_at("b") == 500
+            assert second.reserve(500) == 0.0
+            # the rest of the debt of the first member is paid off at half the rate
+            assert first.reserve(500) == pytest.approx(2.0)
+            assert second.reserve(500) == pytest.approx(1.0)
+    assert budget.share_at("b") == 1000
+    assert FairShareBandwidth(None).bucket("a").reserve(10**9) == 0.0
+
+
+def test_host_bucket_is_reserved_off_the_event_loop(tmp_path: Path) -> None:
+    threads = []
+
+    class Recording(HostTokenBucket):
+        def reserve(self, nbytes: int) -> float:
+            threads.append(threading.get_ident())
+            return super().reserve(nbytes)
+
+    async def acquire() -> int:
+        await RateLimiter(Recording(10**9, str(tmp_path / "bandwidth.json"))).acquire_async(1000)
+        await RateLimiter(TokenBucket(10**9)).acquire_async(1000)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(acquire())
+    assert threads and loop_thread not in threads
+
+
+def test_limiter_from_settings() -> None:
+    assert not limiter_from_settings({})
+    limiter = limiter_from_settings(
+        {"streaming_bandwidth_limit": "1 MB/s", "streaming_host_bandwidth_schedule": [
+            {"start": "00:00", "end": "23:59", "limit": "1 KB/s"}]}
+    )
+    assert [type(bucket) for bucket in limiter.buckets] == [TokenBucket, HostTokenBucket]
+
+
+def test_counting_store_is_throttled() -> None:
+    limiter = RateLimiter(TokenBucket(200_000))
+    # start with an empty bucket
+    limiter.reserve(200_000)
+    stats = TransferStats()
+    store = counting_store(zarr.storage.MemoryStore(), stats, "memory", limiter)
+    ds = xr.Dataset({"value": ("x", np.random.default_rng(0).random(10_000))})
+
+    start = time.perf_counter()
+    ds.to_zarr(store, mode="w", consolidated=False)
+
+    assert stats.bytes("PUT") > 50_000
+    assert time.perf_counter() - start >= stats.bytes("PUT") / 200_000 * 0.9
@@ -0,0 +1,146 @@
+from pathlib import Path
+
+import fsspec
+import numpy as np
+import pytest
+import xarray as xr
+import zarr
+
+from ice_stream.icestream import StreamingState
+from ice_stream.retry import RetryPolicy, is_transient
+from ice_stream.transfer import InstrumentedFileSystem, TransferStats, counting_store
+
+FAST = RetryPolicy(attempts=4, initial_wait=0.001, max_wait=0.01)
+
+
+class FlakyStore(zarr.storage.WrapperStore):
+    """Drops the connection on the first attempt of every chunk write."""
+
+    def __init__(self, store: zarr.abc.store.Store) -> None:
+        super().__init__(store)
+        self.failed: set[str] = set()
+
+    async def set(self, key: str, value: zarr.core.buffer.Buffer) -> None:
+        if key not in self.failed and "/c" in key:
+            self.failed.add(key)
+            raise ConnectionResetError(f"connection reset writing {key}")
+        await self._store.set(key, value)
+
+
+def test_is_transient() -> None:
+    assert is_transient(ConnectionResetError())
+    assert is_transient(TimeoutError())
+    assert not is_transient(FileNotFoundError())
+    assert not is_transient(PermissionError())
+    assert not is_transient(ValueError())
+
+    class HttpResponseError(Exception):
+        status_code = 503
+
+    assert is_transient(HttpResponseError())
+
+
+def test_every_chunk_is_retried_on_its_own() -> None:
+    stats = TransferStats()
+    flaky = FlakyStore(zarr.storage.MemoryStore())
+    ds = xr.Dataset({"value": ("x", np.arange(1000.0))})
+
+    ds.to_zarr(
+        counting_store(flaky, stats, "flaky", retry=FAST),
+        mode="w",
+        encoding={"value": {"chunks": (100,)}},
+        consolidated=False,
+    )
+
+    chunks = len(flaky.failed)
+    assert chunks >= 10
+    # one retry per chunk, not a restart of the whole write
+    assert stats.retries("PUT", "flaky") == chunks
+    assert f"{chunks} retries" in stats.summary()
+    xr.testing.assert_equal(xr.open_zarr(flaky._store, consolidated=False).load(), ds)
+
+
+def test_retries_give_up_and_permanent_errors_fail_fast() -> None:
+    stats = TransferStats()
+    calls = []
+
+    def broken() -> None:
+        calls.append(1)
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        FAST.call(broken, stats=stats, target="t")
+    assert len(calls) == 4
+    assert stats.retry_totals()["PUT"] == 3
+
+    def missing() -> None:
+        calls.append(1)
+        raise FileNotFoundError()
+
+    with pytest.raises(FileNotFoundError):
+        FAST.call(missing)
+    assert len(calls) == 5
+
+
+def test_instrumented_filesystem_retries() -> None:
+    fs = fsspec.filesystem("memory")
+    failures = iter([ConnectionResetError(), TimeoutError()])
+    pipe_file = fs.pipe_file
+
+    class Flaky:
+        def __getattr__(self, name: str) -> object:
+            return getattr(fs, name)
+
+        def pipe_file(self, *args: object, **kwargs: object) -> object:
+            exc = next(failures, None)
+            if exc is not None:
+                raise exc
+            return pipe_file(*args, **kwargs)
+
+    stats = TransferStats()
+    instrumented = InstrumentedFileSystem(Flaky(), stats, "memory", retry=FAST)
+    instrumented.pipe_file("/retry-tests/a.txt", b"hello")
+
+    assert fs.cat_file("/retry-tests/a.txt") == b"hello"
+    assert stats.totals()["PUT"] == {"requests": 1, "bytes": 5}
+    assert stats.retries("PUT") == 2
+
+
+def test_incomplete_target_is_deleted_with_the_retries_of_the_filesystem(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    target_root = f"file://{tmp_path}/target"
+    (tmp_path / "target" / "day1.zarr").mkdir(parents=True)
+    state = StreamingState(str(tmp_path / "streaming_state.yaml"), target_root,
+                           transfer_stats=TransferStats(), retry_policy=RetryPolicy(attempts=3, initial_wait=0))
+    state.on_new_transaction(f"{target_root}/day1.zarr")
+
+    calls = []
+    rm = state.fs.fs.rm
+
+    def flaky(path: str, recursive: bool = False) -> None:
+        calls.append(path)
+        if len(calls) < 3:
+            raise ConnectionResetError("connection reset")
+        if len(calls) == 3:
+            rm(path, recursive=recursive)
+        else:
+            raise FileNotFoundError(path)
+
+    monkeypatch.setattr(state.fs.fs, "rm", flaky)
+    assert state.initialize_and_validate_paths() == (False, None)
+    # 3 attempts of the target, one of the missing high resolution data, not 3 x 3
+    assert [Path(path).name for path in calls] == ["day1.zarr"] * 3 + ["day1_high_res.zarr"]
+    assert not (tmp_path / "target" / "day1.zarr").exists()
+    assert not state.in_transaction()
+
+    # an error that doesn't go away isn't taken for a deleted target
+    state.on_new_transaction(f"{target_root}/day2.zarr")
+    def denied(path: str, recursive: bool = False) -> None:
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(state.fs.fs, "rm", denied)
+    with pytest.raises(PermissionError):
+        state.initialize_and_validate_paths()
+    assert state.in_transaction()
+    state.close()
@@ -0,0 +1,114 @@
+from pathlib import Path
+
+import pytest
+
+import ice_stream.scheduler as scheduler_module
+from ice_stream.ratelimit import RateLimiter
+from ice_stream.scheduler import StreamingScheduler
+
+
+class FakeStreaming:
+    """Records the order the projects are streamed in, projects in `failing` raise."""
+
+    created: list = []
+    streamed: list = []
+    failing: set = set()
+
+    def __init__(self, settings: dict, local_root_path: str, target_root: str) -> None:
+        self.name = Path(local_root_path).name
+        self.rate_limiter = RateLimiter()
+        self.closed: list = []
+        self.shares: list = []
+        self.created.append(self)
+
+    def stream(self) -> None:
+        self.streamed.append(self.name)
+        self.shares.extend(bucket.schedule.rate_at() for bucket in self.rate_limiter.buckets)
+        if self.name in self.failing:
+            raise OSError(f"{self.name} is unreachable")
+
+    def close(self, flush: bool = False) -> None:
+        self.closed.append(flush)
+        if flush and self.name in self.failing:
+            raise OSError(f"{self.name} is unreachable")
+
+
+@pytest.fixture
+def fake_streaming(monkeypatch: pytest.MonkeyPatch) -> type:
+    monkeypatch.setattr(FakeStreaming, "created", [])
+    monkeypatch.setattr(FakeStreaming, "streamed", [])
+    monkeypatch.setattr(FakeStreaming, "failing", set())
+    monkeypatch.setattr(scheduler_module, "Streaming", FakeStreaming)
+    return FakeStreaming
+
+
+def _projects(tmp_path: Path, *names: str) -> list:
+    return [{"settings": {}, "local_root_path": str(tmp_path / name), "target_root": "memory://target"}
+            for name in names]
+
+
+def test_least_recently_served_projects_go_first(tmp_path: Path, fake_streaming: type) -> None:
+    scheduler = StreamingScheduler(_projects(tmp_path, "a", "b", "c"), max_workers=1)
+    scheduler.run()
+    assert fake_streaming.streamed == ["a", "b", "c"]
+
+    scheduler.run_project("a")
+    fake_streaming.streamed.clear()
+    scheduler.run()
+    assert fake_streaming.streamed == ["b", "c", "a"]
+    # the streams are resident between the runs
+    assert len(fake_streaming.created) == 3
+
+
+def test_failing_project_is_isolated_and_rebuilt(tmp_path: Path, fake_streaming: type) -> None:
+    fake_streaming.failing = {"b"}
+    scheduler = StreamingScheduler(_projects(tmp_path, "a", "b", "c"), max_workers=2)
+    results = scheduler.run()
+
+    assert results["a"] is None and results["c"] is None
+    assert isinstance(results["b"], OSError)
+    failed = next(streaming for streaming in fake_streaming.created if streaming.name == "b")
+    assert failed.closed == [False]
+    assert "b" not in scheduler.streams
+
+    fake_streaming.failing = set()
+    assert scheduler.run() == {"a": None, "b": None, "c": None}
+    # only the failed project starts from a clean slate
+    assert sorted(streaming.name for streaming in fake_streaming.created) == ["a", "b", "b", "c"]
+    assert scheduler.streams["b"] is not failed
+
+
+def test_projects_must_not_share_a_name_or_a_root(tmp_path: Path, fake_streaming: type) -> None:
+    with pytest.raises(ValueError, match="Duplicate streaming project name"):
+        StreamingScheduler(_projects(tmp_path, "a") + [{**_projects(tmp_path, "b")[0], "name": "a"}])
+
+    shared = [{**project, "name": name} for name, project in zip("xy", _projects(tmp_path, "a", "a"))]
+    shared[1]["local_root_path"] += "/"
+    with pytest.raises(ValueError, match="must not share a local root path"):
+        StreamingScheduler(shared)
+
+    with pytest.raises(ValueError, match="max_workers"):
+        StreamingScheduler([], max_workers=0)
+
+
+def test_bandwidth_is_shared_by_the_streaming_projects(tmp_path: Path, fake_streaming: type) -> None:
+    scheduler = StreamingScheduler(_projects(tmp_path, "a", "b"), max_workers=1, bandwidth_limit="1 KB/s")
+    scheduler.run()
+    # one at a time, each project gets the whole budget while it streams
+    assert [streaming.shares for streaming in fake_streaming.created] == [[1024], [1024]]
+
+    with scheduler.bandwidth.active("b"):
+        scheduler.run_project("a")
+    assert fake_streaming.created[0].shares[-1] == 512
+
+
+def test_close_flushes_every_stream(tmp_path: Path, fake_streaming: type) -> None:
+    scheduler = StreamingScheduler(_projects(tmp_path, "a", "b", "c"), max_workers=3)
+    scheduler.run()
+    fake_streaming.failing = {"a"}
+
+    scheduler.close(flush=True)
+
+    # a failing flush doesn't keep the other projects from flushing
+    assert [streaming.closed for streaming in fake_streaming.created] == [[True]] * 3
+    assert scheduler.streams == {}
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ice_stream.setup_cache import SetupCache, content_hash, setup_dataset
+
+
+def _dataset(retros: list[int], start: str = "2024-01-01") -> xr.Dataset:
+    return xr.Dataset(
+        {
+            "concentration": ("timestamp", np.arange(5, dtype="float32")),
+            "retro_name": ("retro", np.array([f"r{r}" for r in retros])),
+            "settings": ("settings_id", np.array([10.0])),
+        },
+        coords={
+            "timestamp": pd.date_range(start, periods=5, freq="1s").values,
+            "retro": retros,
+            "settings_id": [0],
+        },
+    )
+
+
+def test_setup_dataset_and_hash_ignore_time_data() -> None:
+    first, later = _dataset([1, 2]), _dataset([1, 2], start="2024-01-02")
+    assert set(setup_dataset(first).dims) == {"retro", "settings_id"}
+    assert content_hash(first) == content_hash(later)
+    assert content_hash(first) != content_hash(_dataset([1, 3]))
+
+
+def test_unknown_target_holds_nothing() -> None:
+    new = SetupCache().new_entries("az://c/setup.zarr", _dataset([1, 2]))
+    assert list(new["retro"]) == [1, 2]
+    assert list(new["settings_id"]) == [0]
+
+
+def test_only_new_entries_need_io() -> None:
+    cache = SetupCache()
+    cache.seed("az://c/setup.zarr", _dataset([1, 2, 3]))
+
+    assert cache.new_entries("az://c/setup.zarr", _dataset([1, 2, 3], start="2024-01-02")) == {}
+    assert cache.new_entries("az://c/setup.zarr", _dataset([2, 3])) == {}
+
+    grown = _dataset([1, 2, 3, 4, 5])
+    assert list(cache.new_entries("az://c/setup.zarr", grown)["retro"]) == [4, 5]
+
+    cache.add("az://c/setup.zarr", grown)
+    assert cache.new_entries("az://c/setup.zarr", grown) == {}
+    assert cache.new_entries("az://c/setup.zarr", _dataset([1, 5])) == {}
+
+
+def test_discard() -> None:
+    cache = SetupCache()
+    cache.seed("az://c/setup.zarr", _dataset([1]))
+    cache.discard("az://c/setup.zarr")
+    assert not cache.is_known("az://c/setup.zarr")
@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from ice_stream.mock_data_generator import SignalSynthesis, generate_mock_data
+from ice_stream.simulator import InstrumentSimulator, Simulator
+from tests.helpers import FakeClock
+
+
+def _expected(seed_file: Path, tmp_path: Path, synthesis: SignalSynthesis, start: str) -> xr.Dataset:
+    ds = generate_mock_data(seed_file, tmp_path / "expected.nc", target_duration_hours=0.5, synthesis=synthesis)
+    offset = np.datetime64(start) - ds["timestamp"].values[0]
+    return ds.assign_coords({dim: ds[dim].values + offset for dim in ("timestamp", "high_res_timestamp")})
+
+
+@pytest.mark.parametrize("suffix", [".nc", ".zarr", ".zip", ".icechunk"])
+def test_simulated_source_holds_the_mock_data(synthetic_seed: Path, tmp_path: Path, suffix: str) -> None:
+    clock = FakeClock(1000.0)
+    instrument = InstrumentSimulator(
+        synthetic_seed, tmp_path / f"inst{suffix}", hours=0.5, speed=60, start="2025-01-01", instrument="inst"
+    )
+    summary = Simulator([instrument], interval=5, clock=clock, sleep=clock.sleep).run()
+
+    assert (tmp_path / f"inst{suffix}").exists()
+    source = instrument.close().load()
+    expected = _expected(synthetic_seed, tmp_path, instrument.synthesis, "2025-01-01")
+    xr.testing.assert_equal(source, expected)
+    assert source.attrs["instrument"] == "inst"
+    # 4 repetitions of 10 minutes at 60x, appended every 5 seconds from the start
+    assert summary[f"inst{suffix}"]["appends"] == 9
+    assert clock.now - 1000 == pytest.approx(40)
+
+
+def test_instruments_append_as_time_passes(synthetic_seed: Path, tmp_path: Path) -> None:
+    clock = FakeClock(1000.0)
+    instruments = [
+        InstrumentSimulator(synthetic_seed, tmp_path / name, hours=0.5, speed=10, start="2025-01-01")
+        for name in ("a.zarr", "b.nc")
+    ]
+    simulator = Simulator(instruments, interval=1, log_path=tmp_path / "appends.jsonl", clock=clock, sleep=clock.sleep)
+    simulator.run(duration=20)
+
+    records = [json.loads(line) for line in (tmp_path / "appends.jsonl").read_text().splitlines()]
+    assert records == simulator.records
+    assert {record["instrument"] for record in records} == {"a.zarr", "b.nc"}
+    for record in records:
+        # nothing is appended ahead of the simulated clock
+        simulated = np.datetime64("2025-01-01") + np.timedelta64(int((record["wall_time"] - 1000) * 10), "s")
+        assert np.datetime64(record["last_timestamp"]) <= simulated
+    # 20 seconds at 10x
+    assert instruments[0].last_timestamp == np.datetime64("2025-01-01T00:03:20")
+    assert not any(instrument.done for instrument in instruments)
+    # different instruments record different data
+    a = instruments[0].close().load()
+    b = instruments[1].close().load()
+    assert not np.array_equal(a["hf_var"].values[:100], b["hf_var"].values[:100])
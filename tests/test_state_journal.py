@@ -0,0 +1,128 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import yaml
+
+from ice_stream.icestream import StreamingState
+from ice_stream.journal import JournalLockedError, StateJournal
+
+
+def _state(last: str, incomplete: str = "") -> dict[str, str]:
+    return {
+        "last_valid_target": last,
+        "penultimate_valid_target": "",
+        "incomplete_target": incomplete,
+    }
+
+
+def test_journal_replays_after_crash(tmp_path: Path) -> None:
+    path = str(tmp_path / "streaming_state.yaml")
+    journal = StateJournal(path)
+    journal.checkpoint(_state(""))
+    journal.append(_state("", incomplete="az://c/day1.zarr"))
+    journal.append(_state("az://c/day1.zarr"))
+    # simulate a power loss: the lock is released but nothing is checkpointed
+    journal._fh.close()
+
+    with open(path) as fh:
+        assert yaml.safe_load(fh)["last_valid_target"] == ""
+
+    reopened = StateJournal(path)
+    assert reopened.load() == _state("az://c/day1.zarr")
+    # replay compacts the journal into the checkpoint
+    assert Path(reopened.journal_path).stat().st_size == 0
+    reopened.close()
+
+
+def test_journal_ignores_torn_tail(tmp_path: Path) -> None:
+    path = str(tmp_path / "streaming_state.yaml")
+    journal = StateJournal(path)
+    journal.append(_state("", incomplete="az://c/day1.zarr"))
+    journal._fh.write(b'0badc0de {"seq": 2, "sta')
+    journal._fh.close()
+
+    reopened = StateJournal(path)
+    assert reopened.load() == _state("", incomplete="az://c/day1.zarr")
+    reopened.close()
+
+
+def test_journal_drops_torn_only_record(tmp_path: Path) -> None:
+    path = str(tmp_path / "streaming_state.yaml")
+    journal = StateJournal(path)
+    journal.append({"a": 1})
+    # tear the only record, nothing can be replayed
+    with open(journal.journal_path, "r+b") as fh:
+        fh.truncate(Path(journal.journal_path).stat().st_size - 3)
+    journal._fh.close()
+
+    reopened = StateJournal(path)
+    assert reopened.load() == {}
+    assert Path(reopened.journal_path).stat().st_size == 0
+    reopened.append({"a": 2})
+    reopened._fh.close()
+
+    again = StateJournal(path)
+    assert again.load() == {"a": 2}
+    again.close()
+
+
+def test_journal_coalesces_non_durable_appends(tmp_path: Path) -> None:
+    path = str(tmp_path / "streaming_state.yaml")
+    journal = StateJournal(path)
+    journal.append(_state("az://c/day1.zarr"), durable=False)
+    assert Path(journal.journal_path).stat().st_size == 0
+
+    journal.flush()
+    size = Path(journal.journal_path).stat().st_size
+    assert size > 0
+    journal.flush()
+    assert Path(journal.journal_path).stat().st_size == size
+    journal.close()
+
+
+def test_journal_checkpoints_periodically(tmp_path: Path) -> None:
+    path = str(tmp_path / "streaming_state.yaml")
+    journal = StateJournal(path, checkpoint_every=3)
+    for i in range(3):
+        journal.append(_state(f"az://c/day{i}.zarr"))
+    assert Path(journal.journal_path).stat().st_size == 0
+    with open(path) as fh:
+        assert yaml.safe_load(fh) == _state("az://c/day2.zarr")
+    journal.close()
+
+
+def test_journal_is_exclusive(tmp_path: Path) -> None:
+    path = str(tmp_path / "streaming_state.yaml")
+    journal = StateJournal(path)
+    with pytest.raises(JournalLockedError):
+        StateJournal(path)
+    journal.close()
+
+    other = StateJournal(str(tmp_path / "other_state.yaml"))
+    StateJournal(path).close()
+    other.close()
+
+
+def test_completed_transaction_survives_a_crash(tmp_path: Path) -> None:
+    target_root = f"file://{tmp_path}/target"
+    url = f"{target_root}/day1.zarr"
+    xr.Dataset(
+        {"value": ("timestamp", np.arange(3.0))},
+        coords={"timestamp": pd.date_range("2024-01-01", periods=3, freq="1s"), "high_res_timestamp": []},
+    ).to_zarr(tmp_path / "target" / "day1.zarr")
+
+    state = StreamingState(str(tmp_path / "streaming_state.yaml"), target_root)
+    state.on_new_transaction(url)
+    state.on_complete_transaction()
+    # power loss right after the upload, before any other transition
+    state._journal._fh.close()
+
+    reopened = StreamingState(str(tmp_path / "streaming_state.yaml"), target_root)
+    is_available, (last_url, ds) = reopened.initialize_and_validate_paths()
+    assert is_available and last_url == url
+    assert ds.timestamp.size == 3
+    assert (tmp_path / "target" / "day1.zarr").exists()
+    reopened.close()
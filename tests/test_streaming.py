@@ -0,0 +1,309 @@
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import ice_stream.icestream as icestream
+from ice_stream.icestream import Streaming
+
+START = pd.Timestamp("2024-01-01")
+
+
+def _source(start: pd.Timestamp, seconds: int, settings: str = "a") -> xr.Dataset:
+    """One second of instrument data per timestamp, and 4 high resolution samples."""
+    timestamps = pd.date_range(start, periods=seconds, freq="1s")
+    high_res = pd.date_range(start, periods=4 * seconds, freq="250ms")
+    return xr.Dataset(
+        {
+            "concentration": ("timestamp", np.arange(seconds, dtype="float64") + (start - START).total_seconds()),
+            "waveform": ("high_res_timestamp", np.arange(4 * seconds, dtype="float64")),
+        },
+        coords={"timestamp": timestamps, "high_res_timestamp": high_res},
+        attrs={"settings": settings},
+    )
+
+
+class FakeBackup:
+    """Exports the slices of `sources` between `since` and `until`, one zarr file per day and settings."""
+
+    sources: list = []
+
+    def __init__(self, settings: dict) -> None:
+        self.config = SimpleNamespace(settings=settings)
+        self.exports: list = []
+
+    def to_file(self, folder: str, since: pd.Timestamp, until: pd.Timestamp) -> list:
+        self.exports.append((since, until))
+        paths = []
+        for source in self.sources:
+            ds = source.sel(timestamp=slice(since, until), high_res_timestamp=slice(since, until))
+            if ds.sizes["timestamp"] == 0:
+                continue
+            days = pd.DatetimeIndex(ds.timestamp.values).normalize()
+            for day in days.unique():
+                part = ds.sel(timestamp=slice(day, day + pd.Timedelta("1D") - pd.Timedelta("1ns")),
+                              high_res_timestamp=slice(day, day + pd.Timedelta("1D") - pd.Timedelta("1ns")))
+                path = Path(folder) / "inst" / f"{day:%Y-%m-%d}_{ds.attrs['settings']}.zarr"
+                part.to_zarr(path, mode="w")
+                paths.append(str(path))
+        return paths
+
+
+def fake_zappend(paths: list, config: dict, slice_source) -> None:
+    ds = slice_source(paths[0])
+    for name in ds.variables:
+        ds[name].encoding.clear()
+    # local targets of `streaming_local_first` come with their storage options
+    local = config["target_dir"].startswith("file://")
+    storage_options = config["target_storage_options"] if local else None
+    fs, path = fsspec.core.url_to_fs(config["target_dir"], **storage_options or {})
+    if fs.exists(path):
+        ds.to_zarr(config["target_dir"], mode="a", append_dim="timestamp", storage_options=storage_options)
+    else:
+        ds.to_zarr(config["target_dir"], mode="w", storage_options=storage_options)
+
+
+@pytest.fixture
+def stub_clads(monkeypatch: pytest.MonkeyPatch) -> type:
+    monkeypatch.setattr(FakeBackup, "sources", [])
+    monkeypatch.setattr(icestream, "_backup", SimpleNamespace(
+        Backup=FakeBackup,
+        significant_keys=["settings"],
+        setup_sideload_path="setup.zarr",
+        append_missing_setup_data_to_target=lambda *args, **kwargs: None,
+    ))
+    monkeypatch.setattr(icestream, "_zappend", SimpleNamespace(zappend=fake_zappend))
+    return FakeBackup
+
+
+@pytest.fixture
+def target_root(tmp_path: Path):
+    """An in-memory target root, zarr on a local path needs its parent folders."""
+    root = f"memory://{tmp_path.name}/target"
+    yield root
+    fsspec.filesystem("memory").rm(root, recursive=True)
+
+
+def _streaming(tmp_path: Path, target_root: str, until: pd.Timestamp, **settings) -> Streaming:
+    settings = {"streaming_metrics": False, "streaming_retry": {"attempts": 1}, **settings}
+    return Streaming(settings, str(tmp_path / "local"), target_root, since_hint=START, until_hint=until)
+
+
+def _target(target_root: str, name: str) -> xr.Dataset:
+    return xr.open_zarr(f"{target_root}/inst/{name}").load()
+
+
+def _high_res(target_root: str, name: str) -> xr.Dataset:
+    return _target(target_root, name.replace(".zarr", "_high_res.zarr"))
+
+
+def _assert_holds(target: xr.Dataset, source: xr.Dataset, name: str = "concentration") -> None:
+    """*target* holds the variable *name* of *source*, every sample once."""
+    dim = source[name].dims[0]
+    np.testing.assert_array_equal(target[dim].values, source[dim].values.astype("datetime64[ns]"))
+    np.testing.assert_array_equal(target[name].values, source[name].values)
+
+
+def test_sub_chunk_files_are_buffered(tmp_path: Path, target_root: str, stub_clads: type) -> None:
+    stub_clads.sources = [_source(START, 40)]
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=39))
+    streaming.stream()
+
+    assert not fsspec.filesystem("memory").exists(f"{target_root}/inst")
+    assert streaming.carry_over.dataset().sizes == {"timestamp": 40, "high_res_timestamp": 157}
+    streaming.close()
+
+
+def test_remainder_is_prepended_on_the_next_run(tmp_path: Path, target_root: str, stub_clads: type) -> None:
+    stub_clads.sources = [_source(START, 400)]
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=249))
+    streaming.stream()
+
+    target = _target(target_root, "2024-01-01_a.zarr")
+    assert target.sizes["timestamp"] == 200
+    assert streaming.carry_over.dataset().sizes["timestamp"] == 50
+
+    streaming.until_hint = START + pd.Timedelta(seconds=399)
+    streaming.stream()
+    target = _target(target_root, "2024-01-01_a.zarr")
+    _assert_holds(target, stub_clads.sources[0])
+    # the 1597 high resolution rows exported so far fill one chunk of 1000, the rest waits
+    assert streaming.carry_over.dataset().sizes == {"timestamp": 0, "high_res_timestamp": 597}
+    # the buffered rows are prepended, they are never exported again
+    assert streaming.backup.exports[-1][0] == START + pd.Timedelta(seconds=249, milliseconds=1)
+    streaming.close()
+
+
+def test_restart_with_a_buffer(tmp_path: Path, target_root: str, stub_clads: type) -> None:
+    stub_clads.sources = [_source(START, 400)]
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=249))
+    streaming.stream()
+    streaming.close()
+
+    restarted = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=399))
+    restarted.stream()
+
+    # the watermark of the buffer is where the export continues
+    assert restarted.backup.exports[0][0] == START + pd.Timedelta(seconds=249, milliseconds=1)
+    target = _target(target_root, "2024-01-01_a.zarr")
+    _assert_holds(target, stub_clads.sources[0])
+    restarted.close()
+
+
+@pytest.mark.parametrize("change", ["settings", "day"])
+def test_buffer_is_flushed_when_the_data_does_not_continue(
+    tmp_path: Path, target_root: str, stub_clads: type, change: str
+) -> None:
+    first = _source(START + pd.Timedelta(hours=23, minutes=50), 250)
+    second_start = START + pd.Timedelta(days=1, seconds=5) if change == "day" else START + pd.Timedelta(hours=23, minutes=55)
+    second = _source(second_start, 200, settings="b" if change == "settings" else "a")
+    stub_clads.sources = [first, second]
+
+    streaming = _streaming(tmp_path, target_root, second_start + pd.Timedelta(seconds=199))
+    streaming.stream()
+
+    # the remainder of the first file completes its target, with a partial chunk
+    target = _target(target_root, "2024-01-01_a.zarr")
+    _assert_holds(target, first)
+    _assert_holds(_high_res(target_root, "2024-01-01_a.zarr"), first, "waveform")
+    name = "2024-01-02_a.zarr" if change == "day" else "2024-01-01_b.zarr"
+    assert _target(target_root, name).sizes["timestamp"] == 200
+    streaming.close()
+
+
+@pytest.mark.parametrize("restart", [False, True], ids=["resident", "restarted"])
+def test_close_flushes_the_buffer(tmp_path: Path, target_root: str, stub_clads: type, restart: bool) -> None:
+    source = _source(START, 250)
+    stub_clads.sources = [source]
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=249))
+    streaming.stream()
+    assert _target(target_root, "2024-01-01_a.zarr").sizes["timestamp"] == 200
+
+    if restart:
+        streaming.close()
+        streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=249))
+    streaming.close(flush=True)
+
+    # the project stopped, no rows are left behind
+    _assert_holds(_target(target_root, "2024-01-01_a.zarr"), source)
+    exported = source.sel(high_res_timestamp=slice(None, START + pd.Timedelta(seconds=249)))
+    _assert_holds(_high_res(target_root, "2024-01-01_a.zarr"), exported, "waveform")
+    assert streaming.carry_over.is_empty()
+
+
+def test_close_keeps_the_buffer_without_flush(tmp_path: Path, target_root: str, stub_clads: type) -> None:
+    stub_clads.sources = [_source(START, 250)]
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=249))
+    streaming.stream()
+    streaming.close()
+
+    assert _target(target_root, "2024-01-01_a.zarr").sizes["timestamp"] == 200
+    reopened = _streaming(tmp_path, target_root, START)
+    assert reopened.carry_over.dataset().sizes["timestamp"] == 50
+    reopened.close()
+
+
+def _targets(target_root: str) -> dict:
+    """Every target below *target_root*, by its path relative to the root."""
+    fs = fsspec.filesystem("memory")
+    root = fs._strip_protocol(target_root)
+    return {
+        path[len(root) + 1:]: xr.open_zarr(f"memory://{path}").load()
+        for path in sorted(fs.find(root, withdirs=True))
+        if path.endswith(".zarr") and not path.endswith("setup.zarr")
+    }
+
+
+def test_pipelined_run_matches_the_sequential_run(tmp_path: Path, stub_clads: type) -> None:
+    # a catch-up over three days, exported in several windows
+    stub_clads.sources = [
+        _source(START + pd.Timedelta(hours=23, minutes=30), 3600),
+        _source(START + pd.Timedelta(days=2, hours=23, minutes=50), 500),
+    ]
+    until = START + pd.Timedelta(days=2, hours=23, minutes=50, seconds=499)
+    roots, states = {}, {}
+    for mode, pipelined in [("sequential", False), ("pipelined", True)]:
+        roots[mode] = f"memory://{tmp_path.name}/{mode}"
+        streaming = _streaming(tmp_path / mode, roots[mode], until, streaming_pipeline=pipelined)
+        streaming.stream()
+        assert len(streaming.backup.exports) > 1
+        states[mode] = {
+            key: str(value).replace(roots[mode], "<root>")
+            for key, value in streaming.streaming_state._state_data.items()
+        }
+        streaming.close()
+
+    try:
+        sequential, pipelined = _targets(roots["sequential"]), _targets(roots["pipelined"])
+        assert sorted(pipelined) == sorted(sequential) and sequential
+        for name, target in sequential.items():
+            xr.testing.assert_identical(pipelined[name], target)
+        assert states["pipelined"] == states["sequential"]
+    finally:
+        for root in roots.values():
+            fsspec.filesystem("memory").rm(root, recursive=True)
+
+
+def test_pipelined_upload_error_stops_the_export(
+    tmp_path: Path, target_root: str, stub_clads: type, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stub_clads.sources = [
+        _source(START + pd.Timedelta(days=day, hours=23, minutes=50), 1200) for day in range(5)
+    ]
+    calls = []
+
+    def failing_zappend(paths: list, config: dict, slice_source) -> None:
+        calls.append(paths[0])
+        if len(calls) > 1:
+            raise OSError("network is unreachable")
+        fake_zappend(paths, config, slice_source)
+
+    monkeypatch.setattr(icestream, "_zappend", SimpleNamespace(zappend=failing_zappend))
+    exports_dir = tmp_path / "exports"
+    exports_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(exports_dir))
+
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(days=5), streaming_pipeline=True,
+                           streaming_pipeline_queue_size=1)
+    with pytest.raises(OSError, match="unreachable"):
+        streaming.stream()
+
+    # the producer stopped instead of exporting the remaining days, and left no exports behind
+    assert len(streaming.backup.exports) < 5
+    assert not any(thread.name == "ice-stream-prefetch" for thread in threading.enumerate())
+    assert list(exports_dir.iterdir()) == []
+    # the failed transaction is rolled back by the next run
+    assert streaming.streaming_state._state_data["incomplete_target"]
+    streaming.close()
+
+
+def test_local_first_pushes_the_targets(
+    tmp_path: Path, target_root: str, stub_clads: type, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    source = _source(START, 400)
+    stub_clads.sources = [source]
+    streaming = _streaming(tmp_path, target_root, START + pd.Timedelta(seconds=199), streaming_local_first=True)
+
+    # the link is down, the run succeeds locally
+    put_file = streaming.target_sync.fs.fs.put_file
+    monkeypatch.setattr(streaming.target_sync.fs.fs, "put_file", lambda *args, **kwargs: _offline())
+    streaming.stream()
+    assert xr.open_zarr(tmp_path / "local" / "targets" / "inst" / "2024-01-01_a.zarr").sizes["timestamp"] == 200
+    assert not fsspec.filesystem("memory").exists(f"{target_root}/inst/2024-01-01_a.zarr/zarr.json")
+
+    # the next run pushes the backlog with its own data
+    monkeypatch.setattr(streaming.target_sync.fs.fs, "put_file", put_file)
+    streaming.until_hint = START + pd.Timedelta(seconds=399)
+    streaming.stream()
+    _assert_holds(_target(target_root, "2024-01-01_a.zarr"), source)
+    streaming.close()
+
+
+def _offline() -> None:
+    raise OSError("network is unreachable")
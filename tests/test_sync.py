@@ -0,0 +1,143 @@
+import shutil
+from pathlib import Path
+
+import icechunk
+import numpy as np
+import pytest
+import xarray as xr
+
+from ice_stream.sync import IcechunkSync, SyncError, TargetSync, local_repository
+
+
+def _commit(repo: icechunk.Repository, n: int, append: bool) -> None:
+    session = repo.writable_session("main")
+    ds = xr.Dataset({"value": ("x", np.random.default_rng(n).random(n))})
+    if append:
+        ds.to_zarr(session.store, mode="a", append_dim="x", consolidated=False)
+    else:
+        ds.to_zarr(session.store, mode="w", encoding={"value": {"chunks": (1000,)}}, consolidated=False)
+    session.commit(f"{n} values")
+
+
+def _remote_values(path: Path) -> int:
+    repo = icechunk.Repository.open(icechunk.local_filesystem_storage(str(path)))
+    return xr.open_zarr(repo.readonly_session("main").store, consolidated=False).sizes["x"]
+
+
+def test_incremental_sync(tmp_path: Path) -> None:
+    repo = local_repository(str(tmp_path / "local"))
+    _commit(repo, 5000, append=False)
+    syncer = IcechunkSync(str(tmp_path / "local"), f"file://{tmp_path / 'remote'}")
+
+    first = syncer.sync()
+    assert first["objects"] > 5 and first["refs"] >= 1
+    assert _remote_values(tmp_path / "remote") == 5000
+    assert syncer.sync() == {"objects": 0, "bytes": 0, "refs": 0}
+
+    _commit(repo, 2000, append=True)
+    second = syncer.sync()
+    assert 0 < second["objects"] < first["objects"] + 5
+    assert _remote_values(tmp_path / "remote") == 7000
+
+
+def test_interrupted_sync_resumes_without_moving_the_refs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    repo = local_repository(str(tmp_path / "local"))
+    _commit(repo, 10_000, append=False)
+    syncer = IcechunkSync(str(tmp_path / "local"), f"file://{tmp_path / 'remote'}", batch_size=2, max_workers=1)
+
+    # the link goes down after the first batch
+    push_batch = syncer._push_batch
+    calls = []
+
+    def flaky(batch: list[str], sizes: dict[str, int]) -> None:
+        calls.append(batch)
+        if len(calls) > 1:
+            raise PermissionError("offline")
+        push_batch(batch, sizes)
+
+    monkeypatch.setattr(syncer, "_push_batch", flaky)
+    with pytest.raises(PermissionError):
+        syncer.sync()
+    assert not (tmp_path / "remote" / "refs").exists()
+
+    monkeypatch.undo()
+    pending = sum(len(objects) for objects in syncer.pending().values())
+    result = syncer.sync()
+    # the first batch wasn't sent again
+    assert result["objects"] == pending
+    assert _remote_values(tmp_path / "remote") == 10_000
+
+
+def test_batches_are_verified(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    repo = local_repository(str(tmp_path / "local"))
+    _commit(repo, 1000, append=False)
+    syncer = IcechunkSync(str(tmp_path / "local"), f"file://{tmp_path / 'remote'}")
+
+    monkeypatch.setattr(syncer.fs.fs, "sizes", lambda paths: [0 for _ in paths])
+    with pytest.raises(SyncError):
+        syncer.sync()
+
+
+def test_sync_lists_the_remote_only_without_a_record(tmp_path: Path) -> None:
+    repo = local_repository(str(tmp_path / "local"))
+    _commit(repo, 5000, append=False)
+    syncer = IcechunkSync(str(tmp_path / "local"), f"file://{tmp_path / 'remote'}")
+    syncer.sync()
+    assert (tmp_path / "local.sync.json").exists()
+
+    _commit(repo, 2000, append=True)
+    syncer.stats.reset()
+    assert syncer.sync()["objects"] > 0
+    assert syncer.stats.requests("LIST") == 0
+
+    # a remote that lost an object is only noticed by a full sync
+    chunk = next((tmp_path / "remote" / "chunks").iterdir())
+    chunk.unlink()
+    assert syncer.sync()["objects"] == 0
+    assert syncer.sync(full=True)["objects"] == 1
+    assert chunk.exists()
+
+    # another host, or a lost record, seeds the record from the remote
+    (tmp_path / "local.sync.json").unlink()
+    fresh = IcechunkSync(str(tmp_path / "local"), f"file://{tmp_path / 'remote'}")
+    assert fresh.sync() == {"objects": 0, "bytes": 0, "refs": 0}
+
+
+def _target(path: Path, n: int, append: bool) -> None:
+    ds = xr.Dataset({"value": ("x", np.arange(n, dtype="float64"))})
+    if append:
+        ds.to_zarr(path, mode="a", append_dim="x", consolidated=False)
+    else:
+        ds.to_zarr(path, mode="w", encoding={"value": {"chunks": (100,)}}, consolidated=False)
+
+
+def test_target_sync_mirrors_the_changed_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    local = tmp_path / "targets"
+    _target(local / "a.zarr", 250, append=False)
+    syncer = TargetSync(str(local), f"file://{tmp_path / 'remote'}")
+
+    pushed = []
+    put_file = syncer.fs.fs.put_file
+    monkeypatch.setattr(syncer.fs.fs, "put_file", lambda lpath, rpath, **kwargs: (
+        pushed.append(Path(rpath).name), put_file(lpath, rpath, **kwargs)))
+
+    first = syncer.sync()
+    assert first["objects"] == len(pushed) > 3
+    # the metadata describes chunks that are there already
+    assert pushed[-1] == "zarr.json" and pushed[0] != "zarr.json"
+    assert syncer.sync()["objects"] == 0
+
+    # appending rewrites the partial last chunk and the metadata
+    pushed.clear()
+    _target(local / "a.zarr", 100, append=True)
+    assert syncer.sync()["objects"] < first["objects"] + 1
+    assert "zarr.json" in pushed
+    remote = xr.open_zarr(tmp_path / "remote" / "a.zarr", consolidated=False)
+    np.testing.assert_array_equal(remote["value"].values, np.r_[np.arange(250), np.arange(100)])
+
+    # a target removed locally is removed from the remote
+    shutil.rmtree(local / "a.zarr")
+    _target(local / "b.zarr", 10, append=False)
+    assert syncer.sync()["deleted"] > 3
+    assert not [path for path in (tmp_path / "remote" / "a.zarr").rglob("*") if path.is_file()]
+    assert (tmp_path / "remote" / "b.zarr" / "zarr.json").exists()
@@ -0,0 +1,145 @@
+import shutil
+from pathlib import Path
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from ice_stream.icestream import StreamingState
+from ice_stream.target_index import TargetIndex
+
+
+@pytest.fixture
+def fs():
+    fs = fsspec.filesystem("memory")
+    yield fs
+    if fs.exists("/streaming-tests"):
+        fs.rm("/streaming-tests", recursive=True)
+
+
+def _make_target(fs, path: str) -> str:
+    fs.pipe_file(f"/streaming-tests/{path}/.zgroup", b"{}")
+    return f"memory://streaming-tests/{path}"
+
+
+def test_record_updates_head_and_sorted_index(fs) -> None:
+    index = TargetIndex(fs, "memory://streaming-tests", "inst-a")
+    assert index.head() == ""
+    assert index.entries() == []
+
+    index.record("memory://streaming-tests/i/p/2024-01-02.zarr", "2024-01-02T00:00:00")
+    index.record("memory://streaming-tests/i/p/2024-01-01.zarr", "2024-01-01T00:00:00")
+
+    reloaded = TargetIndex(fs, "memory://streaming-tests", "inst-a")
+    assert reloaded.head() == "memory://streaming-tests/i/p/2024-01-01.zarr"
+    assert [e["target"] for e in reloaded.entries()] == [
+        "memory://streaming-tests/i/p/2024-01-01.zarr",
+        "memory://streaming-tests/i/p/2024-01-02.zarr",
+    ]
+    # other projects have their own index
+    assert TargetIndex(fs, "memory://streaming-tests", "inst-b").head() == ""
+
+
+def test_find_last_valid_walks_the_index(fs) -> None:
+    index = TargetIndex(fs, "memory://streaming-tests", "inst-a")
+    for day in ("2024-01-01", "2024-01-02", "2024-01-03"):
+        index.record(f"memory://streaming-tests/i/p/{day}.zarr", day)
+
+    valid = {"memory://streaming-tests/i/p/2024-01-02.zarr"}
+    calls = []
+
+    def validate(url):
+        calls.append(url)
+        return "ds" if url in valid else None
+
+    assert index.find_last_valid(validate) == ("memory://streaming-tests/i/p/2024-01-02.zarr", "ds")
+    assert calls == ["memory://streaming-tests/i/p/2024-01-03.zarr", "memory://streaming-tests/i/p/2024-01-02.zarr"]
+
+
+def test_listing_is_the_last_resort(fs) -> None:
+    for path in ("i/p/2024-01-01.zarr", "i/p/2024-01-02.zarr", "i/p/2024-01-02_high_res.zarr", "j/q/2023-12-31.zarr"):
+        _make_target(fs, path)
+    fs.pipe_file("/streaming-tests/i/p/notes.txt", b"")
+
+    index = TargetIndex(fs, "memory://streaming-tests", "inst-a", "i/p")
+    exclude = lambda name: name.endswith("_high_res.zarr")  # noqa: E731
+    assert index.list_targets(exclude, max_workers=2) == [
+        "memory://streaming-tests/i/p/2024-01-02.zarr",
+        "memory://streaming-tests/i/p/2024-01-01.zarr",
+    ]
+    assert index.find_last_valid(lambda url: url, exclude) == (
+        "memory://streaming-tests/i/p/2024-01-02.zarr",
+        "memory://streaming-tests/i/p/2024-01-02.zarr",
+    )
+    assert index.find_last_valid(lambda url: None, exclude) == ("", None)
+
+
+def test_listing_stays_in_the_project(fs) -> None:
+    # the other project streamed last, its target is the newest under the root
+    for path in ("a/p/inst-a-prj-p-2024-01-01t00-00-00zl1b.zarr", "b/q/inst-b-prj-q-2024-01-02t00-00-00zl1b.zarr"):
+        _make_target(fs, path)
+
+    index = TargetIndex(fs, "memory://streaming-tests", "a/p", "a/p")
+    assert index.find_last_valid(lambda url: url) == (
+        "memory://streaming-tests/a/p/inst-a-prj-p-2024-01-01t00-00-00zl1b.zarr",
+    ) * 2
+
+    # the project is unknown, no target is safe to adopt
+    listed = []
+    unknown = TargetIndex(fs, "memory://streaming-tests", None)
+    assert unknown.find_last_valid(lambda url: listed.append(url) or url) == ("", None)
+    assert listed == []
+
+
+@pytest.mark.parametrize("head", [b"target: [unclosed", b"- not a mapping", b"target: 3"])
+def test_corrupt_index_falls_back(fs, head: bytes) -> None:
+    target = _make_target(fs, "i/p/2024-01-01.zarr")
+    index = TargetIndex(fs, "memory://streaming-tests", "i/p", "i/p")
+    index.record(target, "2024-01-01")
+    fs.pipe_file("/streaming-tests/_streaming/i/p/head.yaml", head)
+
+    reloaded = TargetIndex(fs, "memory://streaming-tests", "i/p", "i/p")
+    assert reloaded.head() == ""
+    assert reloaded.find_last_valid(lambda url: url) == (target, target)
+
+    # a torn index, only the listing is left
+    fs.pipe_file("/streaming-tests/_streaming/i/p/index.yaml", b"targets:\n  - {target: memory://stream")
+    reloaded = TargetIndex(fs, "memory://streaming-tests", "i/p", "i/p")
+    assert reloaded.entries() == []
+    assert reloaded.find_last_valid(lambda url: url) == (target, target)
+
+
+def test_hosts_with_the_same_folder_name_keep_their_own_target_index(tmp_path: Path) -> None:
+    target_root = f"file://{tmp_path}/target"
+
+    def stream(host: str, instrument: str, *days: str) -> StreamingState:
+        (tmp_path / host / "streaming").mkdir(parents=True)
+        state = StreamingState(str(tmp_path / host / "streaming" / "streaming_state.yaml"), target_root)
+        for day in days:
+            url = f"{target_root}/{instrument}/project/{day}.zarr"
+            xr.Dataset(
+                {"value": ("timestamp", np.arange(3.0))},
+                coords={"timestamp": pd.date_range(f"2024-01-0{day[-1]}", periods=3, freq="1s"),
+                        "high_res_timestamp": []},
+            ).to_zarr(tmp_path / "target" / instrument / "project" / f"{day}.zarr")
+            state.on_new_transaction(url)
+            state.on_complete_transaction()
+        return state
+
+    host_b = stream("host-b", "inst-b", "day1", "day2")
+    host_a = stream("host-a", "inst-a", "day3")
+    assert host_a.target_index.key == "inst-a/project"
+    assert host_b.target_index.key == "inst-b/project"
+
+    # host b loses its last target, the newest target of host a must not be picked up
+    shutil.rmtree(tmp_path / "target" / "inst-b" / "project" / "day2.zarr")
+    is_available, (last_url, _) = host_b.initialize_and_validate_paths()
+    assert is_available and last_url == f"{target_root}/inst-b/project/day1.zarr"
+
+    # a reset state doesn't know its project, it must not resume on another project's target
+    host_c = stream("host-c", "inst-c")
+    assert host_c.initialize_and_validate_paths() == (False, None)
+    for state in (host_a, host_b, host_c):
+        state.close()
@@ -0,0 +1,91 @@
+import threading
+
+import fsspec
+import icechunk
+import numpy as np
+import pytest
+import xarray as xr
+
+from ice_stream.blocks import upload_in_intervals, upload_single_chunk
+from ice_stream.transfer import InstrumentedFileSystem, TransferStats, counting_store
+
+
+def _dataset(n: int = 10_000) -> xr.Dataset:
+    timestamps = np.datetime64("2024-01-01") + np.arange(n) * np.timedelta64(1, "s")
+    rng = np.random.default_rng(0)
+    return xr.Dataset({"value": ("timestamp", rng.random(n))}, coords={"timestamp": timestamps})
+
+
+def test_stats_are_thread_safe() -> None:
+    stats = TransferStats()
+
+    def work() -> None:
+        for _ in range(1000):
+            stats.record("PUT", 10, "a")
+            stats.record("GET", 1, "b")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stats.requests("PUT") == 8000
+    assert stats.bytes("PUT", "a") == 80_000
+    assert stats.bytes(target="b") == 8000
+    assert stats.by_target()["a"]["PUT"] == {"requests": 8000, "bytes": 80_000}
+    assert "PUT 8000 req" in stats.summary()
+
+    with pytest.raises(ValueError):
+        stats.record("POST")
+
+
+def test_counting_store_on_an_icechunk_session() -> None:
+    repo = icechunk.Repository.create(icechunk.in_memory_storage())
+    session = repo.writable_session("main")
+    stats = TransferStats()
+    ds = _dataset()
+
+    store = counting_store(session.store, stats, "repo")
+    ds.to_zarr(store, mode="w", encoding={"value": {"chunks": (1000,)}}, consolidated=False)
+    session.commit("counted")
+
+    # 10 value chunks, at least as many timestamp chunks and the metadata
+    assert stats.requests("PUT", "repo") > 10
+    assert 0 < stats.bytes("PUT") < ds.nbytes * 2
+    assert store.with_read_only(True).stats is stats
+
+    stored = xr.open_zarr(repo.readonly_session("main").store, consolidated=False)
+    assert stored.sizes["timestamp"] == ds.sizes["timestamp"]
+
+
+def test_upload_helpers_count_requests() -> None:
+    ds = _dataset()
+
+    single = TransferStats()
+    upload_single_chunk(icechunk.Repository.create(icechunk.in_memory_storage()), ds, stats=single)
+    assert single.requests("PUT") > 0
+
+    intervals = TransferStats()
+    repo = icechunk.Repository.create(icechunk.in_memory_storage())
+    upload_in_intervals(repo, ds, "timestamp", np.timedelta64(1000, "s"), stats=intervals)
+    assert intervals.requests("PUT") > single.requests("PUT")
+
+
+def test_instrumented_filesystem() -> None:
+    stats = TransferStats()
+    fs = InstrumentedFileSystem(fsspec.filesystem("memory"), stats, "memory://transfer-tests")
+
+    fs.pipe_file("/transfer-tests/a.txt", b"hello")
+    assert fs.cat_file("/transfer-tests/a.txt") == b"hello"
+    assert fs.exists("/transfer-tests/a.txt")
+    fs.ls("/transfer-tests")
+    fs.rm("/transfer-tests", recursive=True)
+
+    totals = stats.totals()
+    assert totals["PUT"] == {"requests": 1, "bytes": 5}
+    assert totals["GET"] == {"requests": 2, "bytes": 5}
+    assert totals["LIST"]["requests"] == 1
+    assert totals["DELETE"]["requests"] == 1
+    # everything else is passed through
+    assert fs.protocol == fsspec.filesystem("memory").protocol
@@ -1,26 +1,37 @@
+import json
 import os
 import datetime
+import tempfile
+from pathlib import Path
 import numpy as np
 import pytest
 import xarray as xr
 
 import icechunk
-import icechunk.xarray as icx
 
+from ice_stream.benchmark import BenchmarkResults, BenchmarkRun, compare, load_results
 from ice_stream.blocks import clean_dataset, select_minimal_variables, upload_single_chunk
-from ice_stream.mock_data_generator import generate_mock_data
+from ice_stream.mock_data_generator import SignalSynthesis, generate_mock_data
+from ice_stream.transfer import counting_store
 from icechunk import (
     ManifestSplitCondition,
     ManifestSplittingConfig,
     ManifestSplitDimCondition,
 )
-from tests.helpers import AzuriteStorageClient, total_sent_bytes, get_test_data_path
+from tests.helpers import BenchmarkStorage, get_test_data_path
 
 
 # Duration of dataset used in tests (in hours) and chunk size (in minutes).
 # These can be overridden via the environment to run longer tests.
 TEST_DATA_DURATION_HOURS = int(os.environ.get("TEST_DATA_DURATION_HOURS", 24))
 CHUNK_DURATION = np.timedelta64(int(os.environ.get("TEST_CHUNK_DURATION_MINUTES", 4 * 60)), "m")
+# Generated mock datasets are reused across runs from this directory.
+MOCK_CACHE = Path(os.environ.get("ICE_STREAM_MOCK_CACHE", Path(tempfile.gettempdir()) / "ice_stream_mock_cache"))
+# Every strategy is recorded in this results file. With a baseline results file,
+# the module fails on metrics worse than the baseline by more than the threshold.
+BENCH_RESULTS = Path(os.environ.get("ICE_STREAM_BENCH_RESULTS", Path("artifacts") / "benchmark_results.json"))
+BENCH_BASELINE = os.environ.get("ICE_STREAM_BENCH_BASELINE")
+BENCH_THRESHOLD = float(os.environ.get("ICE_STREAM_BENCH_THRESHOLD", 0.2))
 COMPRESSOR = {
     "name": "blosc",
     "configuration": {"cname": "zstd", "clevel": 3},
@@ -30,12 +41,21 @@ def _generate_dataset_for_hours(hours: int, minimal: bool, artifacts) -> xr.Data
     """Generate a mock dataset of approximately the requested duration.
 
     Uses the project-wide mock data generator to ensure realistic, randomized
-    samples instead of slicing the seed dataset. The generated NetCDF is placed
-    under the test's artifact directory for inspection.
+    samples instead of slicing the seed dataset. The repetitions are varied by a
+    seeded :class:`SignalSynthesis`, so compression ratios reflect instrument
+    data rather than verbatim copies. The generated Zarr store is placed under
+    the test's artifact directory for inspection, the in-memory dataset is
+    uploaded without reading it back.
     """
     seed = get_test_data_path()
-    out_path = artifacts.path / f"mock_{'min' if minimal else 'full'}_{hours}h.nc"
-    ds = generate_mock_data(seed, out_path, target_duration_hours=float(hours))
+    out_path = artifacts.path / f"mock_{'min' if minimal else 'full'}_{hours}h.zarr"
+    ds = generate_mock_data(
+        seed,
+        out_path,
+        target_duration_hours=float(hours),
+        synthesis=SignalSynthesis(seed=hours),
+        cache_dir=MOCK_CACHE,
+    )
     if minimal:
         ds = select_minimal_variables(ds)
     ds = clean_dataset(ds)
@@ -54,83 +74,76 @@ def _chunk_size_from_duration(ts: np.ndarray, duration: np.timedelta64 = CHUNK_D
     return int(np.ceil(duration / step))
 
 
-def _setup_repo(container: str, prefix: str, repo_config: icechunk.RepositoryConfig | None = None):
-    client = AzuriteStorageClient()
-    client.container_name = container
-    try:
-        client.blob_service_client.delete_container(container)
-    except Exception:
-        pass
-    client.create_container()
-    storage = icechunk.azure_storage(
-        account=os.environ["AZURE_STORAGE_ACCOUNT_NAME"],
-        container=container,
-        prefix=prefix,
-        from_env=True,
-        config={"azure_storage_use_emulator": "true", "azure_allow_http": "true"},
+def _setup_repo(storage_factory, container: str, prefix: str, repo_config: icechunk.RepositoryConfig | None = None):
+    backend = storage_factory(container, prefix)
+    repo = icechunk.Repository.create(backend.storage, config=repo_config) if repo_config else icechunk.Repository.create(backend.storage)
+    return repo, backend
+
+
+@pytest.fixture(scope="module")
+def bench_results():
+    """Results file of the strategies, compared against the baseline once they ran."""
+    results = BenchmarkResults(
+        BENCH_RESULTS,
+        meta={
+            "duration_hours": TEST_DATA_DURATION_HOURS,
+            "chunk_minutes": float(CHUNK_DURATION / np.timedelta64(1, "m")),
+        },
     )
-    repo = icechunk.Repository.create(storage, config=repo_config) if repo_config else icechunk.Repository.create(storage)
-    return repo, client, storage
+    yield results
+    if BENCH_BASELINE:
+        regressions = compare(results.results, load_results(BENCH_BASELINE)["results"], BENCH_THRESHOLD)
+        assert not regressions, f"Regressions beyond {BENCH_THRESHOLD:.0%} against {BENCH_BASELINE}: {regressions}"
+
 
+def _write(ds: xr.Dataset, session: icechunk.Session, run: BenchmarkRun, **kwargs) -> None:
+    """Write *ds* to *session*, counting the requests in the stats of *run*."""
+    # to_icechunk only accepts the session's own store.
+    ds.to_zarr(counting_store(session.store, run.stats, "icechunk"), consolidated=False, **kwargs)
 
-def _log_stats(
+
+def _record(
+    run: BenchmarkRun,
     ds: xr.Dataset,
+    bench_results: BenchmarkResults,
     artifacts,
-    client: AzuriteStorageClient,
-    container: str,
-    prefix: str,
-    start_sent: int,
-    repo: icechunk.Repository | None = None,
-    name: str = "blob_size.txt",
+    backend: BenchmarkStorage,
+    repo: icechunk.Repository,
 ) -> None:
-    used_sent = max(0, total_sent_bytes() - start_sent)
-    container_client = client.blob_service_client.get_container_client(container)
-    total_bytes = sum(blob.size for blob in container_client.list_blobs(name_starts_with=prefix))
-    size_mb = total_bytes / (1024 * 1024)
-    num_timestamps = int(ds.sizes.get("timestamp", 0))
-    var_names = list(ds.data_vars)
-    dims_by_var = {v: {d: int(ds[v].sizes[d]) for d in ds[v].dims} for v in var_names}
-    lines = [f"size_mb: {size_mb:.2f}", f"sent_mb: {used_sent/(1024*1024):.2f}", f"num_timestamps: {num_timestamps}", f"variables: {', '.join(var_names)}", "dims_by_var:"]
-    if repo is not None:
-        ic_total_bytes = repo.total_chunks_storage()
-        lines.insert(0, f"ic_size_mb: {ic_total_bytes / (1024 * 1024):.2f}")
-    for v in var_names:
-        dims_str = ", ".join(f"{d}={dims_by_var[v][d]}" for d in ds[v].dims)
-        lines.append(f"  - {v}: {dims_str}")
-    # New: record data duration and chunk duration per time dimension.
-    durations_hours: dict[str, float] = {}
+    """Record the metrics of *run*, which uploaded *ds*, with the size of the repository."""
+    store_bytes = backend.store_bytes()
+    durations_hours = {}
     for dim in ("timestamp", "high_res_timestamp"):
-        if dim in ds:
-            arr = ds[dim].values
-            if arr.size >= 2:
-                total = arr[-1] - arr[0]
-                durations_hours[dim] = float(total / np.timedelta64(1, "h"))
-            else:
-                durations_hours[dim] = 0.0
-    if durations_hours:
-        lines.append("data_durations_hours:")
-        for dim, dur_h in durations_hours.items():
-            lines.append(f"  - {dim}: {dur_h:.4f}")
-        # CHUNK_DURATION is the configured time window; log it per present time dim.
-        chunk_minutes = float(CHUNK_DURATION / np.timedelta64(1, "m"))
-        lines.append("chunk_durations_minutes:")
-        for dim in durations_hours.keys():
-            lines.append(f"  - {dim}: {chunk_minutes:.0f}")
-    artifacts.save_text(name, "\n".join(lines) + "\n")
-    assert total_bytes > 0
+        if dim in ds.dims:
+            values = ds[dim].values
+            durations_hours[dim] = float((values[-1] - values[0]) / np.timedelta64(1, "h")) if values.size >= 2 else 0.0
+    result = run.result(
+        store_bytes=store_bytes,
+        backend=backend.backend,
+        chunk_bytes=repo.total_chunks_storage(),
+        num_timestamps=int(ds.sizes.get("timestamp", 0)),
+        variables=list(ds.data_vars),
+        data_durations_hours=durations_hours,
+    )
+    # one run per strategy and backend, the in-memory runs measure the CPU cost alone
+    bench_results.record(f"{run.name}[{backend.backend}]", result)
+    artifacts.save_text("benchmark.json", json.dumps(result, indent=2) + "\n")
+    assert store_bytes is None or store_bytes > 0
+    assert result["chunk_bytes"] > 0
 
 
 @pytest.mark.parametrize("minimal", [False, True], ids=["full", "minimal"])
-def test_single_shot_upload(minimal: bool, artifacts) -> None:
+def test_single_shot_upload(minimal: bool, artifacts, bench_results, storage_factory) -> None:
     # Generate dataset with desired duration using the mock generator
     ds_hour = _generate_dataset_for_hours(TEST_DATA_DURATION_HOURS, minimal, artifacts)
 
     container = f"single-shot-{'min' if minimal else 'full'}-container"
     prefix = "single-shot-prefix"
-    repo, client, _ = _setup_repo(container, prefix)
+    repo, backend = _setup_repo(storage_factory, container, prefix)
 
-    start_sent = total_sent_bytes()
-    upload_single_chunk(repo, ds_hour)
+    with BenchmarkRun(f"single_shot_{'minimal' if minimal else 'full'}", ds_hour.nbytes) as run:
+        upload_single_chunk(repo, ds_hour, stats=run.stats)
+        run.commits += 1
 
     # Verify data is actually compressed in the store
     read_s = repo.readonly_session("main")
@@ -141,13 +154,14 @@ def test_single_shot_upload(minimal: bool, artifacts) -> None:
             continue
         compressors = stored[v].encoding.get("compressors") or stored[v].encoding.get("codecs")
         assert compressors is not None and any(
-            isinstance(c, dict) and c.get("name") == "blosc" for c in compressors
+            # zarr 3 returns the codecs as objects
+            (c if isinstance(c, dict) else c.to_dict()).get("name") == "blosc" for c in compressors
         ), f"Variable {v} is not compressed as expected"
 
-    _log_stats(ds_hour, artifacts, client, container, prefix, start_sent, name=f"blob_size_{'min' if minimal else 'full'}.txt")
+    _record(run, ds_hour, bench_results, artifacts, backend, repo)
 
 
-def test_minimal_hour_chunked_upload_incremental(artifacts) -> None:
+def test_minimal_hour_chunked_upload_incremental(artifacts, bench_results, storage_factory) -> None:
     """Upload minimal variables in fixed-size chunks, reopening the repo for each append."""
     ds_hour = _generate_dataset_for_hours(TEST_DATA_DURATION_HOURS, minimal=True, artifacts=artifacts)
 
@@ -165,25 +179,24 @@ def test_minimal_hour_chunked_upload_incremental(artifacts) -> None:
 
     container = "minimal-hour-incremental-container"
     prefix = "minimal-hour-incremental-prefix"
-    repo, client, storage = _setup_repo(container, prefix)
+    repo, backend = _setup_repo(storage_factory, container, prefix)
 
-    start_sent = total_sent_bytes()
+    with BenchmarkRun("incremental", ds_hour.nbytes) as run:
+        first_chunk = ds_hour.isel(timestamp=slice(0, chunk_size))
+        s = repo.writable_session("main")
+        _write(first_chunk, s, run, mode="w", encoding=encoding)
+        run.commit(s, "initial chunk")
 
-    first_chunk = ds_hour.isel(timestamp=slice(0, chunk_size))
-    s = repo.writable_session("main")
-    icx.to_icechunk(first_chunk, s, mode="w", encoding=encoding)
-    s.commit("initial chunk")
-
-    reopened = icechunk.Repository.open(storage)
-    for start in range(chunk_size, aligned_ts, chunk_size):
-        s2 = reopened.writable_session("main")
-        chunk = ds_hour.isel(timestamp=slice(start, start + chunk_size))
-        icx.to_icechunk(chunk, s2, mode="a-", append_dim="timestamp")
-        s2.commit("append chunk")
+        reopened = icechunk.Repository.open(backend.storage)
+        for start in range(chunk_size, aligned_ts, chunk_size):
+            s2 = reopened.writable_session("main")
+            chunk = ds_hour.isel(timestamp=slice(start, start + chunk_size))
+            _write(chunk, s2, run, mode="a-", append_dim="timestamp")
+            run.commit(s2, "append chunk")
 
-    _log_stats(ds_hour, artifacts, client, container, prefix, start_sent, repo, name="blob_size_incremental.txt")
+    _record(run, ds_hour, bench_results, artifacts, backend, repo)
 
-    reopened = icechunk.Repository.open(storage)
+    reopened = icechunk.Repository.open(backend.storage)
     read_s = reopened.readonly_session("main")
     stored = xr.open_zarr(read_s.store, consolidated=False)
     assert stored.sizes["timestamp"] == aligned_ts
@@ -193,7 +206,7 @@ def test_minimal_hour_chunked_upload_incremental(artifacts) -> None:
             assert stored[v].encoding.get("chunks")[0] == chunk_size
 
 
-def test_minimal_hour_chunked_single_manifest_upload_incremental(artifacts) -> None:
+def test_minimal_hour_chunked_single_manifest_upload_incremental(artifacts, bench_results, storage_factory) -> None:
     """Upload minimal variables in fixed-size chunks with manifest splitting."""
     ds_hour = _generate_dataset_for_hours(TEST_DATA_DURATION_HOURS, minimal=True, artifacts=artifacts)
 
@@ -216,28 +229,27 @@ def test_minimal_hour_chunked_single_manifest_upload_incremental(artifacts) -> N
 
     container = "minimal-hour-manifest-container"
     prefix = "minimal-hour-manifest-prefix"
-    repo, client, storage = _setup_repo(container, prefix, repo_config)
+    repo, backend = _setup_repo(storage_factory, container, prefix, repo_config)
 
-    start_sent = total_sent_bytes()
+    with BenchmarkRun("manifest_split", ds_hour.nbytes) as run:
+        first_chunk = ds_hour.isel(timestamp=slice(0, chunk_size))
+        s = repo.writable_session("main")
+        _write(first_chunk, s, run, mode="w", encoding=encoding)
+        run.commit(s, "initial chunk")
 
-    first_chunk = ds_hour.isel(timestamp=slice(0, chunk_size))
-    s = repo.writable_session("main")
-    icx.to_icechunk(first_chunk, s, mode="w", encoding=encoding)
-    s.commit("initial chunk")
-
-    reopened = icechunk.Repository.open(storage, config=repo_config)
-    for start in range(chunk_size, aligned_ts, chunk_size):
-        s2 = reopened.writable_session("main")
-        chunk = ds_hour.isel(timestamp=slice(start, start + chunk_size))
-        icx.to_icechunk(chunk, s2, mode="a-", append_dim="timestamp")
-        s2.commit("append chunk")
+        reopened = icechunk.Repository.open(backend.storage, config=repo_config)
+        for start in range(chunk_size, aligned_ts, chunk_size):
+            s2 = reopened.writable_session("main")
+            chunk = ds_hour.isel(timestamp=slice(start, start + chunk_size))
+            _write(chunk, s2, run, mode="a-", append_dim="timestamp")
+            run.commit(s2, "append chunk")
 
-    repo.expire_snapshots(older_than=datetime.datetime.now(tz=datetime.UTC))
-    repo.garbage_collect(datetime.datetime.now(tz=datetime.UTC))
+        repo.expire_snapshots(older_than=datetime.datetime.now(tz=datetime.UTC))
+        repo.garbage_collect(datetime.datetime.now(tz=datetime.UTC))
 
-    _log_stats(ds_hour, artifacts, client, container, prefix, start_sent, repo, name="blob_size_incremental.txt")
+    _record(run, ds_hour, bench_results, artifacts, backend, repo)
 
-    reopened = icechunk.Repository.open(storage)
+    reopened = icechunk.Repository.open(backend.storage)
     read_s = reopened.readonly_session("main")
     stored = xr.open_zarr(read_s.store, consolidated=False)
     assert stored.sizes["timestamp"] == aligned_ts
@@ -247,7 +259,7 @@ def test_minimal_hour_chunked_single_manifest_upload_incremental(artifacts) -> N
             assert stored[v].encoding.get("chunks")[0] == chunk_size
 
 
-def test_full_dataset_high_freq_chunked_upload(artifacts) -> None:
+def test_full_dataset_high_freq_chunked_upload(artifacts, bench_results, storage_factory) -> None:
     """Upload full dataset including high-frequency variables in chunks."""
     ds_hour = _generate_dataset_for_hours(TEST_DATA_DURATION_HOURS, minimal=False, artifacts=artifacts)
 
@@ -274,39 +286,38 @@ def test_full_dataset_high_freq_chunked_upload(artifacts) -> None:
 
     container = "full-highfreq-incremental-container"
     prefix = "full-highfreq-incremental-prefix"
-    repo, client, storage = _setup_repo(container, prefix)
-
-    start_sent = total_sent_bytes()
-
-    first_chunk = ds_hour.isel(timestamp=slice(0, chunk_size), high_res_timestamp=slice(0, hr_chunk_size))
-    s = repo.writable_session("main")
-    icx.to_icechunk(first_chunk, s, mode="w", encoding=encoding)
-    s.commit("initial chunk")
-
-    reopened = icechunk.Repository.open(storage)
-    num_chunks = max(total_ts // chunk_size, total_hr // hr_chunk_size)
-    for i in range(1, num_chunks):
-        ts_start = i * chunk_size
-        hr_start = i * hr_chunk_size
-        s2 = reopened.writable_session("main")
-        # Only include variables that depend on the low-frequency timestamp
-        chunk_low = ds_hour.isel(timestamp=slice(ts_start, ts_start + chunk_size)).drop_dims(
-            "high_res_timestamp", errors="ignore"
-        )
-        if chunk_low.sizes.get("timestamp", 0) > 0:
-            icx.to_icechunk(chunk_low, s2, mode="a-", append_dim="timestamp")
-        # Likewise, isolate high-frequency variables when appending along
-        # the high_res_timestamp dimension
-        chunk_high = ds_hour.isel(high_res_timestamp=slice(hr_start, hr_start + hr_chunk_size)).drop_dims(
-            "timestamp", errors="ignore"
-        )
-        if chunk_high.sizes.get("high_res_timestamp", 0) > 0:
-            icx.to_icechunk(chunk_high, s2, mode="a-", append_dim="high_res_timestamp")
-        s2.commit("append chunk")
-
-    _log_stats(ds_hour, artifacts, client, container, prefix, start_sent, repo, name="blob_size_full_highfreq.txt")
-
-    reopened = icechunk.Repository.open(storage)
+    repo, backend = _setup_repo(storage_factory, container, prefix)
+
+    with BenchmarkRun("high_freq", ds_hour.nbytes) as run:
+        first_chunk = ds_hour.isel(timestamp=slice(0, chunk_size), high_res_timestamp=slice(0, hr_chunk_size))
+        s = repo.writable_session("main")
+        _write(first_chunk, s, run, mode="w", encoding=encoding)
+        run.commit(s, "initial chunk")
+
+        reopened = icechunk.Repository.open(backend.storage)
+        num_chunks = max(total_ts // chunk_size, total_hr // hr_chunk_size)
+        for i in range(1, num_chunks):
+            ts_start = i * chunk_size
+            hr_start = i * hr_chunk_size
+            s2 = reopened.writable_session("main")
+            # Only include variables that depend on the low-frequency timestamp
+            chunk_low = ds_hour.isel(timestamp=slice(ts_start, ts_start + chunk_size)).drop_dims(
+                "high_res_timestamp", errors="ignore"
+            )
+            if chunk_low.sizes.get("timestamp", 0) > 0:
+                _write(chunk_low, s2, run, mode="a-", append_dim="timestamp")
+            # Likewise, isolate high-frequency variables when appending along
+            # the high_res_timestamp dimension
+            chunk_high = ds_hour.isel(high_res_timestamp=slice(hr_start, hr_start + hr_chunk_size)).drop_dims(
+                "timestamp", errors="ignore"
+            )
+            if chunk_high.sizes.get("high_res_timestamp", 0) > 0:
+                _write(chunk_high, s2, run, mode="a-", append_dim="high_res_timestamp")
+            run.commit(s2, "append chunk")
+
+    _record(run, ds_hour, bench_results, artifacts, backend, repo)
+
+    reopened = icechunk.Repository.open(backend.storage)
     read_s = reopened.readonly_session("main")
     stored = xr.open_zarr(read_s.store, consolidated=False)
     assert stored.sizes["timestamp"] == total_ts
@@ -317,15 +328,13 @@ def test_full_dataset_high_freq_chunked_upload(artifacts) -> None:
             assert v in stored.data_vars
 
 
-def test_minimal_hour_timed_single_manifest_upload_incremental(artifacts) -> None:
+def test_minimal_hour_timed_single_manifest_upload_incremental(artifacts, bench_results, storage_factory) -> None:
     """Upload minimal variables in configurable time increments."""
     ds_hour = _generate_dataset_for_hours(TEST_DATA_DURATION_HOURS, minimal=True, artifacts=artifacts)
 
     container = "minimal-hour-timed-container"
     prefix = "minimal-hour-timed-prefix"
-    repo, client, storage = _setup_repo(container, prefix)
-
-    start_sent = total_sent_bytes()
+    repo, backend = _setup_repo(storage_factory, container, prefix)
 
     ts = ds_hour["timestamp"].values
     step = CHUNK_DURATION
@@ -336,34 +345,35 @@ def test_minimal_hour_timed_single_manifest_upload_incremental(artifacts) -> Non
     first_end_idx = int(np.searchsorted(ts, first_end, side="right"))
     first_chunk = ds_hour.isel(timestamp=slice(0, first_end_idx))
 
-    s = repo.writable_session("main")
-    # Ensure compression is applied on first write by passing encoding.
-    encoding = {}
-    for name in first_chunk.variables:
-        dtype = getattr(first_chunk[name].dtype, "kind", None)
-        if dtype not in {"O", "S"}:
-            encoding[name] = {"compressors": [COMPRESSOR]}
-    icx.to_icechunk(first_chunk, s, mode="w", encoding=encoding)
-    s.commit("initial window")
-
-    reopened = icechunk.Repository.open(storage)
-    cur_start = first_end
-    while cur_start < t_last:
-        cur_end = cur_start + step
-        if cur_end > t_last:
-            cur_end = t_last
-        start_idx = int(np.searchsorted(ts, cur_start, side="right"))
-        end_idx = int(np.searchsorted(ts, cur_end, side="right"))
-        if end_idx > start_idx:
-            chunk = ds_hour.isel(timestamp=slice(start_idx, end_idx))
-            s2 = reopened.writable_session("main")
-            icx.to_icechunk(chunk, s2, mode="a-", append_dim="timestamp")
-            s2.commit("append window")
-        cur_start = cur_end
-
-    _log_stats(ds_hour, artifacts, client, container, prefix, start_sent, repo, name="blob_size_incremental.txt")
-
-    reopened = icechunk.Repository.open(storage)
+    with BenchmarkRun("timed_window", ds_hour.nbytes) as run:
+        s = repo.writable_session("main")
+        # Ensure compression is applied on first write by passing encoding.
+        encoding = {}
+        for name in first_chunk.variables:
+            dtype = getattr(first_chunk[name].dtype, "kind", None)
+            if dtype not in {"O", "S"}:
+                encoding[name] = {"compressors": [COMPRESSOR]}
+        _write(first_chunk, s, run, mode="w", encoding=encoding)
+        run.commit(s, "initial window")
+
+        reopened = icechunk.Repository.open(backend.storage)
+        cur_start = first_end
+        while cur_start < t_last:
+            cur_end = cur_start + step
+            if cur_end > t_last:
+                cur_end = t_last
+            start_idx = int(np.searchsorted(ts, cur_start, side="right"))
+            end_idx = int(np.searchsorted(ts, cur_end, side="right"))
+            if end_idx > start_idx:
+                chunk = ds_hour.isel(timestamp=slice(start_idx, end_idx))
+                s2 = reopened.writable_session("main")
+                _write(chunk, s2, run, mode="a-", append_dim="timestamp")
+                run.commit(s2, "append window")
+            cur_start = cur_end
+
+    _record(run, ds_hour, bench_results, artifacts, backend, repo)
+
+    reopened = icechunk.Repository.open(backend.storage)
     read_s = reopened.readonly_session("main")
     stored = xr.open_zarr(read_s.store, consolidated=False)
     assert stored.sizes["timestamp"] == ds_hour.sizes["timestamp"]